@@ -0,0 +1,147 @@
+"""Compare the throughput of the agent execution modes and pipelines.
+
+Sync and async execution of the staged (master -> expert -> email drafter) and
+fused (single LLM call) pipelines. The LLM is replaced by the fake LLM answering
+after a fixed latency, so the numbers reflect how many runs a single process
+keeps in flight, not watsonx speed. `app.agent.loadtest` measures the whole
+API instead.
+Runs are persisted to the configured Postgres database and removed afterwards.
+
+With `--cassette` the runs get the answers and latencies of watsonx calls
+recorded before with `--record` (see `app.agent.cassette`), and with
+`--zero-latency` only the pipeline's own overhead is left.
+
+    python -m app.agent.benchmark --runs 100 --latency 0.5 --pipelines staged fused
+    python -m app.agent.benchmark --runs 20 --modes sync --cassette bench.jsonl.gz --record
+    python -m app.agent.benchmark --runs 100 --cassette bench.jsonl.gz --zero-latency
+"""
+
+import argparse
+import asyncio
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlmodel import Session, col, delete
+
+from app.agent import langgraph
+from app.agent.cassette import get_cassette
+from app.agent.checkpoint import aclose_checkpointer
+from app.agent.fake_llm import FakeChatModel
+from app.core.config import settings
+from app.core.db import async_engine, engine
+from app.tables import AgentRun
+
+MAIL = (
+    "Subject: Krankengeld\n"
+    "Body: Wann überweist die Krankenkasse das Krankengeld auf mein Konto?\n"
+    "Sender: max.mustermann@example.com"
+)
+
+# Default size of the anyio threadpool that runs sync background tasks
+THREADPOOL_SIZE = 40
+
+
+def create_runs(count: int) -> list[uuid.UUID]:
+    with Session(engine) as session:
+        runs = [
+            AgentRun(
+                mail_sender="benchmark@example.com",
+                mail_subject="Benchmark",
+                mail_body=MAIL,
+                status="running",
+                status_message="Agent processing started",
+                draft_body="",
+                draft_subject="",
+            )
+            for _ in range(count)
+        ]
+        session.add_all(runs)
+        session.commit()
+        return [run.id for run in runs]
+
+
+def delete_runs(run_ids: list[uuid.UUID]) -> None:
+    with Session(engine) as session:
+        session.execute(delete(AgentRun).where(col(AgentRun.id).in_(run_ids)))
+        session.commit()
+
+
+def run_sync(run_ids: list[uuid.UUID], pipeline: str) -> None:
+    def run(run_id: uuid.UUID) -> None:
+        with Session(engine) as session:
+            langgraph.run_graph(MAIL, session, run_id, pipeline)
+
+    with ThreadPoolExecutor(max_workers=THREADPOOL_SIZE) as executor:
+        list(executor.map(run, run_ids))
+
+
+async def run_async(run_ids: list[uuid.UUID], pipeline: str) -> None:
+    await asyncio.gather(
+        *(langgraph.arun_graph(MAIL, run_id, pipeline) for run_id in run_ids)
+    )
+    await aclose_checkpointer()
+    await async_engine.dispose()
+
+
+def benchmark(mode: str, pipeline: str, runs: int) -> float:
+    run_ids = create_runs(runs)
+    try:
+        start_time = time.perf_counter()
+        if mode == "async":
+            asyncio.run(run_async(run_ids, pipeline))
+        else:
+            run_sync(run_ids, pipeline)
+        return runs / (time.perf_counter() - start_time)
+    finally:
+        delete_runs(run_ids)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument(
+        "--modes", nargs="+", choices=["sync", "async"], default=["sync", "async"]
+    )
+    parser.add_argument(
+        "--pipelines", nargs="+", choices=["staged", "fused"], default=["staged"]
+    )
+    parser.add_argument("--cassette", help="Replay the LLM calls of this cassette")
+    parser.add_argument(
+        "--record", action="store_true", help="Record watsonx calls into --cassette"
+    )
+    parser.add_argument(
+        "--zero-latency", action="store_true", help="Replay without waiting"
+    )
+    args = parser.parse_args()
+
+    if args.cassette:
+        settings.LLM_CASSETTE_MODE = "record" if args.record else "replay"
+        settings.LLM_CASSETTE_PATH = args.cassette
+        settings.LLM_CASSETTE_LATENCY = "zero" if args.zero_latency else "recorded"
+        langgraph.llm = langgraph.chat_model(settings.LLM_MODEL_LARGE)
+        langgraph.small_llm = langgraph.chat_model(settings.LLM_MODEL_SMALL)
+        langgraph.expert_llms.clear()
+    else:
+        langgraph.llm = langgraph.small_llm = FakeChatModel(latency=args.latency)
+
+    results = {
+        (mode, pipeline): benchmark(mode, pipeline, args.runs)
+        for pipeline in args.pipelines
+        for mode in args.modes
+    }
+    get_cassette().close()
+    for (mode, pipeline), runs_per_second in results.items():
+        print(f"{mode:>5} {pipeline:>6}: {runs_per_second:.2f} runs/s")
+    baseline = next(iter(results))
+    for key, runs_per_second in results.items():
+        if key != baseline:
+            print(
+                f"{' '.join(key)} speedup over {' '.join(baseline)}: "
+                f"{runs_per_second / results[baseline]:.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
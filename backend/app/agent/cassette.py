@@ -0,0 +1,293 @@
+"""Record the LLM calls of the agents and replay them, for repeatable benchmarks.
+
+With LLM_CASSETTE_MODE=record every call of the chat models is appended to the
+cassette at LLM_CASSETTE_PATH: a hash of the model, the messages and the call
+parameters, the answer and when each of its chunks arrived. With
+LLM_CASSETTE_MODE=replay the models answer from the cassette instead, as slow
+as the recorded calls (LLM_CASSETTE_LATENCY=recorded) or at once (zero), so
+runs of the same mails see identical answers and timings, and the remaining
+time is the pipeline's own Python and database overhead.
+
+One JSON line per call, gzip compressed if the path ends with `.gz`. Failed
+calls are not recorded, their retry is. Of the calls with the same request in
+flight together, like a hedged request and its duplicate, only the first
+answer is recorded. Calls with the same request are replayed in the order
+they were recorded, starting over once all were served.
+
+    LLM_CASSETTE_MODE=record LLM_CASSETTE_PATH=traffic.jsonl.gz fastapi run
+    python -m app.agent.benchmark --cassette traffic.jsonl.gz --zero-latency
+"""
+
+import asyncio
+import atexit
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections.abc import AsyncIterator, Iterator
+from dataclasses import dataclass
+from typing import IO, Any
+
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+
+from app.core.config import settings
+
+
+class CassetteMiss(LookupError):
+    """The cassette holds no call with the request."""
+
+
+def request_key(model_id: str, messages: list[BaseMessage], **kwargs: Any) -> str:
+    """Hash of everything the answer to a call depends on."""
+    request = {
+        "model": model_id,
+        "messages": [[message.type, message.content] for message in messages],
+        "params": kwargs,
+    }
+    encoded = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()[:32]
+
+
+def open_cassette(path: str, mode: str) -> IO[str]:
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class Cassette:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._file: IO[str] | None = None
+        # Recorded calls by request key, loaded on the first replay
+        self._calls: dict[str, list[dict[str, Any]]] | None = None
+        self._replayed: dict[str, int] = {}
+
+    def record(self, call: dict[str, Any]) -> None:
+        line = json.dumps(call, ensure_ascii=False, default=str)
+        with self._lock:
+            if not self._file:
+                self._file = open_cassette(self.path, "a")
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        """Finish the recording, a gzip cassette is unreadable until closed."""
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def _load(self) -> dict[str, list[dict[str, Any]]]:
+        calls: dict[str, list[dict[str, Any]]] = {}
+        with open_cassette(self.path, "r") as file:
+            for line in file:
+                call = json.loads(line)
+                calls.setdefault(call["key"], []).append(call)
+        return calls
+
+    def replay(self, key: str) -> dict[str, Any]:
+        """The next recorded call with the request `key`."""
+        with self._lock:
+            if self._calls is None:
+                self._calls = self._load()
+            calls = self._calls.get(key)
+            if not calls:
+                raise CassetteMiss(f"No call with request {key} in {self.path}")
+            index = self._replayed.get(key, 0)
+            self._replayed[key] = index + 1
+            return calls[index % len(calls)]
+
+
+_cassette: Cassette | None = None
+
+
+def get_cassette() -> Cassette:
+    """The cassette at LLM_CASSETTE_PATH, shared by all chat models."""
+    global _cassette
+    if not _cassette:
+        _cassette = Cassette(settings.LLM_CASSETTE_PATH)
+        atexit.register(_cassette.close)
+    return _cassette
+
+
+@dataclass
+class Flight:
+    """Calls with the same request in flight together."""
+
+    calls: int = 0
+    recorded: bool = False
+
+
+class RecordingChatModel:
+    """Records the calls of `chat`, the model `model_id`, into `cassette`."""
+
+    def __init__(self, model_id: str, chat: Any, cassette: Cassette) -> None:
+        self.chat = chat
+        # Calls are keyed by the configured model, replayed whatever served them
+        self.recorded_model_id = model_id
+        self.model_id = chat.model_id
+        self.cassette = cassette
+        self._lock = threading.Lock()
+        self._flights: dict[str, Flight] = {}
+
+    def _start(self, messages: list[BaseMessage], kwargs: dict[str, Any]) -> str:
+        key = request_key(self.recorded_model_id, messages, **kwargs)
+        with self._lock:
+            self._flights.setdefault(key, Flight()).calls += 1
+        return key
+
+    def _finish(
+        self,
+        key: str,
+        chunks: list[tuple[float, str]],
+        response: AIMessage | AIMessageChunk | None,
+    ) -> None:
+        """Record the answer of a call, None if it failed.
+
+        Only the first answer of the calls in flight with it is recorded.
+        """
+        with self._lock:
+            flight = self._flights[key]
+            flight.calls -= 1
+            if not flight.calls:
+                del self._flights[key]
+            if response is None or flight.recorded:
+                return
+            flight.recorded = True
+        if not chunks:
+            chunks = [(0.0, "")]
+        self.cassette.record(
+            {
+                "key": key,
+                "model": self.model_id,
+                "chunks": [[round(offset, 4), content] for offset, content in chunks],
+                "response_metadata": response.response_metadata,
+                "usage_metadata": response.usage_metadata,
+            }
+        )
+
+    def invoke(self, messages: list[BaseMessage], **kwargs) -> AIMessage:
+        key = self._start(messages, kwargs)
+        start_time = time.perf_counter()
+        try:
+            response = self.chat.invoke(messages, **kwargs)
+        except BaseException:
+            self._finish(key, [], None)
+            raise
+        chunks = [(time.perf_counter() - start_time, response.content)]
+        self._finish(key, chunks, response)
+        return response
+
+    async def ainvoke(self, messages: list[BaseMessage], **kwargs) -> AIMessage:
+        key = self._start(messages, kwargs)
+        start_time = time.perf_counter()
+        try:
+            response = await self.chat.ainvoke(messages, **kwargs)
+        except BaseException:
+            self._finish(key, [], None)
+            raise
+        chunks = [(time.perf_counter() - start_time, response.content)]
+        self._finish(key, chunks, response)
+        return response
+
+    def stream(self, messages: list[BaseMessage], **kwargs) -> Iterator[AIMessageChunk]:
+        key = self._start(messages, kwargs)
+        start_time = time.perf_counter()
+        chunks = []
+        response = AIMessageChunk(content="")
+        finished = False
+        try:
+            for chunk in self.chat.stream(messages, **kwargs):
+                chunks.append((time.perf_counter() - start_time, chunk.content))
+                response += chunk
+                yield chunk
+            finished = True
+        finally:
+            self._finish(key, chunks, response if finished else None)
+
+    async def astream(
+        self, messages: list[BaseMessage], **kwargs
+    ) -> AsyncIterator[AIMessageChunk]:
+        key = self._start(messages, kwargs)
+        start_time = time.perf_counter()
+        chunks = []
+        response = AIMessageChunk(content="")
+        finished = False
+        try:
+            async for chunk in self.chat.astream(messages, **kwargs):
+                chunks.append((time.perf_counter() - start_time, chunk.content))
+                response += chunk
+                yield chunk
+            finished = True
+        finally:
+            self._finish(key, chunks, response if finished else None)
+
+
+class ReplayChatModel:
+    """Answers the calls of the model `model_id` from `cassette`.
+
+    With `latency` each chunk arrives as long after the call started as it
+    did when it was recorded, otherwise everything arrives at once.
+    """
+
+    def __init__(self, model_id: str, cassette: Cassette, latency: bool) -> None:
+        self.model_id = model_id
+        self.cassette = cassette
+        self.latency = latency
+
+    def _replay(self, messages: list[BaseMessage], kwargs: dict[str, Any]) -> dict:
+        return self.cassette.replay(request_key(self.model_id, messages, **kwargs))
+
+    def _answer(self, call: dict[str, Any]) -> AIMessage:
+        return AIMessage(
+            content="".join(content for _, content in call["chunks"]),
+            response_metadata=call["response_metadata"],
+            usage_metadata=call["usage_metadata"],
+        )
+
+    def _chunks(self, call: dict[str, Any]) -> Iterator[tuple[float, AIMessageChunk]]:
+        """The chunks of the answer with their offsets, the last carries the usage."""
+        *chunks, (last_offset, last_content) = call["chunks"]
+        for offset, content in chunks:
+            yield offset, AIMessageChunk(content=content)
+        yield (
+            last_offset,
+            AIMessageChunk(
+                content=last_content,
+                response_metadata=call["response_metadata"],
+                usage_metadata=call["usage_metadata"],
+            ),
+        )
+
+    def _seconds(self, call: dict[str, Any]) -> float:
+        return call["chunks"][-1][0] if self.latency else 0
+
+    def invoke(self, messages: list[BaseMessage], **kwargs) -> AIMessage:
+        call = self._replay(messages, kwargs)
+        time.sleep(self._seconds(call))
+        return self._answer(call)
+
+    async def ainvoke(self, messages: list[BaseMessage], **kwargs) -> AIMessage:
+        call = self._replay(messages, kwargs)
+        await asyncio.sleep(self._seconds(call))
+        return self._answer(call)
+
+    def stream(self, messages: list[BaseMessage], **kwargs) -> Iterator[AIMessageChunk]:
+        call = self._replay(messages, kwargs)
+        start_time = time.perf_counter()
+        for offset, chunk in self._chunks(call):
+            if self.latency:
+                time.sleep(max(0, offset - (time.perf_counter() - start_time)))
+            yield chunk
+
+    async def astream(
+        self, messages: list[BaseMessage], **kwargs
+    ) -> AsyncIterator[AIMessageChunk]:
+        call = self._replay(messages, kwargs)
+        start_time = time.perf_counter()
+        for offset, chunk in self._chunks(call):
+            if self.latency:
+                await asyncio.sleep(max(0, offset - (time.perf_counter() - start_time)))
+            yield chunk
@@ -0,0 +1,99 @@
+"""Postgres checkpoints of the agent graphs, so interrupted runs resume.
+
+With AGENT_CHECKPOINTING the graphs save their `State` after each node, with
+the run's id as thread. A run executed again, because its worker crashed, its
+job was requeued or it was resumed with `POST /agent/{run_id}/resume`,
+continues after its last completed node instead of repeating the LLM calls
+before it. The checkpoints of a run are deleted once it completed.
+
+The session and write-behind buffer of a run are not part of the state, the
+nodes get them as `RunContext`. The tables belong to langgraph-checkpoint-
+postgres, `setup_checkpoints` creates and migrates them and Alembic ignores
+them.
+"""
+
+import asyncio
+
+from langgraph.checkpoint.postgres import PostgresSaver
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool, ConnectionPool
+from sqlalchemy import make_url
+
+from app.core.config import settings
+
+CHECKPOINT_TABLES = (
+    "checkpoints",
+    "checkpoint_blobs",
+    "checkpoint_writes",
+    "checkpoint_migrations",
+)
+
+# psycopg takes the URL without the SQLAlchemy dialect
+CONNINFO = (
+    make_url(str(settings.SQLALCHEMY_DATABASE_URI))
+    .set(drivername="postgresql")
+    .render_as_string(hide_password=False)
+)
+# Connections as the savers expect them
+CONNECTION_KWARGS = {
+    "autocommit": True,
+    "prepare_threshold": 0,
+    "row_factory": dict_row,
+}
+
+# A saver runs one query at a time behind a lock, so every run gets a saver of
+# its own and the runs share the connections of the pool
+pool = ConnectionPool(
+    CONNINFO,
+    min_size=1,
+    max_size=settings.AGENT_CHECKPOINT_POOL_SIZE,
+    kwargs=CONNECTION_KWARGS,
+    open=False,
+)
+# Pools of the async graphs by the event loop their connections belong to
+_async_pools: dict[asyncio.AbstractEventLoop, AsyncConnectionPool] = {}
+
+
+def get_checkpointer() -> PostgresSaver:
+    """A saver for a sync graph run, the pool is opened on first use."""
+    pool.open()
+    return PostgresSaver(pool)
+
+
+async def aget_checkpointer() -> AsyncPostgresSaver:
+    """A saver for an async graph run on the running event loop.
+
+    Async connections belong to the loop that opened them, so each loop gets
+    a pool on first use. The owner of the loop closes it with
+    `aclose_checkpointer` before the loop ends.
+    """
+    loop = asyncio.get_running_loop()
+    for closed_loop in [other for other in _async_pools if other.is_closed()]:
+        # Its connections cannot be closed without their loop
+        del _async_pools[closed_loop]
+        print("⚠️  Checkpoint pool of a closed event loop was not closed")
+    if loop not in _async_pools:
+        async_pool = AsyncConnectionPool(
+            CONNINFO,
+            min_size=1,
+            max_size=settings.AGENT_CHECKPOINT_POOL_SIZE,
+            kwargs=CONNECTION_KWARGS,
+            open=False,
+        )
+        await async_pool.open()
+        _async_pools[loop] = async_pool
+    return AsyncPostgresSaver(_async_pools[loop])
+
+
+async def aclose_checkpointer() -> None:
+    """Close the pool of the running event loop, if it has one."""
+    async_pool = _async_pools.pop(asyncio.get_running_loop(), None)
+    if async_pool:
+        await async_pool.close()
+
+
+def setup_checkpoints() -> None:
+    """Create or migrate the checkpoint tables."""
+    with PostgresSaver.from_conn_string(CONNINFO) as saver:
+        saver.setup()
@@ -0,0 +1,254 @@
+"""Local routing classifier that answers the master agent's decision without an LLM call.
+
+A TF-IDF + softmax regression model, trained from the routing decisions the
+master agent already stored as `master_agent` steps:
+
+    python -m app.agent.classifier --output routing_classifier.npz
+
+Set ROUTING_CLASSIFIER_PATH to the output file to enable the fast path. Mails
+the model is not confident about (ROUTING_CLASSIFIER_THRESHOLD) still go
+through the LLM.
+"""
+
+import argparse
+import re
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+from sqlmodel import Session, select
+
+from app.core.config import settings
+from app.core.db import engine
+from app.tables import AgentRun, Step
+
+TOKEN_PATTERN = re.compile(r"\w\w+")
+# Only decisions of the LLM, so the classifier never trains on its own output
+ROUTING_STEP_PATTERN = re.compile(r"^Routed request to (\w+) expert agent$")
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercased words and word bigrams."""
+    words = TOKEN_PATTERN.findall(text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:], strict=False)]
+
+
+def softmax(logits: np.ndarray) -> np.ndarray:
+    exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+class RoutingClassifier:
+    def __init__(
+        self,
+        vocabulary: list[str],
+        idf: np.ndarray,
+        weights: np.ndarray,
+        bias: np.ndarray,
+        classes: list[str],
+    ) -> None:
+        self.vocabulary = {token: index for index, token in enumerate(vocabulary)}
+        self.idf = idf
+        self.weights = weights
+        self.bias = bias
+        self.classes = classes
+
+    def features(self, text: str) -> tuple[np.ndarray, np.ndarray]:
+        """Sparse L2-normalized TF-IDF vector of `text` as (indices, values)."""
+        counts = Counter(
+            self.vocabulary[token]
+            for token in tokenize(text)
+            if token in self.vocabulary
+        )
+        indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        values *= self.idf[indices]
+        norm = np.linalg.norm(values)
+        if norm > 0:
+            values /= norm
+        return indices, values
+
+    def probabilities(self, text: str) -> np.ndarray:
+        """Probability of each class in `self.classes` for `text`."""
+        indices, values = self.features(text)
+        return softmax(values @ self.weights[indices] + self.bias)
+
+    def predict(self, text: str) -> tuple[str, float]:
+        """Most likely expert agent for `text` and its probability."""
+        probabilities = self.probabilities(text)
+        best = int(probabilities.argmax())
+        return self.classes[best], float(probabilities[best])
+
+    def rank(self, text: str) -> list[tuple[str, float]]:
+        """All expert agents for `text`, most likely first."""
+        probabilities = self.probabilities(text)
+        return [
+            (self.classes[index], float(probabilities[index]))
+            for index in np.argsort(-probabilities)
+        ]
+
+    @classmethod
+    def train(
+        cls,
+        texts: list[str],
+        labels: list[str],
+        max_features: int = 20000,
+        min_df: int = 2,
+        epochs: int = 300,
+        learning_rate: float = 10.0,
+        l2: float = 1e-4,
+    ) -> "RoutingClassifier":
+        """Fit the vocabulary, IDF weights and a softmax regression on the texts."""
+        tokenized = [tokenize(text) for text in texts]
+        document_frequency = Counter(
+            token for tokens in tokenized for token in set(tokens)
+        )
+        vocabulary = [
+            token
+            for token, count in document_frequency.most_common(max_features)
+            if count >= min_df
+        ]
+        idf = np.array(
+            [
+                np.log((1 + len(texts)) / (1 + document_frequency[token])) + 1
+                for token in vocabulary
+            ],
+            dtype=np.float32,
+        )
+        classes = sorted(set(labels))
+        model = cls(
+            vocabulary,
+            idf,
+            np.zeros((len(vocabulary), len(classes)), dtype=np.float32),
+            np.zeros(len(classes), dtype=np.float32),
+            classes,
+        )
+
+        # Sparse design matrix in coordinate format
+        rows, columns, values = [], [], []
+        for row, text in enumerate(texts):
+            indices, row_values = model.features(text)
+            rows.append(np.full(len(indices), row))
+            columns.append(indices)
+            values.append(row_values)
+        rows, columns, values = (
+            np.concatenate(rows),
+            np.concatenate(columns),
+            np.concatenate(values),
+        )
+        targets = np.zeros((len(texts), len(classes)), dtype=np.float32)
+        targets[np.arange(len(texts)), [classes.index(label) for label in labels]] = 1
+
+        # Full batch gradient descent on the mean cross entropy
+        for _ in range(epochs):
+            logits = np.tile(model.bias, (len(texts), 1))
+            np.add.at(logits, rows, values[:, None] * model.weights[columns])
+            gradient = (softmax(logits) - targets) / len(texts)
+            weights_gradient = l2 * model.weights
+            np.add.at(weights_gradient, columns, values[:, None] * gradient[rows])
+            model.weights -= learning_rate * weights_gradient
+            model.bias -= learning_rate * gradient.sum(axis=0)
+
+        return model
+
+    def save(self, path: str) -> None:
+        np.savez(
+            path,
+            vocabulary=np.array(list(self.vocabulary)),
+            idf=self.idf,
+            weights=self.weights,
+            bias=self.bias,
+            classes=np.array(self.classes),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "RoutingClassifier":
+        with np.load(path) as data:
+            return cls(
+                data["vocabulary"].tolist(),
+                data["idf"],
+                data["weights"],
+                data["bias"],
+                data["classes"].tolist(),
+            )
+
+
+@lru_cache
+def get_routing_classifier() -> RoutingClassifier | None:
+    if not settings.ROUTING_CLASSIFIER_PATH:
+        return None
+    try:
+        return RoutingClassifier.load(settings.ROUTING_CLASSIFIER_PATH)
+    except FileNotFoundError:
+        print(
+            f"⚠️  Routing classifier '{settings.ROUTING_CLASSIFIER_PATH}' not found, routing with the LLM"
+        )
+        return None
+
+
+def route_with_classifier(mail: str) -> str | None:
+    """Expert agent for `mail` if the local classifier is confident enough."""
+    classifier = get_routing_classifier()
+    if not classifier:
+        return None
+
+    expert_agent, confidence = classifier.predict(mail)
+    if confidence < settings.ROUTING_CLASSIFIER_THRESHOLD:
+        return None
+
+    print(
+        f"⚡ Local classifier routed to '{expert_agent}' (confidence {confidence:.2f})"
+    )
+    return expert_agent
+
+
+def load_training_data(session: Session) -> tuple[list[str], list[str]]:
+    """Mails and the expert agent the LLM routed them to."""
+    # Imported here, the graph module imports this one
+    from app.agent.langgraph import format_mail
+
+    statement = (
+        select(AgentRun, Step.text)
+        .join(Step)
+        .where(Step.type == "master_agent", Step.status == "completed")
+    )
+    texts, labels = [], []
+    for agent_run, step_text in session.exec(statement):
+        match = ROUTING_STEP_PATTERN.match(step_text)
+        if match:
+            texts.append(
+                format_mail(
+                    agent_run.mail_subject, agent_run.mail_body, agent_run.mail_sender
+                )
+            )
+            labels.append(match.group(1))
+    return texts, labels
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Train the routing classifier")
+    parser.add_argument("--output", default="routing_classifier.npz")
+    parser.add_argument("--epochs", type=int, default=300)
+    args = parser.parse_args()
+
+    with Session(engine) as session:
+        texts, labels = load_training_data(session)
+    if len(set(labels)) < 2:
+        raise SystemExit("Need routing decisions for at least two expert agents")
+
+    classifier = RoutingClassifier.train(texts, labels, epochs=args.epochs)
+    accuracy = np.mean(
+        [
+            classifier.predict(text)[0] == label
+            for text, label in zip(texts, labels, strict=True)
+        ]
+    )
+    classifier.save(args.output)
+    print(
+        f"Trained on {len(texts)} routing decisions, {len(classifier.vocabulary)} features, "
+        f"training accuracy {accuracy:.2%}, saved to {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""Declarative registry of the expert agents.
+
+Each entry configures one expert node of the graph: its prompt, how it is
+described to the router, and the model and budgets of its LLM calls, so token
+budgets and models can be tuned per category without touching the nodes.
+"""
+
+from dataclasses import dataclass
+from typing import Any
+
+from langchain_core.messages import SystemMessage
+
+
+@dataclass(frozen=True)
+class Expert:
+    icon: str
+    label: str
+    # What the master agent routes to this expert
+    description: str
+    running_text: str
+    completed_text: str
+    system_message: SystemMessage
+    # Substrings of mails likely meant for this expert, used for speculation
+    # when no routing classifier is trained
+    keywords: tuple[str, ...] = ()
+    # "small" or "large" model (`LLM_MODEL_SMALL`, `LLM_MODEL_LARGE`), an
+    # unusable analysis of the small one is redone by the large one
+    tier: str = "large"
+    # Replaces the model of the tier, without escalation
+    model_id: str | None = None
+    max_tokens: int = 2000
+    temperature: float | None = None
+    # Seconds watsonx may spend generating before it stops, None for no limit
+    timeout: float | None = None
+
+    def chat_params(self) -> dict[str, Any]:
+        """Per-request parameters of the expert's LLM calls."""
+        params = {"max_tokens": self.max_tokens, "temperature": self.temperature}
+        if self.timeout:
+            params["time_limit"] = int(self.timeout * 1000)
+        return {key: value for key, value in params.items() if value is not None}
+
+
+# Expert agents by graph node name. Each expert node creates a step of type
+# "<name>_expert", analyzes the request with its system message and hands the
+# analysis over to the email drafter.
+EXPERTS: dict[str, Expert] = {
+    "zuzahlung": Expert(
+        icon="💰",
+        label="Zuzahlung",
+        description="Für Fragen zu Zuzahlungen, Eigenanteilen, Befreiungen",
+        running_text="Analyzing co-payment related inquiry",
+        completed_text="Completed analysis of co-payment inquiry",
+        keywords=("zuzahlung", "eigenanteil", "befreiung", "belastungsgrenze"),
+        system_message=SystemMessage(
+            content="""Du bist ein Experte für Zuzahlungen bei einer deutschen Krankenkasse.
+        Analysiere die Kundenanfrage und sammle wichtige Informationen und Überlegungen zu:
+        - Zuzahlungen bei Medikamenten, Hilfsmitteln, Therapien
+        - Eigenanteilen und deren Berechnung
+        - Zuzahlungsbefreiungen und deren Beantragung
+        - Belastungsgrenzen und jährlichen Höchstbeträgen
+        - Quittungen und Nachweisen für Zuzahlungen
+
+        Erstelle KEINE direkte Antwort an den Kunden, sondern sammle alle relevanten Informationen, 
+        wichtige Punkte und Überlegungen, die für die finale E-Mail-Antwort wichtig sind.
+        Strukturiere deine Analyse klar und präzise."""
+        ),
+    ),
+    "familienversicherung": Expert(
+        icon="👨‍👩‍👧‍👦",
+        label="Familienversicherung",
+        description="Für Fragen zur Familienversicherung, Mitversicherung von Angehörigen",
+        running_text="Analyzing family insurance inquiry",
+        completed_text="Completed analysis of family insurance inquiry",
+        keywords=("familienversicherung", "mitversicher", "ehepartner", "kinder"),
+        system_message=SystemMessage(
+            content="""Du bist ein Experte für Familienversicherung bei einer deutschen Krankenkasse.
+        Analysiere die Kundenanfrage und sammle wichtige Informationen und Überlegungen zu:
+        - Mitversicherung von Ehepartnern und Kindern
+        - Voraussetzungen für die Familienversicherung
+        - Einkommensgrenzen und deren Überschreitung
+        - Anmeldung und Abmeldung von Familienmitgliedern
+        - Übergang zwischen Familienversicherung und eigener Versicherung
+
+        Erstelle KEINE direkte Antwort an den Kunden, sondern sammle alle relevanten Informationen, 
+        wichtige Punkte und Überlegungen, die für die finale E-Mail-Antwort wichtig sind.
+        Strukturiere deine Analyse klar und präzise."""
+        ),
+    ),
+    "pflegeversicherung": Expert(
+        icon="🏥",
+        label="Pflegeversicherung",
+        description="Für Fragen zur Pflegeversicherung, Pflegegraden, Leistungen",
+        running_text="Analyzing care insurance inquiry",
+        completed_text="Completed analysis of care insurance inquiry",
+        keywords=("pflege", "pflegegrad", "pflegegeld"),
+        system_message=SystemMessage(
+            content="""Du bist ein Experte für Pflegeversicherung bei einer deutschen Krankenkasse.
+        Analysiere die Kundenanfrage und sammle wichtige Informationen und Überlegungen zu:
+        - Pflegegraden und deren Beantragung
+        - Leistungen der Pflegeversicherung
+        - Pflegegeld und Pflegesachleistungen
+        - Kombination von Geld- und Sachleistungen
+        - Verhinderungspflege und Kurzzeitpflege
+        - Pflegehilfsmitteln und Wohnraumanpassungen
+
+        Erstelle KEINE direkte Antwort an den Kunden, sondern sammle alle relevanten Informationen, 
+        wichtige Punkte und Überlegungen, die für die finale E-Mail-Antwort wichtig sind.
+        Strukturiere deine Analyse klar und präzise."""
+        ),
+    ),
+    "krankengeld": Expert(
+        icon="🤒",
+        label="Krankengeld",
+        description="Für Fragen zum Krankengeld, Arbeitsunfähigkeit, Lohnfortzahlung",
+        running_text="Analyzing sick pay inquiry",
+        completed_text="Completed analysis of sick pay inquiry",
+        keywords=("krankengeld", "arbeitsunfähig", "krankschreibung"),
+        system_message=SystemMessage(
+            content="""Du bist ein Experte für Krankengeld bei einer deutschen Krankenkasse.
+        Analysiere die Kundenanfrage und sammle wichtige Informationen und Überlegungen zu:
+        - Krankengeld-Anträgen und deren Bearbeitung
+        - Arbeitsunfähigkeitsbescheinigungen
+        - Höhe und Berechnung des Krankengeldes
+        - Dauer der Krankengeld-Zahlung
+        - Übergang von Lohnfortzahlung zu Krankengeld
+        - Wiedereingliederungsmaßnahmen
+
+        Erstelle KEINE direkte Antwort an den Kunden, sondern sammle alle relevanten Informationen, 
+        wichtige Punkte und Überlegungen, die für die finale E-Mail-Antwort wichtig sind.
+        Strukturiere deine Analyse klar und präzise."""
+        ),
+    ),
+    "kostenuebernahme": Expert(
+        icon="💳",
+        label="Kostenübernahme",
+        description="Für Kostenübernahme-Anträge, Erstattungen, Privatrechnungen",
+        running_text="Analyzing cost coverage inquiry",
+        completed_text="Completed analysis of cost coverage inquiry",
+        keywords=("kostenübernahme", "erstattung", "rechnung", "kosten"),
+        system_message=SystemMessage(
+            content="""Du bist ein Experte für Kostenübernahme und Erstattungen bei einer deutschen Krankenkasse.
+        Analysiere die Kundenanfrage und sammle wichtige Informationen und Überlegungen zu:
+        - Kostenübernahme-Anträgen für Behandlungen und Therapien
+        - Erstattung von Privatrechnungen und Notfallbehandlungen
+        - Genehmigungsverfahren für teure Behandlungen
+        - Kostenvoranschläge und deren Prüfung
+        - Auslandsbehandlungen und deren Erstattung
+        - Hilfsmittel-Kostenübernahme
+        - Zweitmeinungsverfahren
+
+        Erstelle KEINE direkte Antwort an den Kunden, sondern sammle alle relevanten Informationen, 
+        wichtige Punkte und Überlegungen, die für die finale E-Mail-Antwort wichtig sind.
+        Strukturiere deine Analyse klar und präzise."""
+        ),
+    ),
+    "widerspruch": Expert(
+        icon="⚖️",
+        label="Widerspruch",
+        description="Für Widersprüche gegen Ablehnungsbescheide, Rechtsmittel",
+        running_text="Analyzing appeals and objections inquiry",
+        completed_text="Completed analysis of appeals and objections inquiry",
+        keywords=("widerspruch", "ablehnung", "bescheid", "abgelehnt"),
+        # Objections need the legal reasoning in full
+        max_tokens=4000,
+        system_message=SystemMessage(
+            content="""Du bist ein Experte für Widersprüche und Rechtsmittel bei einer deutschen Krankenkasse.
+        Analysiere die Kundenanfrage und sammle wichtige Informationen und Überlegungen zu:
+        - Widerspruchsverfahren gegen Ablehnungsbescheide
+        - Fristen für Widersprüche und deren Einhaltung
+        - Erforderliche Unterlagen und Begründungen
+        - Widerspruchsausschüsse und deren Verfahren
+        - Sozialgerichtsverfahren als nächste Instanz
+        - Einstweilige Anordnungen bei dringenden Fällen
+        - Rechtsbeistand und Beratung
+
+        Erstelle KEINE direkte Antwort an den Kunden, sondern sammle alle relevanten Informationen, 
+        wichtige Punkte und Überlegungen, die für die finale E-Mail-Antwort wichtig sind.
+        Strukturiere deine Analyse klar und präzise."""
+        ),
+    ),
+    "mutterschaft": Expert(
+        icon="🤱",
+        label="Mutterschaft",
+        description="Für Schwangerschaft, Mutterschaftsgeld, Vorsorgeuntersuchungen",
+        running_text="Analyzing maternity and pregnancy inquiry",
+        completed_text="Completed analysis of maternity and pregnancy inquiry",
+        keywords=("schwanger", "mutterschaft", "geburt", "hebamme"),
+        system_message=SystemMessage(
+            content="""Du bist ein Experte für Mutterschaft und Schwangerschaft bei einer deutschen Krankenkasse.
+        Analysiere die Kundenanfrage und sammle wichtige Informationen und Überlegungen zu:
+        - Vorsorgeuntersuchungen während der Schwangerschaft
+        - Mutterschaftsgeld und dessen Beantragung
+        - Hebammenleistungen und deren Abrechnung
+        - Geburtsvorbereitungskurse und Rückbildungsgymnastik
+        - Zusätzliche Leistungen für Schwangere
+        - Mutterschutzfristen und Elternzeit
+        - Familienversicherung für Neugeborene
+
+        Erstelle KEINE direkte Antwort an den Kunden, sondern sammle alle relevanten Informationen, 
+        wichtige Punkte und Überlegungen, die für die finale E-Mail-Antwort wichtig sind.
+        Strukturiere deine Analyse klar und präzise."""
+        ),
+    ),
+    "rehabilitation": Expert(
+        icon="🏃‍♂️",
+        label="Rehabilitation",
+        description="Für Reha-Maßnahmen, Kuren, medizinische Rehabilitation",
+        running_text="Analyzing rehabilitation inquiry",
+        completed_text="Completed analysis of rehabilitation inquiry",
+        keywords=("reha", "kur", "rehabilitation"),
+        system_message=SystemMessage(
+            content="""Du bist ein Experte für Rehabilitation und Kuren bei einer deutschen Krankenkasse.
+        Analysiere die Kundenanfrage und sammle wichtige Informationen und Überlegungen zu:
+        - Rehabilitationsmaßnahmen und deren Beantragung
+        - Medizinische Voraussetzungen für Reha-Maßnahmen
+        - Ambulante vs. stationäre Rehabilitation
+        - Anschlussheilbehandlungen (AHB)
+        - Präventionsmaßnahmen und Kuren
+        - Reha-Einrichtungen und deren Auswahl
+        - Zuzahlungen bei Reha-Maßnahmen
+        - Nachsorge und Reha-Sport
+
+        Erstelle KEINE direkte Antwort an den Kunden, sondern sammle alle relevanten Informationen, 
+        wichtige Punkte und Überlegungen, die für die finale E-Mail-Antwort wichtig sind.
+        Strukturiere deine Analyse klar und präzise."""
+        ),
+    ),
+    "terminvermittlung": Expert(
+        icon="📅",
+        label="Terminvermittlung",
+        description="Für Terminanfragen, Beratungstermine, Facharzttermine, Wartezeiten",
+        running_text="Analyzing appointment scheduling inquiry",
+        completed_text="Completed analysis of appointment scheduling inquiry",
+        keywords=("termin", "facharzt", "wartezeit"),
+        tier="small",
+        # Appointment requests only need a few facts
+        max_tokens=800,
+        system_message=SystemMessage(
+            content="""Du bist ein Experte für Terminvermittlung und Beratungstermine bei einer deutschen Krankenkasse.
+        Analysiere die Kundenanfrage und sammle wichtige Informationen und Überlegungen zu:
+        - Terminvereinbarungen für Beratungsgespräche
+        - Facharzttermine und Terminservicestelle
+        - Beschwerden über lange Wartezeiten
+        - Dringende Terminvermittlung bei akuten Beschwerden
+        - Zweitmeinungstermine
+        - Telefonische vs. persönliche Beratungstermine
+        - Sprechstunden und Öffnungszeiten
+        - Online-Terminbuchung und digitale Services
+
+        Erstelle KEINE direkte Antwort an den Kunden, sondern sammle alle relevanten Informationen, 
+        wichtige Punkte und Überlegungen, die für die finale E-Mail-Antwort wichtig sind.
+        Strukturiere deine Analyse klar und präzise."""
+        ),
+    ),
+    "sonstiges": Expert(
+        icon="📋",
+        label="Sonstiges",
+        description="Für alle anderen Anfragen (Versichertenkarte, Bankdaten ändern, etc.)",
+        running_text="Analyzing general inquiry",
+        completed_text="Completed analysis of general inquiry",
+        keywords=("versichertenkarte", "bankverbindung", "adresse", "umzug"),
+        max_tokens=1000,
+        system_message=SystemMessage(
+            content="""Du bist ein Allgemein-Experte für eine deutsche Krankenkasse.
+        Analysiere die Kundenanfrage und sammle wichtige Informationen und Überlegungen zu:
+        - Verlorene oder defekte Versichertenkarten
+        - Kontaktdaten und Bankverbindung ändern
+        - Allgemeine Informationen zur Krankenversicherung
+        - Umzug und Kassenwechsel
+        - Bonusprogramme und Zusatzleistungen
+        - Mitgliedschaft und Beiträge
+        - Bescheinigungen und Nachweise
+
+        Erstelle KEINE direkte Antwort an den Kunden, sondern sammle alle relevanten Informationen, 
+        wichtige Punkte und Überlegungen, die für die finale E-Mail-Antwort wichtig sind.
+        Strukturiere deine Analyse klar und präzise."""
+        ),
+    ),
+}
+
+# Routing options listed in the master and fused prompts
+EXPERT_DESCRIPTIONS = "\n".join(
+    f"- {name}: {expert.description}" for name, expert in EXPERTS.items()
+)
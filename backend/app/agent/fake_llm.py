@@ -0,0 +1,181 @@
+"""Stand-in for `ChatWatsonx` to run and load-test the agents without watsonx.
+
+Set LLM_FAKE=true and the graph uses `FakeChatModel` for every stage. Answers
+depend only on the prompt: the master agent routes by the keywords of the
+expert registry, the experts, the email drafter and the fused call answer with
+fixed German texts in the expected format. Each call waits for a log-normally
+distributed time to the first token and then for its answer tokens at a fixed
+rate, and a share of calls fails with a `ConnectionError` like a dropped
+connection. Latencies and failures are drawn from a seeded generator, so a
+sequential run is reproducible.
+"""
+
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+from collections.abc import AsyncIterator, Iterator
+
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+
+from app.agent.experts import EXPERTS
+from app.agent.token_budget import CHARS_PER_TOKEN, count_prompt_tokens, count_tokens
+from app.core.config import settings
+
+ANALYSIS = (
+    "Relevante Punkte: Anliegen des Versicherten prüfen, Leistungsanspruch nach "
+    "SGB V klären, fehlende Unterlagen anfordern und nächste Schritte benennen."
+)
+DRAFT = (
+    "Sehr geehrte Damen und Herren,\n\n"
+    "vielen Dank für Ihre Anfrage. Wir haben Ihr Anliegen geprüft und melden "
+    "uns mit allen Details innerhalb von fünf Werktagen bei Ihnen. Bitte "
+    "senden Sie uns bis dahin die fehlenden Unterlagen zu.\n\n"
+    "Bei Fragen erreichen Sie uns telefonisch unter 0800 123456.\n\n"
+    "Mit freundlichen Grüßen\n"
+    "Ihre Krankenkasse"
+)
+
+
+class FakeChatModel:
+    def __init__(
+        self,
+        latency: float = 0.5,
+        latency_sigma: float = 0.0,
+        tokens_per_second: float = 0,
+        error_rate: float = 0.0,
+        seed: int = 0,
+        model_id: str = "fake",
+    ) -> None:
+        # Recorded as the model of the steps, like the watsonx model id
+        self.model_id = model_id
+        # Median seconds to the first token and the log-normal spread around it
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        # Answer tokens per second after the first one, 0 answers at once
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, model_id: str = "fake") -> "FakeChatModel":
+        return cls(
+            model_id=f"fake:{model_id}",
+            latency=settings.LLM_FAKE_LATENCY,
+            latency_sigma=settings.LLM_FAKE_LATENCY_SIGMA,
+            tokens_per_second=settings.LLM_FAKE_TOKENS_PER_SECOND,
+            error_rate=settings.LLM_FAKE_ERROR_RATE,
+            seed=settings.LLM_FAKE_SEED,
+        )
+
+    def _content(self, messages: list[BaseMessage]) -> str:
+        # Imported here, the graph module creates its models with this one
+        from app.agent import langgraph
+
+        if messages[0] is langgraph.MASTER_SYSTEM_MESSAGE:
+            return route_by_keywords(messages[-1].content)
+        if messages[0] is langgraph.FUSED_SYSTEM_MESSAGE:
+            return json.dumps(
+                {
+                    "category": route_by_keywords(messages[-1].content),
+                    "analysis": ANALYSIS,
+                    "draft": DRAFT,
+                },
+                ensure_ascii=False,
+            )
+        if any(messages[0] is expert.system_message for expert in EXPERTS.values()):
+            return ANALYSIS
+        return DRAFT
+
+    def _answer(self, messages: list[BaseMessage], **kwargs) -> AIMessage:
+        """The answer, cut off at `max_tokens` like a real model."""
+        content = self._content(messages)
+        finish_reason = "stop"
+        max_tokens = kwargs.get("max_tokens")
+        if max_tokens and count_tokens(content) > max_tokens:
+            content = content[: max_tokens * CHARS_PER_TOKEN]
+            finish_reason = "length"
+        prompt_tokens = count_prompt_tokens(messages)
+        completion_tokens = count_tokens(content)
+        return AIMessage(
+            content=content,
+            response_metadata={"finish_reason": finish_reason},
+            usage_metadata={
+                "input_tokens": prompt_tokens,
+                "output_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        )
+
+    def _first_token_delay(self) -> float:
+        """Seconds to the first token, raises the injected failures."""
+        with self._lock:
+            failed = self._random.random() < self.error_rate
+            delay = (
+                self._random.lognormvariate(math.log(self.latency), self.latency_sigma)
+                if self.latency > 0
+                else 0
+            )
+        if failed:
+            raise ConnectionError("Injected failure of the fake LLM")
+        return delay
+
+    def _token_delay(self, text: str) -> float:
+        if not self.tokens_per_second:
+            return 0
+        return count_tokens(text) / self.tokens_per_second
+
+    def _chunks(self, answer: AIMessage) -> list[AIMessageChunk]:
+        """The answer word by word, the last chunk carries the usage."""
+        words = answer.content.split(" ")
+        chunks = [AIMessageChunk(content=f"{word} ") for word in words[:-1]]
+        chunks.append(
+            AIMessageChunk(
+                content=words[-1],
+                response_metadata=answer.response_metadata,
+                usage_metadata=answer.usage_metadata,
+            )
+        )
+        return chunks
+
+    def invoke(self, messages: list[BaseMessage], **kwargs) -> AIMessage:
+        answer = self._answer(messages, **kwargs)
+        time.sleep(self._first_token_delay() + self._token_delay(answer.content))
+        return answer
+
+    async def ainvoke(self, messages: list[BaseMessage], **kwargs) -> AIMessage:
+        answer = self._answer(messages, **kwargs)
+        await asyncio.sleep(
+            self._first_token_delay() + self._token_delay(answer.content)
+        )
+        return answer
+
+    def stream(self, messages: list[BaseMessage], **kwargs) -> Iterator[AIMessageChunk]:
+        answer = self._answer(messages, **kwargs)
+        time.sleep(self._first_token_delay())
+        for chunk in self._chunks(answer):
+            yield chunk
+            time.sleep(self._token_delay(chunk.content))
+
+    async def astream(
+        self, messages: list[BaseMessage], **kwargs
+    ) -> AsyncIterator[AIMessageChunk]:
+        answer = self._answer(messages, **kwargs)
+        await asyncio.sleep(self._first_token_delay())
+        for chunk in self._chunks(answer):
+            yield chunk
+            await asyncio.sleep(self._token_delay(chunk.content))
+
+
+def route_by_keywords(mail: str) -> str:
+    """The expert whose registry keywords occur most often in `mail`."""
+    text = mail.lower()
+    hits = {
+        name: sum(text.count(keyword) for keyword in expert.keywords)
+        for name, expert in EXPERTS.items()
+    }
+    best = max(hits, key=hits.__getitem__)
+    return best if hits[best] else "sonstiges"
@@ -1,16 +1,66 @@
-import logging
+import asyncio
+import inspect
+import threading
+import time
 import uuid
-from typing import Annotated, Literal
-
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Annotated, Any, Literal, Protocol
+
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    BaseMessage,
+    BaseMessageChunk,
+    HumanMessage,
+    SystemMessage,
+)
+from langchain_core.runnables import RunnableConfig
 from langchain_ibm import ChatWatsonx
 from langgraph.graph import END, START, StateGraph
 from langgraph.graph.message import add_messages
+from langgraph.runtime import Runtime
+from pydantic import BaseModel, ValidationError
+from sqlalchemy.orm import selectinload
 from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing_extensions import TypedDict
 
+from app.agent.cassette import RecordingChatModel, ReplayChatModel, get_cassette
+from app.agent.checkpoint import aget_checkpointer, get_checkpointer
+from app.agent.classifier import route_with_classifier
+from app.agent.experts import EXPERT_DESCRIPTIONS, EXPERTS, Expert
+from app.agent.fake_llm import FakeChatModel
+from app.agent.run_events import publish_token
+from app.agent.run_lease import hold_leases
+from app.agent.run_state import RunState, track, untrack
+from app.agent.semantic_router import aroute_with_embeddings, route_with_embeddings
+from app.agent.speculation import (
+    cancel_speculation,
+    resolve_speculation,
+    start_speculation,
+)
+from app.agent.token_budget import completion_budget, truncate_tokens, usage
+from app.agent.write_behind import LLMUsage, RunBuffer
+from app.core.config import settings
+from app.core.db import async_engine, engine
+from app.core.metrics import (
+    AGENT_NODE_SECONDS,
+    AGENT_RUNS,
+    AGENT_RUNS_IN_PROGRESS,
+    observe_llm_call,
+)
+from app.services.rate_limit import quota
+from app.services.resilience import (
+    CallPolicy,
+    acall_with_policy,
+    astream_with_policy,
+    call_with_policy,
+    stream_with_policy,
+)
 from app.services.watsonx_provider import WatsonxProvider
-from app.tables import AgentRun, Step
+from app.tables import AgentRun
 
 
 class State(TypedDict):
@@ -20,864 +70,907 @@ class State(TypedDict):
     messages: Annotated[list, add_messages] = []
     next_agent: str
     expert_analysis: str
-    session: Session
+    # Expert whose analysis the master agent already obtained speculatively
+    speculative_expert: str
     agent_run_id: uuid.UUID
 
 
-graph_builder = StateGraph(State)
+@dataclass
+class RunContext:
+    """What the nodes of a run use besides the `State`, which is checkpointed."""
 
-llm = ChatWatsonx(
-    model_id="meta-llama/llama-4-maverick-17b-128e-instruct-fp8",
-    watsonx_client=WatsonxProvider.instance().client,
-    max_tokens=100000,
-)
+    # A sync `Session` for `graph`, an `AsyncSession` for `async_graph`
+    session: Session | AsyncSession
+    # Step and status updates, written once per node by `build_graph`
+    buffer: RunBuffer
 
 
-def create_step(
-    session: Session,
-    agent_run_id: uuid.UUID,
-    step_type: str,
-    text: str,
-    status: str = "completed",
-):
-    """Helper function to create a step in the database."""
-    step = Step(type=step_type, text=text, status=status, agent_run_id=agent_run_id)
-    session.add(step)
-    session.commit()
-    session.refresh(step)
-    return step
+Node = Callable[[State, Runtime[RunContext]], Any]
 
 
-def update_agent_run_status(
-    session: Session, agent_run_id: uuid.UUID, status: str, status_message: str
-):
-    """Helper function to update the agent run status."""
-    agent_run = session.get(AgentRun, agent_run_id)
-    if agent_run:
-        agent_run.status = status
-        agent_run.status_message = status_message
-        session.add(agent_run)
-        session.commit()
-        session.refresh(agent_run)
+class ChatModel(Protocol):
+    """What the agents call of a chat model.
 
+    `ChatWatsonx`, `FakeChatModel` and the cassette models provide it.
+    """
 
-def master_agent(state: State):
-    """Orchestrator agent that decides which expert agent should handle the request."""
-    print("🎯 Master agent called - analyzing request to determine expert agent")
+    @property
+    def model_id(self) -> str | None: ...
 
-    # Create step for master agent
-    create_step(
-        state["session"],
-        state["agent_run_id"],
-        "master_agent",
-        "Analyzing request to determine appropriate expert agent",
-        "running",
-    )
+    def invoke(
+        self, input: list[BaseMessage], /, *args: Any, **kwargs: Any
+    ) -> BaseMessage: ...
 
-    # Update run status
-    update_agent_run_status(
-        state["session"],
-        state["agent_run_id"],
-        "running",
-        "Master agent analyzing request",
-    )
+    async def ainvoke(
+        self, input: list[BaseMessage], /, *args: Any, **kwargs: Any
+    ) -> BaseMessage: ...
 
-    system_message = SystemMessage(
-        content="""Du bist ein Orchestrator-Agent für eine deutsche Krankenkasse. 
-Deine Aufgabe ist es, Kundenanfragen zu analysieren und zu entscheiden, welcher Experten-Agent die Anfrage am besten bearbeiten kann.
+    def stream(
+        self, input: list[BaseMessage], /, *args: Any, **kwargs: Any
+    ) -> Iterator[BaseMessageChunk]: ...
 
+    def astream(
+        self, input: list[BaseMessage], /, *args: Any, **kwargs: Any
+    ) -> AsyncIterator[BaseMessageChunk]: ...
 
 
-Verfügbare Experten-Agenten:
-- zuzahlung: Für Fragen zu Zuzahlungen, Eigenanteilen, Befreiungen
-- familienversicherung: Für Fragen zur Familienversicherung, Mitversicherung von Angehörigen
-- pflegeversicherung: Für Fragen zur Pflegeversicherung, Pflegegraden, Leistungen
-- krankengeld: Für Fragen zum Krankengeld, Arbeitsunfähigkeit, Lohnfortzahlung
-- kostenuebernahme: Für Kostenübernahme-Anträge, Erstattungen, Privatrechnungen
-- widerspruch: Für Widersprüche gegen Ablehnungsbescheide, Rechtsmittel
-- mutterschaft: Für Schwangerschaft, Mutterschaftsgeld, Vorsorgeuntersuchungen
-- rehabilitation: Für Reha-Maßnahmen, Kuren, medizinische Rehabilitation
-- terminvermittlung: Für Terminanfragen, Beratungstermine, Facharzttermine, Wartezeiten
-- sonstiges: Für alle anderen Anfragen (Versichertenkarte, Bankdaten ändern, etc.)
+def chat_model(model_id: str) -> ChatModel:
+    """The watsonx chat model `model_id`, or the fake LLM if LLM_FAKE is set.
 
-Analysiere die Kundenanfrage und antworte NUR mit dem Namen des zuständigen Experten-Agenten.
-Antworte nur mit einem Wort: zuzahlung, familienversicherung, pflegeversicherung, krankengeld, kostenuebernahme, widerspruch, mutterschaft, rehabilitation, terminvermittlung, sonstiges oder email_drafter."""
-    )
-    messages = state["messages"]
-    messages_with_system = [system_message] + messages
-    response = llm.invoke(messages_with_system)
-
-    # Extract the expert agent name from the response
-    expert_agent = response.content.strip().lower()
-
-    # Validate the response and default to "sonstiges" if invalid
-    valid_agents = [
-        "zuzahlung",
-        "familienversicherung",
-        "pflegeversicherung",
-        "krankengeld",
-        "kostenuebernahme",
-        "widerspruch",
-        "mutterschaft",
-        "rehabilitation",
-        "terminvermittlung",
-        "sonstiges",
-        "email_drafter",
-    ]
-    if expert_agent not in valid_agents:
-        print(
-            f"⚠️  Invalid expert agent '{expert_agent}' returned by master agent, defaulting to 'sonstiges'"
+    LLM_CASSETTE_MODE records the calls of the model or replays them instead.
+    """
+    if settings.LLM_CASSETTE_MODE == "replay":
+        return ReplayChatModel(
+            model_id, get_cassette(), settings.LLM_CASSETTE_LATENCY == "recorded"
         )
-        expert_agent = "sonstiges"
-
-    print(f"✅ Master agent decision: routing to '{expert_agent}' expert")
+    chat: ChatModel
+    if settings.LLM_FAKE:
+        chat = FakeChatModel.from_settings(model_id)
+    else:
+        # Chat models of the same model share its inference and connections
+        chat = ChatWatsonx(
+            watsonx_model=WatsonxProvider.instance().get_model_inference(model_id)
+        )
+    if settings.LLM_CASSETTE_MODE == "record":
+        return RecordingChatModel(model_id, chat, get_cassette())
+    return chat
+
+
+# Chat models of the large and small tier, created on first use: connecting to
+# watsonx takes seconds and importing the graph should neither wait for it nor
+# fail without it. `warm_up` creates them ahead of the first run
+llm: ChatModel | None = None
+small_llm: ChatModel | None = None
+_models_lock = threading.Lock()
+
+# Model tiers from smallest to largest, stages escalate along them
+TIERS = ("small", "large")
+
+# Completion budgets in tokens, the experts configure theirs in `EXPERTS`
+MASTER_MAX_TOKENS = 20
+EMAIL_DRAFTER_MAX_TOKENS = 2000
+FUSED_MAX_TOKENS = 4000
+# Deadlines in seconds, nodes without one use LLM_DEADLINE_SECONDS and the
+# experts configure theirs in `EXPERTS`
+MASTER_DEADLINE = 15.0
+FUSED_DEADLINE = 120.0
+
+# Chat models of experts that configure their own model, by model ID
+expert_llms: dict[str, ChatModel] = {}
+
+
+def tier_llm(tier: str) -> ChatModel:
+    global llm, small_llm
+    if tier == "small":
+        if not small_llm:
+            with _models_lock:
+                small_llm = small_llm or chat_model(settings.LLM_MODEL_SMALL)
+        return small_llm
+    if not llm:
+        with _models_lock:
+            llm = llm or chat_model(settings.LLM_MODEL_LARGE)
+    return llm
+
+
+def escalation(tier: str) -> tuple[str, ...]:
+    """`tier` followed by the larger tiers a stage escalates to."""
+    return TIERS[TIERS.index(tier) :]
+
+
+def expert_tiers(expert: Expert) -> tuple[str, ...]:
+    return (expert.tier,) if expert.model_id else escalation(expert.tier)
+
+
+def expert_llm(expert: Expert, tier: str) -> ChatModel:
+    """The chat model of `expert`, the one of `tier` unless it configures its own."""
+    if not expert.model_id:
+        return tier_llm(tier)
+    if expert.model_id not in expert_llms:
+        with _models_lock:
+            if expert.model_id not in expert_llms:
+                expert_llms[expert.model_id] = chat_model(expert.model_id)
+    return expert_llms[expert.model_id]
+
+
+def warm_up() -> None:
+    """Create the chat models ahead of the first run.
+
+    A failure, e.g. watsonx not being reachable, is only reported, the first
+    run tries again.
+    """
+    start_time = time.perf_counter()
+    try:
+        for tier in TIERS:
+            tier_llm(tier)
+        for expert in EXPERTS.values():
+            if expert.model_id:
+                expert_llm(expert, expert.tier)
+    except Exception as e:
+        print(f"⚠️  Warming up the chat models failed, retrying on first use: {e!r}")
+        return
+    print(f"🔥 Chat models warmed up in {time.perf_counter() - start_time:.2f} seconds")
+
+
+def settle_usage(
+    buffer: RunBuffer,
+    chat: ChatModel,
+    response: AIMessage,
+    seconds: float,
+    prompt_tokens: int,
+    reserved: int,
+) -> None:
+    """Record a call on the current step and refund its unused quota."""
+    prompt_tokens, completion_tokens = usage(response, prompt_tokens)
+    buffer.record_llm_call(chat.model_id, seconds, prompt_tokens, completion_tokens)
+    observe_llm_call(chat.model_id, seconds, prompt_tokens, completion_tokens)
+    quota.refund(reserved - prompt_tokens - completion_tokens)
+
+
+async def asettle_usage(
+    buffer: RunBuffer | LLMUsage,
+    chat: ChatModel,
+    response: AIMessage,
+    seconds: float,
+    prompt_tokens: int,
+    reserved: int,
+) -> None:
+    """Async variant of `settle_usage`."""
+    prompt_tokens, completion_tokens = usage(response, prompt_tokens)
+    buffer.record_llm_call(chat.model_id, seconds, prompt_tokens, completion_tokens)
+    observe_llm_call(chat.model_id, seconds, prompt_tokens, completion_tokens)
+    await quota.arefund(reserved - prompt_tokens - completion_tokens)
+
+
+def invoke_llm(
+    chat: ChatModel,
+    messages: list,
+    buffer: RunBuffer,
+    node: str,
+    max_tokens: int,
+    deadline: float | None = None,
+    **kwargs: Any,
+) -> AIMessage:
+    """`chat.invoke` within the token budget and the deadline of `node`.
+
+    Transient failures are retried and slow calls hedged, the usage is
+    recorded on the run and the quota it reserved but did not use refunded.
+    """
+    prompt_tokens, max_tokens = completion_budget(messages, max_tokens)
+    start_time = time.perf_counter()
+    response = call_with_policy(
+        node,
+        lambda: chat.invoke(messages, max_tokens=max_tokens, **kwargs),
+        CallPolicy.default(deadline, prompt_tokens + max_tokens),
+    )
+    seconds = time.perf_counter() - start_time
+    settle_usage(
+        buffer, chat, response, seconds, prompt_tokens, prompt_tokens + max_tokens
+    )
+    return response
+
+
+async def ainvoke_llm(
+    chat: ChatModel,
+    messages: list,
+    buffer: RunBuffer | LLMUsage,
+    node: str,
+    max_tokens: int,
+    deadline: float | None = None,
+    **kwargs: Any,
+) -> AIMessage:
+    """Async variant of `invoke_llm`."""
+    prompt_tokens, max_tokens = completion_budget(messages, max_tokens)
+    start_time = time.perf_counter()
+    response = await acall_with_policy(
+        node,
+        lambda: chat.ainvoke(messages, max_tokens=max_tokens, **kwargs),
+        CallPolicy.default(deadline, prompt_tokens + max_tokens),
+    )
+    seconds = time.perf_counter() - start_time
+    await asettle_usage(
+        buffer, chat, response, seconds, prompt_tokens, prompt_tokens + max_tokens
+    )
+    return response
 
-    # Update step status to completed
-    # Get the most recent step for this agent run
-    steps = (
-        state["session"]
-        .query(Step)
-        .filter(Step.agent_run_id == state["agent_run_id"], Step.type == "master_agent")
-        .order_by(Step.id.desc())
-        .first()
-    )
-    if steps:
-        steps.status = "completed"
-        steps.text = f"Routed request to {expert_agent} expert agent"
-        state["session"].add(steps)
-        state["session"].commit()
 
-    return {
-        "next_agent": expert_agent,
-    }
+MASTER_SYSTEM_MESSAGE = SystemMessage(
+    content=f"""Du bist ein Orchestrator-Agent für eine deutsche Krankenkasse. 
+Deine Aufgabe ist es, Kundenanfragen zu analysieren und zu entscheiden, welcher Experten-Agent die Anfrage am besten bearbeiten kann.
 
 
-def zuzahlung_expert(state: State):
-    """Expert agent for co-payment related inquiries."""
-    print("💰 Zuzahlung expert agent called")
 
-    # Create step for this expert agent
-    create_step(
-        state["session"],
-        state["agent_run_id"],
-        "zuzahlung_expert",
-        "Analyzing co-payment related inquiry",
-        "running",
-    )
+Verfügbare Experten-Agenten:
+{EXPERT_DESCRIPTIONS}
 
-    # Update run status
-    update_agent_run_status(
-        state["session"],
-        state["agent_run_id"],
-        "running",
-        "Zuzahlung expert analyzing request",
-    )
+Analysiere die Kundenanfrage und antworte NUR mit dem Namen des zuständigen Experten-Agenten.
+Antworte nur mit einem Wort: zuzahlung, familienversicherung, pflegeversicherung, krankengeld, kostenuebernahme, widerspruch, mutterschaft, rehabilitation, terminvermittlung, sonstiges oder email_drafter."""
+)
 
-    system_message = SystemMessage(
-        content="""Du bist ein Experte für Zuzahlungen bei einer deutschen Krankenkasse.
-        Analysiere die Kundenanfrage und sammle wichtige Informationen und Überlegungen zu:
-        - Zuzahlungen bei Medikamenten, Hilfsmitteln, Therapien
-        - Eigenanteilen und deren Berechnung
-        - Zuzahlungsbefreiungen und deren Beantragung
-        - Belastungsgrenzen und jährlichen Höchstbeträgen
-        - Quittungen und Nachweisen für Zuzahlungen
+# Valid routing decisions of the master agent
+VALID_AGENTS = [
+    "zuzahlung",
+    "familienversicherung",
+    "pflegeversicherung",
+    "krankengeld",
+    "kostenuebernahme",
+    "widerspruch",
+    "mutterschaft",
+    "rehabilitation",
+    "terminvermittlung",
+    "sonstiges",
+    "email_drafter",
+]
 
-        Erstelle KEINE direkte Antwort an den Kunden, sondern sammle alle relevanten Informationen, 
-        wichtige Punkte und Überlegungen, die für die finale E-Mail-Antwort wichtig sind.
-        Strukturiere deine Analyse klar und präzise."""
-    )
+FUSED_SYSTEM_MESSAGE = SystemMessage(
+    content=f"""Du bist ein Sachbearbeiter einer deutschen Krankenkasse.
+Bearbeite die Kundenanfrage in drei Schritten und antworte ausschließlich mit einem JSON-Objekt.
 
-    messages_with_system = [system_message] + state["messages"]
-    response = llm.invoke(messages_with_system)
+1. "category": Ordne die Anfrage genau einer dieser Kategorien zu:
+{EXPERT_DESCRIPTIONS}
 
-    print("✅ Zuzahlung expert completed analysis")
+2. "analysis": Sammle als Experte dieser Kategorie alle relevanten Informationen, wichtigen Punkte und Überlegungen, die für die E-Mail-Antwort wichtig sind. Strukturiere deine Analyse klar und präzise.
 
-    # Update step to completed
-    steps = (
-        state["session"]
-        .query(Step)
-        .filter(
-            Step.agent_run_id == state["agent_run_id"], Step.type == "zuzahlung_expert"
-        )
-        .order_by(Step.id.desc())
-        .first()
-    )
-    if steps:
-        steps.status = "completed"
-        steps.text = "Completed analysis of co-payment inquiry"
-        state["session"].add(steps)
-        state["session"].commit()
+3. "draft": Verfasse basierend auf deiner Analyse eine vollständige E-Mail-Antwort an den Kunden, die:
+- Professionell und höflich ist
+- Mache klare Ansagen (nicht "in der Regel" oder "meistens" etc)
+- Alle wichtigen Informationen aus der Analyse berücksichtigt
+- Konkrete nächste Schritte aufzeigt
+- Bei Bedarf Kontaktdaten oder weitere Hilfsangebote enthält
+- Vollständig auf Deutsch verfasst ist
 
-    return {
-        "expert_analysis": response.content,
-    }
+Die Mail sollte wenn möglich einem Bestimmten Schema folgen:
+- Anrede (Sehr geehrter Herr/Sehr geehrte Frau)
+- Vielen Dank für Ihre Anfrage (Anfrage nochmal kurz auffassen/zusammenfassen)
+- Antwort auf die Anfrage
+- ggf. Hinweise auf fehlende Unterlagen
+- Nächste Schritte
+- Kontaktdaten
+- Angemessene Grußformel
+- Anhang (falls vorhanden)
 
+Verwende einen empathischen, aber sachlichen Ton.
 
-def familienversicherung_expert(state: State):
-    """Expert agent for family insurance inquiries."""
-    print("👨‍👩‍👧‍👦 Familienversicherung expert agent called")
+Antworte NUR mit diesem JSON-Objekt:
+{{"category": "<Kategorie>", "analysis": "<Analyse>", "draft": "<E-Mail-Antwort>"}}"""
+)
 
-    # Create step for this expert agent
-    create_step(
-        state["session"],
-        state["agent_run_id"],
-        "familienversicherung_expert",
-        "Analyzing family insurance inquiry",
-        "running",
-    )
 
-    # Update run status
-    update_agent_run_status(
-        state["session"],
-        state["agent_run_id"],
-        "running",
-        "Familienversicherung expert analyzing request",
-    )
+class FusedResponse(BaseModel):
+    category: str
+    analysis: str
+    draft: str
 
-    system_message = SystemMessage(
-        content="""Du bist ein Experte für Familienversicherung bei einer deutschen Krankenkasse.
-        Analysiere die Kundenanfrage und sammle wichtige Informationen und Überlegungen zu:
-        - Mitversicherung von Ehepartnern und Kindern
-        - Voraussetzungen für die Familienversicherung
-        - Einkommensgrenzen und deren Überschreitung
-        - Anmeldung und Abmeldung von Familienmitgliedern
-        - Übergang zwischen Familienversicherung und eigener Versicherung
 
-        Erstelle KEINE direkte Antwort an den Kunden, sondern sammle alle relevanten Informationen, 
-        wichtige Punkte und Überlegungen, die für die finale E-Mail-Antwort wichtig sind.
-        Strukturiere deine Analyse klar und präzise."""
-    )
+def match_expert_agent(content: str) -> str | None:
+    """The expert agent named by a master agent response, None if it names none."""
+    expert_agent = content.strip().lower()
+    return expert_agent if expert_agent in VALID_AGENTS else None
 
-    messages_with_system = [system_message] + state["messages"]
-    response = llm.invoke(messages_with_system)
 
-    print("✅ Familienversicherung expert completed analysis")
+def parse_expert_agent(content: str) -> str:
+    """Extract the expert agent name from the master agent response."""
+    expert_agent = match_expert_agent(content)
 
-    # Update step to completed
-    steps = (
-        state["session"]
-        .query(Step)
-        .filter(
-            Step.agent_run_id == state["agent_run_id"],
-            Step.type == "familienversicherung_expert",
+    # Default to "sonstiges" if invalid
+    if not expert_agent:
+        print(
+            f"⚠️  Invalid expert agent '{content.strip()}' returned by master agent, defaulting to 'sonstiges'"
         )
-        .order_by(Step.id.desc())
-        .first()
-    )
-    if steps:
-        steps.status = "completed"
-        steps.text = "Completed analysis of family insurance inquiry"
-        state["session"].add(steps)
-        state["session"].commit()
-
-    return {
-        "expert_analysis": response.content,
-    }
+        expert_agent = "sonstiges"
 
+    print(f"✅ Master agent decision: routing to '{expert_agent}' expert")
+    return expert_agent
 
-def pflegeversicherung_expert(state: State):
-    """Expert agent for care insurance inquiries."""
-    print("🏥 Pflegeversicherung expert agent called")
 
-    # Create step for this expert agent
-    create_step(
-        state["session"],
-        state["agent_run_id"],
-        "pflegeversicherung_expert",
-        "Analyzing care insurance inquiry",
-        "running",
+def is_usable_analysis(response: AIMessage) -> bool:
+    """Whether an expert analysis is neither empty nor cut off at `max_tokens`."""
+    return (
+        bool(response.content.strip())
+        and response.response_metadata.get("finish_reason") != "length"
     )
 
-    # Update run status
-    update_agent_run_status(
-        state["session"],
-        state["agent_run_id"],
-        "running",
-        "Pflegeversicherung expert analyzing request",
-    )
 
-    system_message = SystemMessage(
-        content="""Du bist ein Experte für Pflegeversicherung bei einer deutschen Krankenkasse.
-        Analysiere die Kundenanfrage und sammle wichtige Informationen und Überlegungen zu:
-        - Pflegegraden und deren Beantragung
-        - Leistungen der Pflegeversicherung
-        - Pflegegeld und Pflegesachleistungen
-        - Kombination von Geld- und Sachleistungen
-        - Verhinderungspflege und Kurzzeitpflege
-        - Pflegehilfsmitteln und Wohnraumanpassungen
+def routed_text(expert_agent: str, tier: str) -> str:
+    step_text = f"Routed request to {expert_agent} expert agent"
+    if tier != settings.AGENT_ROUTING_TIER:
+        step_text += f" (escalated to {tier} model)"
+    return step_text
+
+
+def route_with_llm(messages: list, buffer: RunBuffer) -> tuple[str, str]:
+    """Route with the LLM of `AGENT_ROUTING_TIER`, escalating on invalid answers.
+
+    Returns the expert agent and the tier that chose it.
+    """
+    messages_with_system = [MASTER_SYSTEM_MESSAGE] + messages
+    *smaller_tiers, largest_tier = escalation(settings.AGENT_ROUTING_TIER)
+    for tier in smaller_tiers:
+        response = invoke_llm(
+            tier_llm(tier),
+            messages_with_system,
+            buffer,
+            f"master:{tier}",
+            MASTER_MAX_TOKENS,
+            MASTER_DEADLINE,
+        )
+        if expert_agent := match_expert_agent(response.content):
+            print(f"✅ Master agent decision: routing to '{expert_agent}' expert")
+            return expert_agent, tier
+        print(
+            f"⚠️  Invalid expert agent '{response.content.strip()}' returned by the {tier} model, escalating"
+        )
 
-        Erstelle KEINE direkte Antwort an den Kunden, sondern sammle alle relevanten Informationen, 
-        wichtige Punkte und Überlegungen, die für die finale E-Mail-Antwort wichtig sind.
-        Strukturiere deine Analyse klar und präzise."""
+    response = invoke_llm(
+        tier_llm(largest_tier),
+        messages_with_system,
+        buffer,
+        f"master:{largest_tier}",
+        MASTER_MAX_TOKENS,
+        MASTER_DEADLINE,
     )
+    return parse_expert_agent(response.content), largest_tier
+
+
+async def aroute_with_llm(messages: list, buffer: RunBuffer) -> tuple[str, str]:
+    """Async variant of `route_with_llm`."""
+    messages_with_system = [MASTER_SYSTEM_MESSAGE] + messages
+    *smaller_tiers, largest_tier = escalation(settings.AGENT_ROUTING_TIER)
+    for tier in smaller_tiers:
+        response = await ainvoke_llm(
+            tier_llm(tier),
+            messages_with_system,
+            buffer,
+            f"master:{tier}",
+            MASTER_MAX_TOKENS,
+            MASTER_DEADLINE,
+        )
+        if expert_agent := match_expert_agent(response.content):
+            print(f"✅ Master agent decision: routing to '{expert_agent}' expert")
+            return expert_agent, tier
+        print(
+            f"⚠️  Invalid expert agent '{response.content.strip()}' returned by the {tier} model, escalating"
+        )
 
-    messages_with_system = [system_message] + state["messages"]
-    response = llm.invoke(messages_with_system)
+    response = await ainvoke_llm(
+        tier_llm(largest_tier),
+        messages_with_system,
+        buffer,
+        f"master:{largest_tier}",
+        MASTER_MAX_TOKENS,
+        MASTER_DEADLINE,
+    )
+    return parse_expert_agent(response.content), largest_tier
+
+
+def analyze_with_expert(name: str, messages: list, buffer: RunBuffer) -> str:
+    """Analysis of the request by the expert agent `name`.
+
+    An unusable analysis of a smaller model is redone by the next larger one.
+    """
+    expert = EXPERTS[name]
+    messages_with_system = [expert.system_message] + messages
+    for tier in expert_tiers(expert):
+        response = invoke_llm(
+            expert_llm(expert, tier),
+            messages_with_system,
+            buffer,
+            f"{name}_expert:{tier}",
+            deadline=expert.timeout,
+            **expert.chat_params(),
+        )
+        if is_usable_analysis(response):
+            break
+        print(f"⚠️  Unusable {name} analysis of the {tier} model, escalating")
+    return response.content
+
+
+async def aanalyze_with_expert(
+    name: str, messages: list, buffer: RunBuffer | LLMUsage
+) -> str:
+    """Async variant of `analyze_with_expert`."""
+    expert = EXPERTS[name]
+    messages_with_system = [expert.system_message] + messages
+    for tier in expert_tiers(expert):
+        response = await ainvoke_llm(
+            expert_llm(expert, tier),
+            messages_with_system,
+            buffer,
+            f"{name}_expert:{tier}",
+            deadline=expert.timeout,
+            **expert.chat_params(),
+        )
+        if is_usable_analysis(response):
+            break
+        print(f"⚠️  Unusable {name} analysis of the {tier} model, escalating")
+    return response.content
+
+
+def parse_fused_response(content: str) -> FusedResponse | None:
+    """Validate the JSON answer of the fused call, None if it is unusable."""
+    content = content.strip().removeprefix("```json").removeprefix("```")
+    content = content.removesuffix("```")
+    try:
+        response = FusedResponse.model_validate_json(content)
+    except ValidationError as e:
+        print(f"⚠️  Invalid fused response, falling back to separate agents: {e}")
+        return None
+
+    response.category = response.category.strip().lower()
+    if response.category not in EXPERTS:
+        print(
+            f"⚠️  Invalid category '{response.category}' in fused response, falling back to separate agents"
+        )
+        return None
+    return response
+
+
+def stream_draft(messages: list, buffer: RunBuffer) -> str:
+    """Generate the draft token by token, publishing each token to SSE clients."""
+    prompt_tokens, max_tokens = completion_budget(messages, EMAIL_DRAFTER_MAX_TOKENS)
+    chat = tier_llm("large")
+    # Adding the chunks sums up the usage watsonx reports on them
+    response = AIMessageChunk(content="")
+    start_time = time.perf_counter()
+    chunks = stream_with_policy(
+        "email_drafter",
+        lambda: chat.stream(messages, max_tokens=max_tokens),
+        CallPolicy.default(tokens=prompt_tokens + max_tokens),
+    )
+    for chunk in chunks:
+        publish_token(buffer.agent_run_id, chunk.content)
+        response += chunk
+    seconds = time.perf_counter() - start_time
+    settle_usage(
+        buffer,
+        chat,
+        response,
+        seconds,
+        prompt_tokens,
+        prompt_tokens + max_tokens,
+    )
+    return response.content
 
-    print("✅ Pflegeversicherung expert completed analysis")
 
-    # Update step to completed
-    steps = (
-        state["session"]
-        .query(Step)
-        .filter(
-            Step.agent_run_id == state["agent_run_id"],
-            Step.type == "pflegeversicherung_expert",
-        )
-        .order_by(Step.id.desc())
-        .first()
+async def astream_draft(messages: list, buffer: RunBuffer) -> str:
+    """Async variant of `stream_draft`."""
+    prompt_tokens, max_tokens = completion_budget(messages, EMAIL_DRAFTER_MAX_TOKENS)
+    chat = tier_llm("large")
+    response = AIMessageChunk(content="")
+    start_time = time.perf_counter()
+    chunks = astream_with_policy(
+        "email_drafter",
+        lambda: chat.astream(messages, max_tokens=max_tokens),
+        CallPolicy.default(tokens=prompt_tokens + max_tokens),
+    )
+    async for chunk in chunks:
+        publish_token(buffer.agent_run_id, chunk.content)
+        response += chunk
+    seconds = time.perf_counter() - start_time
+    await asettle_usage(
+        buffer,
+        chat,
+        response,
+        seconds,
+        prompt_tokens,
+        prompt_tokens + max_tokens,
     )
-    if steps:
-        steps.status = "completed"
-        steps.text = "Completed analysis of care insurance inquiry"
-        state["session"].add(steps)
-        state["session"].commit()
+    return response.content
 
-    return {
-        "expert_analysis": response.content,
-    }
 
+def email_drafter_system_message(state: State) -> SystemMessage:
+    """Build the email drafter prompt from the request and the expert analysis."""
+    # Get the conversation history to understand the context
+    conversation_context = ""
+    for msg in state["messages"]:
+        if hasattr(msg, "content"):
+            conversation_context += f"{msg.content}\n"
 
-def krankengeld_expert(state: State):
-    """Expert agent for sick pay inquiries."""
-    print("🤒 Krankengeld expert agent called")
+    expert_analysis = state.get("expert_analysis", "")
 
-    # Create step for this expert agent
-    create_step(
-        state["session"],
-        state["agent_run_id"],
-        "krankengeld_expert",
-        "Analyzing sick pay inquiry",
-        "running",
-    )
+    return SystemMessage(
+        content=f"""Du bist ein professioneller E-Mail-Verfasser für eine deutsche Krankenkasse.
 
-    # Update run status
-    update_agent_run_status(
-        state["session"],
-        state["agent_run_id"],
-        "running",
-        "Krankengeld expert analyzing request",
-    )
+Deine Aufgabe ist es, basierend auf der folgenden Kundenanfrage und der Expertenanalyse eine professionelle, empathische und hilfreiche E-Mail-Antwort an den Kunden zu verfassen.
 
-    system_message = SystemMessage(
-        content="""Du bist ein Experte für Krankengeld bei einer deutschen Krankenkasse.
-        Analysiere die Kundenanfrage und sammle wichtige Informationen und Überlegungen zu:
-        - Krankengeld-Anträgen und deren Bearbeitung
-        - Arbeitsunfähigkeitsbescheinigungen
-        - Höhe und Berechnung des Krankengeldes
-        - Dauer der Krankengeld-Zahlung
-        - Übergang von Lohnfortzahlung zu Krankengeld
-        - Wiedereingliederungsmaßnahmen
+Kundenanfrage:
+{conversation_context}
 
-        Erstelle KEINE direkte Antwort an den Kunden, sondern sammle alle relevanten Informationen, 
-        wichtige Punkte und Überlegungen, die für die finale E-Mail-Antwort wichtig sind.
-        Strukturiere deine Analyse klar und präzise."""
-    )
+Expertenanalyse:
+{expert_analysis}
 
-    messages_with_system = [system_message] + state["messages"]
-    response = llm.invoke(messages_with_system)
+Schreibe eine vollständige E-Mail-Antwort, die:
+- Professionell und höflich ist
+- Mache klare Ansagen (nicht "in der Regel" oder "meistens" etc)
+- Alle wichtigen Informationen aus der Expertenanalyse berücksichtigt
+- Konkrete nächste Schritte aufzeigt
+- Bei Bedarf Kontaktdaten oder weitere Hilfsangebote enthält
+- Vollständig auf Deutsch verfasst ist
 
-    print("✅ Krankengeld expert completed analysis")
+Die Mail sollte wenn möglich einem Bestimmten Schema folgen:
+- Anrede (Sehr geehrter Herr/Sehr geehrte Frau)
+- Vielen Dank für Ihre Anfrage (Anfrage nochmal kurz auffassen/zusammenfassen)
+- Antwort auf die Anfrage
+- ggf. Hinweise auf fehlende Unterlagen
+- Nächste Schritte
+- Kontaktdaten
+- Angemessene Grußformel
+- Anhang (falls vorhanden)
 
-    # Update step to completed
-    steps = (
-        state["session"]
-        .query(Step)
-        .filter(
-            Step.agent_run_id == state["agent_run_id"],
-            Step.type == "krankengeld_expert",
-        )
-        .order_by(Step.id.desc())
-        .first()
+Beginne die E-Mail mit einer passenden Anrede und beende sie mit einer professionellen Grußformel.
+Verwende einen empathischen, aber sachlichen Ton."""
     )
-    if steps:
-        steps.status = "completed"
-        steps.text = "Completed analysis of sick pay inquiry"
-        state["session"].add(steps)
-        state["session"].commit()
-
-    return {
-        "expert_analysis": response.content,
-    }
 
 
-def kostenuebernahme_expert(state: State):
-    """Expert agent for cost coverage and reimbursement inquiries."""
-    print("💳 Kostenübernahme expert agent called")
+def master_agent(state: State, runtime: Runtime[RunContext]):
+    """Orchestrator agent that decides which expert agent should handle the request."""
+    print("🎯 Master agent called - analyzing request to determine expert agent")
 
-    # Create step for this expert agent
-    create_step(
-        state["session"],
-        state["agent_run_id"],
-        "kostenuebernahme_expert",
-        "Analyzing cost coverage inquiry",
+    # Create step for master agent
+    runtime.context.buffer.create_step(
+        "master_agent",
+        "Analyzing request to determine appropriate expert agent",
         "running",
     )
 
     # Update run status
-    update_agent_run_status(
-        state["session"],
-        state["agent_run_id"],
+    runtime.context.buffer.update_run_status(
         "running",
-        "Kostenübernahme expert analyzing request",
-    )
-
-    system_message = SystemMessage(
-        content="""Du bist ein Experte für Kostenübernahme und Erstattungen bei einer deutschen Krankenkasse.
-        Analysiere die Kundenanfrage und sammle wichtige Informationen und Überlegungen zu:
-        - Kostenübernahme-Anträgen für Behandlungen und Therapien
-        - Erstattung von Privatrechnungen und Notfallbehandlungen
-        - Genehmigungsverfahren für teure Behandlungen
-        - Kostenvoranschläge und deren Prüfung
-        - Auslandsbehandlungen und deren Erstattung
-        - Hilfsmittel-Kostenübernahme
-        - Zweitmeinungsverfahren
-
-        Erstelle KEINE direkte Antwort an den Kunden, sondern sammle alle relevanten Informationen, 
-        wichtige Punkte und Überlegungen, die für die finale E-Mail-Antwort wichtig sind.
-        Strukturiere deine Analyse klar und präzise."""
+        "Master agent analyzing request",
     )
 
-    messages_with_system = [system_message] + state["messages"]
-    response = llm.invoke(messages_with_system)
+    mail = state["messages"][-1].content
+    if expert_agent := route_with_classifier(mail):
+        step_text = f"Routed request to {expert_agent} expert agent (local classifier)"
+    elif expert_agent := route_with_embeddings(mail):
+        step_text = f"Routed request to {expert_agent} expert agent (embedding router)"
+    else:
+        expert_agent, tier = route_with_llm(state["messages"], runtime.context.buffer)
+        step_text = routed_text(expert_agent, tier)
 
-    print("✅ Kostenübernahme expert completed analysis")
-
-    # Update step to completed
-    steps = (
-        state["session"]
-        .query(Step)
-        .filter(
-            Step.agent_run_id == state["agent_run_id"],
-            Step.type == "kostenuebernahme_expert",
-        )
-        .order_by(Step.id.desc())
-        .first()
-    )
-    if steps:
-        steps.status = "completed"
-        steps.text = "Completed analysis of cost coverage inquiry"
-        state["session"].add(steps)
-        state["session"].commit()
+    # Update step status to completed
+    runtime.context.buffer.complete_step("master_agent", step_text)
 
     return {
-        "expert_analysis": response.content,
+        "next_agent": expert_agent,
     }
 
 
-def widerspruch_expert(state: State):
-    """Expert agent for appeals and objections."""
-    print("⚖️ Widerspruch expert agent called")
+def make_expert_agent(name: str) -> Node:
+    """Create the node function of the expert agent `name`."""
+    expert = EXPERTS[name]
+    step_type = f"{name}_expert"
 
-    # Create step for this expert agent
-    create_step(
-        state["session"],
-        state["agent_run_id"],
-        "widerspruch_expert",
-        "Analyzing appeals and objections inquiry",
-        "running",
-    )
-
-    # Update run status
-    update_agent_run_status(
-        state["session"],
-        state["agent_run_id"],
-        "running",
-        "Widerspruch expert analyzing request",
-    )
+    def expert_agent(state: State, runtime: Runtime[RunContext]):
+        print(f"{expert.icon} {expert.label} expert agent called")
 
-    system_message = SystemMessage(
-        content="""Du bist ein Experte für Widersprüche und Rechtsmittel bei einer deutschen Krankenkasse.
-        Analysiere die Kundenanfrage und sammle wichtige Informationen und Überlegungen zu:
-        - Widerspruchsverfahren gegen Ablehnungsbescheide
-        - Fristen für Widersprüche und deren Einhaltung
-        - Erforderliche Unterlagen und Begründungen
-        - Widerspruchsausschüsse und deren Verfahren
-        - Sozialgerichtsverfahren als nächste Instanz
-        - Einstweilige Anordnungen bei dringenden Fällen
-        - Rechtsbeistand und Beratung
+        # Create step for this expert agent
+        runtime.context.buffer.create_step(
+            step_type,
+            expert.running_text,
+            "running",
+        )
 
-        Erstelle KEINE direkte Antwort an den Kunden, sondern sammle alle relevanten Informationen, 
-        wichtige Punkte und Überlegungen, die für die finale E-Mail-Antwort wichtig sind.
-        Strukturiere deine Analyse klar und präzise."""
-    )
+        # Update run status
+        runtime.context.buffer.update_run_status(
+            "running",
+            f"{expert.label} expert analyzing request",
+        )
 
-    messages_with_system = [system_message] + state["messages"]
-    response = llm.invoke(messages_with_system)
+        analysis = analyze_with_expert(name, state["messages"], runtime.context.buffer)
 
-    print("✅ Widerspruch expert completed analysis")
+        print(f"✅ {expert.label} expert completed analysis")
 
-    # Update step to completed
-    steps = (
-        state["session"]
-        .query(Step)
-        .filter(
-            Step.agent_run_id == state["agent_run_id"],
-            Step.type == "widerspruch_expert",
+        # Update step to completed
+        runtime.context.buffer.complete_step(
+            step_type,
+            expert.completed_text,
         )
-        .order_by(Step.id.desc())
-        .first()
-    )
-    if steps:
-        steps.status = "completed"
-        steps.text = "Completed analysis of appeals and objections inquiry"
-        state["session"].add(steps)
-        state["session"].commit()
 
-    return {
-        "expert_analysis": response.content,
-    }
+        return {
+            "expert_analysis": analysis,
+        }
 
+    return expert_agent
 
-def mutterschaft_expert(state: State):
-    """Expert agent for maternity and pregnancy inquiries."""
-    print("🤱 Mutterschaft expert agent called")
 
-    # Create step for this expert agent
-    create_step(
-        state["session"],
-        state["agent_run_id"],
-        "mutterschaft_expert",
-        "Analyzing maternity and pregnancy inquiry",
-        "running",
-    )
+def email_drafter_agent(state: State, runtime: Runtime[RunContext]):
+    """Agent that drafts a professional email response to the customer."""
+    print("✉️ Email drafter agent called")
 
-    # Update run status
-    update_agent_run_status(
-        state["session"],
-        state["agent_run_id"],
+    # Create step for email drafter
+    runtime.context.buffer.create_step(
+        "email_drafter",
+        "Drafting professional email response",
         "running",
-        "Mutterschaft expert analyzing request",
-    )
-
-    system_message = SystemMessage(
-        content="""Du bist ein Experte für Mutterschaft und Schwangerschaft bei einer deutschen Krankenkasse.
-        Analysiere die Kundenanfrage und sammle wichtige Informationen und Überlegungen zu:
-        - Vorsorgeuntersuchungen während der Schwangerschaft
-        - Mutterschaftsgeld und dessen Beantragung
-        - Hebammenleistungen und deren Abrechnung
-        - Geburtsvorbereitungskurse und Rückbildungsgymnastik
-        - Zusätzliche Leistungen für Schwangere
-        - Mutterschutzfristen und Elternzeit
-        - Familienversicherung für Neugeborene
-
-        Erstelle KEINE direkte Antwort an den Kunden, sondern sammle alle relevanten Informationen, 
-        wichtige Punkte und Überlegungen, die für die finale E-Mail-Antwort wichtig sind.
-        Strukturiere deine Analyse klar und präzise."""
     )
 
-    messages_with_system = [system_message] + state["messages"]
-    response = llm.invoke(messages_with_system)
+    # Update run status
+    runtime.context.buffer.update_run_status("running", "Drafting email response")
 
-    print("✅ Mutterschaft expert completed analysis")
+    messages_with_system = [email_drafter_system_message(state)] + [
+        state["messages"][-1]
+    ]  # Only use the last message
+    draft = stream_draft(messages_with_system, runtime.context.buffer)
+    print("✅ Email drafter completed response")
 
     # Update step to completed
-    steps = (
-        state["session"]
-        .query(Step)
-        .filter(
-            Step.agent_run_id == state["agent_run_id"],
-            Step.type == "mutterschaft_expert",
-        )
-        .order_by(Step.id.desc())
-        .first()
+    runtime.context.buffer.complete_step(
+        "email_drafter",
+        "Completed email draft",
     )
-    if steps:
-        steps.status = "completed"
-        steps.text = "Completed analysis of maternity and pregnancy inquiry"
-        state["session"].add(steps)
-        state["session"].commit()
 
-    return {
-        "expert_analysis": response.content,
-    }
+    # Save draft and final run status
+    agent_run = runtime.context.session.get(AgentRun, state["agent_run_id"])
+    if agent_run:
+        runtime.context.buffer.complete_run(f"Re: {agent_run.mail_subject}", draft)
 
+    return {"messages": [AIMessage(content=draft)]}
 
-def rehabilitation_expert(state: State):
-    """Expert agent for rehabilitation inquiries."""
-    print("🏃‍♂️ Rehabilitation expert agent called")
 
-    # Create step for this expert agent
-    create_step(
-        state["session"],
-        state["agent_run_id"],
-        "rehabilitation_expert",
-        "Analyzing rehabilitation inquiry",
+async def amaster_agent(state: State, runtime: Runtime[RunContext]):
+    """Async variant of `master_agent`."""
+    print("🎯 Master agent called - analyzing request to determine expert agent")
+
+    runtime.context.buffer.create_step(
+        "master_agent",
+        "Analyzing request to determine appropriate expert agent",
         "running",
     )
-
-    # Update run status
-    update_agent_run_status(
-        state["session"],
-        state["agent_run_id"],
+    runtime.context.buffer.update_run_status(
         "running",
-        "Rehabilitation expert analyzing request",
+        "Master agent analyzing request",
     )
 
-    system_message = SystemMessage(
-        content="""Du bist ein Experte für Rehabilitation und Kuren bei einer deutschen Krankenkasse.
-        Analysiere die Kundenanfrage und sammle wichtige Informationen und Überlegungen zu:
-        - Rehabilitationsmaßnahmen und deren Beantragung
-        - Medizinische Voraussetzungen für Reha-Maßnahmen
-        - Ambulante vs. stationäre Rehabilitation
-        - Anschlussheilbehandlungen (AHB)
-        - Präventionsmaßnahmen und Kuren
-        - Reha-Einrichtungen und deren Auswahl
-        - Zuzahlungen bei Reha-Maßnahmen
-        - Nachsorge und Reha-Sport
-
-        Erstelle KEINE direkte Antwort an den Kunden, sondern sammle alle relevanten Informationen, 
-        wichtige Punkte und Überlegungen, die für die finale E-Mail-Antwort wichtig sind.
-        Strukturiere deine Analyse klar und präzise."""
+    mail = state["messages"][-1].content
+    speculative_tasks = {}
+    # Kept apart from the master agent's step, see `RunBuffer.record_speculation`
+    speculative_usage: dict[str, LLMUsage] = {}
+
+    def speculate(name: str) -> Awaitable[str]:
+        speculative_usage[name] = LLMUsage()
+        return aanalyze_with_expert(name, state["messages"], speculative_usage[name])
+
+    if expert_agent := route_with_classifier(mail):
+        step_text = f"Routed request to {expert_agent} expert agent (local classifier)"
+    else:
+        # Routing takes a remote call, let the likely experts start meanwhile
+        speculative_tasks = start_speculation(
+            mail, settings.AGENT_SPECULATIVE_EXPERTS, speculate
+        )
+        try:
+            if expert_agent := await aroute_with_embeddings(mail):
+                step_text = (
+                    f"Routed request to {expert_agent} expert agent (embedding router)"
+                )
+            else:
+                expert_agent, tier = await aroute_with_llm(
+                    state["messages"], runtime.context.buffer
+                )
+                step_text = routed_text(expert_agent, tier)
+        except BaseException:
+            cancel_speculation(speculative_tasks)
+            runtime.context.buffer.record_speculation(speculative_usage, None)
+            raise
+
+    runtime.context.buffer.complete_step("master_agent", step_text)
+
+    update = {"next_agent": expert_agent}
+    analysis = await resolve_speculation(speculative_tasks, expert_agent)
+    runtime.context.buffer.record_speculation(
+        speculative_usage, expert_agent if analysis is not None else None
     )
+    if analysis is not None:
+        update |= {"speculative_expert": expert_agent, "expert_analysis": analysis}
+    return update
 
-    messages_with_system = [system_message] + state["messages"]
-    response = llm.invoke(messages_with_system)
 
-    print("✅ Rehabilitation expert completed analysis")
+def make_async_expert_agent(name: str) -> Node:
+    """Async variant of `make_expert_agent`."""
+    expert = EXPERTS[name]
+    step_type = f"{name}_expert"
 
-    # Update step to completed
-    steps = (
-        state["session"]
-        .query(Step)
-        .filter(
-            Step.agent_run_id == state["agent_run_id"],
-            Step.type == "rehabilitation_expert",
+    async def expert_agent(state: State, runtime: Runtime[RunContext]):
+        print(f"{expert.icon} {expert.label} expert agent called")
+
+        runtime.context.buffer.create_step(
+            step_type,
+            expert.running_text,
+            "running",
+        )
+        runtime.context.buffer.update_run_status(
+            "running",
+            f"{expert.label} expert analyzing request",
         )
-        .order_by(Step.id.desc())
-        .first()
-    )
-    if steps:
-        steps.status = "completed"
-        steps.text = "Completed analysis of rehabilitation inquiry"
-        state["session"].add(steps)
-        state["session"].commit()
 
-    return {
-        "expert_analysis": response.content,
-    }
+        if state.get("speculative_expert") == name:
+            analysis = state["expert_analysis"]
+            runtime.context.buffer.adopt_speculation(name)
+        else:
+            analysis = await aanalyze_with_expert(
+                name, state["messages"], runtime.context.buffer
+            )
 
+        print(f"✅ {expert.label} expert completed analysis")
 
-def terminvermittlung_expert(state: State):
-    """Expert agent for appointment scheduling and mediation."""
-    print("📅 Terminvermittlung expert agent called")
+        runtime.context.buffer.complete_step(
+            step_type,
+            expert.completed_text,
+        )
 
-    # Create step for this expert agent
-    create_step(
-        state["session"],
-        state["agent_run_id"],
-        "terminvermittlung_expert",
-        "Analyzing appointment scheduling inquiry",
-        "running",
-    )
+        return {
+            "expert_analysis": analysis,
+        }
 
-    # Update run status
-    update_agent_run_status(
-        state["session"],
-        state["agent_run_id"],
+    return expert_agent
+
+
+async def aemail_drafter_agent(state: State, runtime: Runtime[RunContext]):
+    """Async variant of `email_drafter_agent`."""
+    print("✉️ Email drafter agent called")
+
+    runtime.context.buffer.create_step(
+        "email_drafter",
+        "Drafting professional email response",
         "running",
-        "Terminvermittlung expert analyzing request",
     )
+    runtime.context.buffer.update_run_status("running", "Drafting email response")
 
-    system_message = SystemMessage(
-        content="""Du bist ein Experte für Terminvermittlung und Beratungstermine bei einer deutschen Krankenkasse.
-        Analysiere die Kundenanfrage und sammle wichtige Informationen und Überlegungen zu:
-        - Terminvereinbarungen für Beratungsgespräche
-        - Facharzttermine und Terminservicestelle
-        - Beschwerden über lange Wartezeiten
-        - Dringende Terminvermittlung bei akuten Beschwerden
-        - Zweitmeinungstermine
-        - Telefonische vs. persönliche Beratungstermine
-        - Sprechstunden und Öffnungszeiten
-        - Online-Terminbuchung und digitale Services
+    messages_with_system = [email_drafter_system_message(state)] + [
+        state["messages"][-1]
+    ]  # Only use the last message
+    draft = await astream_draft(messages_with_system, runtime.context.buffer)
+    print("✅ Email drafter completed response")
 
-        Erstelle KEINE direkte Antwort an den Kunden, sondern sammle alle relevanten Informationen, 
-        wichtige Punkte und Überlegungen, die für die finale E-Mail-Antwort wichtig sind.
-        Strukturiere deine Analyse klar und präzise."""
+    runtime.context.buffer.complete_step(
+        "email_drafter",
+        "Completed email draft",
     )
 
-    messages_with_system = [system_message] + state["messages"]
-    response = llm.invoke(messages_with_system)
+    agent_run = await runtime.context.session.get(AgentRun, state["agent_run_id"])
+    if agent_run:
+        runtime.context.buffer.complete_run(f"Re: {agent_run.mail_subject}", draft)
 
-    print("✅ Terminvermittlung expert completed analysis")
+    return {"messages": [AIMessage(content=draft)]}
 
-    # Update step to completed
-    steps = (
-        state["session"]
-        .query(Step)
-        .filter(
-            Step.agent_run_id == state["agent_run_id"],
-            Step.type == "terminvermittlung_expert",
-        )
-        .order_by(Step.id.desc())
-        .first()
-    )
-    if steps:
-        steps.status = "completed"
-        steps.text = "Completed analysis of appointment scheduling inquiry"
-        state["session"].add(steps)
-        state["session"].commit()
-
-    return {
-        "expert_analysis": response.content,
-    }
 
+def fused_agent(state: State, runtime: Runtime[RunContext]):
+    """Routes, analyzes and drafts with a single structured LLM call.
 
-def sonstiges_expert(state: State):
-    """Expert agent for general inquiries."""
-    print("📋 Sonstiges expert agent called")
+    Writes the same master, expert and email drafter steps as the staged
+    agents. If the answer is unusable, the staged agents take over.
+    """
+    print("⚡ Fused agent called - routing, analyzing and drafting in one call")
 
-    # Create step for this expert agent
-    create_step(
-        state["session"],
-        state["agent_run_id"],
-        "sonstiges_expert",
-        "Analyzing general inquiry",
+    step = runtime.context.buffer.create_step(
+        "master_agent",
+        "Analyzing, routing and drafting the request in a single call",
         "running",
     )
-
-    # Update run status
-    update_agent_run_status(
-        state["session"],
-        state["agent_run_id"],
+    runtime.context.buffer.update_run_status(
         "running",
-        "Sonstiges expert analyzing request",
+        "Fused agent processing request",
     )
 
-    system_message = SystemMessage(
-        content="""Du bist ein Allgemein-Experte für eine deutsche Krankenkasse.
-        Analysiere die Kundenanfrage und sammle wichtige Informationen und Überlegungen zu:
-        - Verlorene oder defekte Versichertenkarten
-        - Kontaktdaten und Bankverbindung ändern
-        - Allgemeine Informationen zur Krankenversicherung
-        - Umzug und Kassenwechsel
-        - Bonusprogramme und Zusatzleistungen
-        - Mitgliedschaft und Beiträge
-        - Bescheinigungen und Nachweise
-
-        Erstelle KEINE direkte Antwort an den Kunden, sondern sammle alle relevanten Informationen, 
-        wichtige Punkte und Überlegungen, die für die finale E-Mail-Antwort wichtig sind.
-        Strukturiere deine Analyse klar und präzise."""
+    messages_with_system = [FUSED_SYSTEM_MESSAGE] + state["messages"]
+    response = invoke_llm(
+        tier_llm("large"),
+        messages_with_system,
+        runtime.context.buffer,
+        "fused",
+        FUSED_MAX_TOKENS,
+        FUSED_DEADLINE,
+        response_format={"type": "json_object"},
     )
+    fused = parse_fused_response(response.content)
+    if not fused:
+        runtime.context.buffer.finish_step(
+            step, "Single call failed, routing with separate agents"
+        )
+        return {}
 
-    messages_with_system = [system_message] + state["messages"]
-    response = llm.invoke(messages_with_system)
-
-    print("✅ Sonstiges expert completed analysis")
+    runtime.context.buffer.finish_step(
+        step,
+        f"Routed request to {fused.category} expert agent (fused)",
+    )
+    runtime.context.buffer.create_step(
+        f"{fused.category}_expert",
+        EXPERTS[fused.category].completed_text,
+    )
+    runtime.context.buffer.create_step(
+        "email_drafter",
+        "Completed email draft",
+    )
 
-    # Update step to completed
-    steps = (
-        state["session"]
-        .query(Step)
-        .filter(
-            Step.agent_run_id == state["agent_run_id"], Step.type == "sonstiges_expert"
+    agent_run = runtime.context.session.get(AgentRun, state["agent_run_id"])
+    if agent_run:
+        runtime.context.buffer.complete_run(
+            f"Re: {agent_run.mail_subject}", fused.draft
         )
-        .order_by(Step.id.desc())
-        .first()
-    )
-    if steps:
-        steps.status = "completed"
-        steps.text = "Completed analysis of general inquiry"
-        state["session"].add(steps)
-        state["session"].commit()
+    print(f"✅ Fused agent completed response via '{fused.category}'")
 
     return {
-        "expert_analysis": response.content,
+        "next_agent": fused.category,
+        "expert_analysis": fused.analysis,
+        "messages": [AIMessage(content=fused.draft)],
     }
 
 
-def email_drafter_agent(state: State):
-    """Agent that drafts a professional email response to the customer."""
-    print("✉️ Email drafter agent called")
+async def afused_agent(state: State, runtime: Runtime[RunContext]):
+    """Async variant of `fused_agent`."""
+    print("⚡ Fused agent called - routing, analyzing and drafting in one call")
 
-    # Create step for email drafter
-    create_step(
-        state["session"],
-        state["agent_run_id"],
-        "email_drafter",
-        "Drafting professional email response",
+    step = runtime.context.buffer.create_step(
+        "master_agent",
+        "Analyzing, routing and drafting the request in a single call",
         "running",
     )
-
-    # Update run status
-    update_agent_run_status(
-        state["session"], state["agent_run_id"], "running", "Drafting email response"
+    runtime.context.buffer.update_run_status(
+        "running",
+        "Fused agent processing request",
     )
 
-    # Get the conversation history to understand the context
-    conversation_context = ""
-    for msg in state["messages"]:
-        if hasattr(msg, "content"):
-            conversation_context += f"{msg.content}\n"
-
-    expert_analysis = state.get("expert_analysis", "")
-
-    system_message = SystemMessage(
-        content=f"""Du bist ein professioneller E-Mail-Verfasser für eine deutsche Krankenkasse.
-
-Deine Aufgabe ist es, basierend auf der folgenden Kundenanfrage und der Expertenanalyse eine professionelle, empathische und hilfreiche E-Mail-Antwort an den Kunden zu verfassen.
-
-Kundenanfrage:
-{conversation_context}
-
-Expertenanalyse:
-{expert_analysis}
-
-Schreibe eine vollständige E-Mail-Antwort, die:
-- Professionell und höflich ist
-- Mache klare Ansagen (nicht "in der Regel" oder "meistens" etc)
-- Alle wichtigen Informationen aus der Expertenanalyse berücksichtigt
-- Konkrete nächste Schritte aufzeigt
-- Bei Bedarf Kontaktdaten oder weitere Hilfsangebote enthält
-- Vollständig auf Deutsch verfasst ist
-
-Die Mail sollte wenn möglich einem Bestimmten Schema folgen:
-- Anrede (Sehr geehrter Herr/Sehr geehrte Frau)
-- Vielen Dank für Ihre Anfrage (Anfrage nochmal kurz auffassen/zusammenfassen)
-- Antwort auf die Anfrage
-- ggf. Hinweise auf fehlende Unterlagen
-- Nächste Schritte
-- Kontaktdaten
-- Angemessene Grußformel
-- Anhang (falls vorhanden)
-
-Beginne die E-Mail mit einer passenden Anrede und beende sie mit einer professionellen Grußformel.
-Verwende einen empathischen, aber sachlichen Ton."""
+    messages_with_system = [FUSED_SYSTEM_MESSAGE] + state["messages"]
+    response = await ainvoke_llm(
+        tier_llm("large"),
+        messages_with_system,
+        runtime.context.buffer,
+        "fused",
+        FUSED_MAX_TOKENS,
+        FUSED_DEADLINE,
+        response_format={"type": "json_object"},
     )
-
-    messages_with_system = [system_message] + [
-        state["messages"][-1]
-    ]  # Only use the last message
-    response = llm.invoke(messages_with_system)
-    print("✅ Email drafter completed response")
-
-    # Update step to completed
-    steps = (
-        state["session"]
-        .query(Step)
-        .filter(
-            Step.agent_run_id == state["agent_run_id"], Step.type == "email_drafter"
+    fused = parse_fused_response(response.content)
+    if not fused:
+        runtime.context.buffer.finish_step(
+            step, "Single call failed, routing with separate agents"
         )
-        .order_by(Step.id.desc())
-        .first()
+        return {}
+
+    runtime.context.buffer.finish_step(
+        step,
+        f"Routed request to {fused.category} expert agent (fused)",
+    )
+    runtime.context.buffer.create_step(
+        f"{fused.category}_expert",
+        EXPERTS[fused.category].completed_text,
+    )
+    runtime.context.buffer.create_step(
+        "email_drafter",
+        "Completed email draft",
     )
-    if steps:
-        steps.status = "completed"
-        steps.text = "Completed email draft"
-        state["session"].add(steps)
-        state["session"].commit()
 
-    # Update final run status and save draft
-    agent_run = state["session"].get(AgentRun, state["agent_run_id"])
+    agent_run = await runtime.context.session.get(AgentRun, state["agent_run_id"])
     if agent_run:
-        agent_run.status = "completed"
-        agent_run.status_message = "Email response generated successfully"
-        agent_run.draft_body = response.content
-        agent_run.draft_subject = f"Re: {agent_run.mail_subject}"
-        state["session"].add(agent_run)
-        state["session"].commit()
+        runtime.context.buffer.complete_run(
+            f"Re: {agent_run.mail_subject}", fused.draft
+        )
+    print(f"✅ Fused agent completed response via '{fused.category}'")
 
-    return {"messages": [response]}
+    return {
+        "next_agent": fused.category,
+        "expert_analysis": fused.analysis,
+        "messages": [AIMessage(content=fused.draft)],
+    }
 
 
 def route_to_expert(
@@ -898,51 +991,271 @@ def route_to_expert(
     return state["next_agent"]
 
 
-# Add all nodes to the graph
-graph_builder.add_node("master", master_agent)
-graph_builder.add_node("zuzahlung", zuzahlung_expert)
-graph_builder.add_node("familienversicherung", familienversicherung_expert)
-graph_builder.add_node("pflegeversicherung", pflegeversicherung_expert)
-graph_builder.add_node("krankengeld", krankengeld_expert)
-graph_builder.add_node("kostenuebernahme", kostenuebernahme_expert)
-graph_builder.add_node("widerspruch", widerspruch_expert)
-graph_builder.add_node("mutterschaft", mutterschaft_expert)
-graph_builder.add_node("rehabilitation", rehabilitation_expert)
-graph_builder.add_node("terminvermittlung", terminvermittlung_expert)
-graph_builder.add_node("sonstiges", sonstiges_expert)
-graph_builder.add_node("email_drafter", email_drafter_agent)
-
-# Define the flow
-graph_builder.add_edge(START, "master")
-graph_builder.add_conditional_edges("master", route_to_expert)
-
-# All expert agents end the conversation
-graph_builder.add_edge("zuzahlung", "email_drafter")
-graph_builder.add_edge("familienversicherung", "email_drafter")
-graph_builder.add_edge("pflegeversicherung", "email_drafter")
-graph_builder.add_edge("krankengeld", "email_drafter")
-graph_builder.add_edge("kostenuebernahme", "email_drafter")
-graph_builder.add_edge("widerspruch", "email_drafter")
-graph_builder.add_edge("mutterschaft", "email_drafter")
-graph_builder.add_edge("rehabilitation", "email_drafter")
-graph_builder.add_edge("terminvermittlung", "email_drafter")
-graph_builder.add_edge("sonstiges", "email_drafter")
-
-# Only the email drafter ends the conversation
-graph_builder.add_edge("email_drafter", END)
-
-graph = graph_builder.compile()
-
-
-def run_graph(mail: str, session: Session, agent_run_id: uuid.UUID):
+def route_after_fused(state: State) -> Literal["master", "__end__"]:
+    """End after a usable fused answer, otherwise run the staged agents."""
+    return END if state.get("next_agent") else "master"
+
+
+def flushing(name: str, node: Node) -> Node:
+    """Wrap `node` to write its buffered updates in one transaction when it ends.
+
+    Also when it failed, so the database shows how far the run got. The
+    duration of the node including the write is observed as `name`.
+    """
+    node_seconds = AGENT_NODE_SECONDS.labels(name)
+
+    if inspect.iscoroutinefunction(node):
+
+        async def async_node(state: State, runtime: Runtime[RunContext]):
+            start_time = time.perf_counter()
+            try:
+                return await node(state, runtime)
+            finally:
+                await runtime.context.buffer.aflush(runtime.context.session)
+                node_seconds.observe(time.perf_counter() - start_time)
+
+        return async_node
+
+    def sync_node(state: State, runtime: Runtime[RunContext]):
+        start_time = time.perf_counter()
+        try:
+            return node(state, runtime)
+        finally:
+            runtime.context.buffer.flush(runtime.context.session)
+            node_seconds.observe(time.perf_counter() - start_time)
+
+    return sync_node
+
+
+def build_graph(
+    master: Node,
+    expert_factory: Callable[[str], Node],
+    email_drafter: Node,
+    fused: Node | None = None,
+):
+    """Wire the master, expert and email drafter nodes into a compiled graph.
+
+    With a `fused` node the graph starts with the single-call pipeline and
+    only falls back to the staged agents when its answer is unusable.
+    """
+    graph_builder = StateGraph(State, context_schema=RunContext)
+
+    # Add all nodes to the graph
+    graph_builder.add_node("master", flushing("master", master))
+    for name in EXPERTS:
+        graph_builder.add_node(name, flushing(name, expert_factory(name)))
+    graph_builder.add_node("email_drafter", flushing("email_drafter", email_drafter))
+
+    # Define the flow
+    if fused:
+        graph_builder.add_node("fused", flushing("fused", fused))
+        graph_builder.add_edge(START, "fused")
+        graph_builder.add_conditional_edges("fused", route_after_fused)
+    else:
+        graph_builder.add_edge(START, "master")
+    graph_builder.add_conditional_edges("master", route_to_expert)
+
+    # All expert agents hand over to the email drafter
+    for name in EXPERTS:
+        graph_builder.add_edge(name, "email_drafter")
+
+    # Only the email drafter ends the conversation
+    graph_builder.add_edge("email_drafter", END)
+
+    return graph_builder.compile()
+
+
+# Compiled graphs by pipeline, "staged" runs master -> expert -> email drafter
+# and "fused" answers with a single LLM call
+graphs = {
+    "staged": build_graph(master_agent, make_expert_agent, email_drafter_agent),
+    "fused": build_graph(
+        master_agent, make_expert_agent, email_drafter_agent, fused_agent
+    ),
+}
+async_graphs = {
+    "staged": build_graph(amaster_agent, make_async_expert_agent, aemail_drafter_agent),
+    "fused": build_graph(
+        amaster_agent, make_async_expert_agent, aemail_drafter_agent, afused_agent
+    ),
+}
+graph = graphs["staged"]
+async_graph = async_graphs["staged"]
+
+
+def run_category(run_state: RunState) -> str:
+    """The expert the run was routed to, "unrouted" if it ended before."""
+    for step_type in run_state.latest_steps:
+        if step_type.endswith("_expert"):
+            return step_type.removesuffix("_expert")
+    return "unrouted"
+
+
+@contextmanager
+def observed_run(run_state: RunState, pipeline: str) -> Iterator[None]:
+    """Count the run as in progress, and by its outcome once it ended."""
+    AGENT_RUNS_IN_PROGRESS.inc()
+    try:
+        yield
+    finally:
+        AGENT_RUNS_IN_PROGRESS.dec()
+        outcome = "completed" if run_state.status == "completed" else "failed"
+        AGENT_RUNS.labels(pipeline, run_category(run_state), outcome).inc()
+
+
+def fail_run(buffer: RunBuffer, session: Session, error: Exception) -> None:
+    """Mark the run as failed, which ends the event streams of its clients."""
+    print(f"❌ Agent run {buffer.agent_run_id} failed: {error!r}")
+    buffer.fail_run()
+    try:
+        # The error may have aborted the session's transaction
+        session.rollback()
+        buffer.flush(session)
+    finally:
+        # Also when the database is unreachable, streams would wait forever
+        buffer.publish_done()
+
+
+async def afail_run(buffer: RunBuffer, session: AsyncSession, error: Exception) -> None:
+    """Async variant of `fail_run`."""
+    print(f"❌ Agent run {buffer.agent_run_id} failed: {error!r}")
+    buffer.fail_run()
+    try:
+        await session.rollback()
+        await buffer.aflush(session)
+    finally:
+        buffer.publish_done()
+
+
+def format_mail(subject: str, body: str, sender: str) -> str:
+    return f"Subject: {subject}\nBody: {body}\nSender: {sender}"
+
+
+def initial_state(mail: str, agent_run_id: uuid.UUID) -> dict[str, Any]:
+    return {
+        "messages": [
+            HumanMessage(content=truncate_tokens(mail, settings.AGENT_MAX_MAIL_TOKENS))
+        ],
+        "agent_run_id": agent_run_id,
+    }
+
+
+def run_config(agent_run_id: uuid.UUID) -> RunnableConfig:
+    """The run's thread of checkpoints."""
+    return {"configurable": {"thread_id": str(agent_run_id)}}
+
+
+def run_graph(
+    mail: str, session: Session, agent_run_id: uuid.UUID, pipeline: str = "staged"
+):
     print("🚀 Starting agent workflow")
-    result = graph.invoke(
-        {
-            "messages": [HumanMessage(content=mail)],
-            "session": session,
-            "agent_run_id": agent_run_id,
-        }
-    )
+    buffer = RunBuffer(track(agent_run_id))
+    graph = graphs[pipeline]
+    config = run_config(agent_run_id)
+    graph_input = initial_state(mail, agent_run_id)
+    with hold_leases([agent_run_id]):
+        try:
+            if settings.AGENT_CHECKPOINTING:
+                graph = graph.copy({"checkpointer": get_checkpointer()})
+                snapshot = graph.get_state(config)
+                if snapshot.values and not snapshot.next:
+                    # Finished before its checkpoints were deleted, the draft is saved
+                    return snapshot.values["messages"][-1].content
+                if snapshot.next:
+                    print(f"♻️ Resuming agent run {agent_run_id} at {snapshot.next}")
+                    buffer.restore(session.get(AgentRun, agent_run_id))
+                    graph_input = None
+
+            with observed_run(buffer.run_state, pipeline):
+                result = graph.invoke(
+                    graph_input, config, context=RunContext(session, buffer)
+                )
+                # The time of the last node's write, timed after it was committed
+                buffer.flush(session)
+            if settings.AGENT_CHECKPOINTING:
+                graph.checkpointer.delete_thread(config["configurable"]["thread_id"])
+        except Exception as e:
+            fail_run(buffer, session, e)
+            raise
+        finally:
+            untrack(agent_run_id)
     print("🏁 Agent workflow completed")
     print("MESSAGES", result)
     return result["messages"][-1].content
+
+
+async def arun_graph(mail: str, agent_run_id: uuid.UUID, pipeline: str = "staged"):
+    """Run the agent workflow on the event loop with async LLM and DB calls."""
+    print("🚀 Starting async agent workflow")
+    buffer = RunBuffer(track(agent_run_id))
+    graph = async_graphs[pipeline]
+    config = run_config(agent_run_id)
+    graph_input = initial_state(mail, agent_run_id)
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        with hold_leases([agent_run_id]):
+            try:
+                if settings.AGENT_CHECKPOINTING:
+                    graph = graph.copy({"checkpointer": await aget_checkpointer()})
+                    snapshot = await graph.aget_state(config)
+                    if snapshot.values and not snapshot.next:
+                        return snapshot.values["messages"][-1].content
+                    if snapshot.next:
+                        print(f"♻️ Resuming agent run {agent_run_id} at {snapshot.next}")
+                        agent_run = await session.get(
+                            AgentRun,
+                            agent_run_id,
+                            options=[selectinload(AgentRun.steps)],
+                        )
+                        buffer.restore(agent_run)
+                        graph_input = None
+
+                with observed_run(buffer.run_state, pipeline):
+                    result = await graph.ainvoke(
+                        graph_input, config, context=RunContext(session, buffer)
+                    )
+                    await buffer.aflush(session)
+                if settings.AGENT_CHECKPOINTING:
+                    await graph.checkpointer.adelete_thread(
+                        config["configurable"]["thread_id"]
+                    )
+            except Exception as e:
+                await afail_run(buffer, session, e)
+                raise
+            finally:
+                untrack(agent_run_id)
+    print("🏁 Async agent workflow completed")
+    return result["messages"][-1].content
+
+
+async def execute_run(
+    mail: str, agent_run_id: uuid.UUID, pipeline: str = "staged"
+) -> None:
+    """Run the graph from async code in the configured AGENT_EXECUTION_MODE."""
+    if settings.AGENT_EXECUTION_MODE == "async":
+        await arun_graph(mail, agent_run_id, pipeline)
+        return
+
+    def run_in_thread() -> None:
+        with Session(engine) as session:
+            run_graph(mail, session, agent_run_id, pipeline)
+
+    await asyncio.to_thread(run_in_thread)
+
+
+async def run_graph_batch(
+    runs: list[tuple[str, uuid.UUID]], concurrency: int, pipeline: str = "staged"
+) -> None:
+    """Execute (mail, agent_run_id) pairs with at most `concurrency` in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(mail: str, agent_run_id: uuid.UUID) -> None:
+        async with semaphore:
+            try:
+                await execute_run(mail, agent_run_id, pipeline)
+            except Exception:
+                # The run marked itself as failed, the others go on
+                pass
+
+    # Runs waiting for their turn are not resumable either
+    with hold_leases(agent_run_id for _, agent_run_id in runs):
+        await asyncio.gather(*(run(mail, agent_run_id) for mail, agent_run_id in runs))
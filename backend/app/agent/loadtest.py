@@ -0,0 +1,266 @@
+"""Load-test `/agent/langgraph` through the API, Postgres and the fake LLM.
+
+Starts N runs at once against a running API, follows each through
+`GET /agent/{run_id}/events` until its draft is done, and samples the database
+meanwhile. Reports runs per second, percentiles of the time from starting a
+run to its finished draft, failed runs, the connections held on the database
+and the depth of the `agentjob` queue.
+
+With `--serve` the API is started with uvicorn and LLM_FAKE=true, otherwise
+the API at `--url` is tested as it is configured. Run it against a test
+database, the runs are removed afterwards.
+
+    python -m app.agent.loadtest --serve --workers 2 --runs 200
+    python -m app.agent.loadtest --url http://localhost:8000 --runs 50
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from dataclasses import dataclass, field
+
+import httpx
+from sqlalchemy import text
+from sqlmodel import Session, col, delete, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import settings
+from app.core.db import async_engine, engine
+from app.tables import AgentJob, AgentRun
+
+MAILS = [
+    (
+        "Krankengeld",
+        "Wann überweist die Krankenkasse das Krankengeld auf mein Konto?",
+    ),
+    (
+        "Termin beim Facharzt",
+        "Können Sie mir bei der Terminvermittlung für einen Facharzt helfen?",
+    ),
+    (
+        "Widerspruch gegen Bescheid",
+        "Ich lege Widerspruch gegen den Bescheid zur Ablehnung meiner Reha ein.",
+    ),
+    ("Adressänderung", "Bitte ändern Sie meine Anschrift ab dem nächsten Monat."),
+]
+SENDER = "load-test@example.com"
+# Seconds between two samples of the database
+SAMPLE_INTERVAL = 0.5
+# Seconds to wait for a started API to answer its health check
+SERVER_STARTUP_TIMEOUT = 60.0
+
+CONNECTIONS_STATEMENT = text(
+    "SELECT count(*) FROM pg_stat_activity "
+    "WHERE datname = current_database() AND pid <> pg_backend_pid()"
+)
+
+
+@dataclass
+class RunResult:
+    run_id: uuid.UUID | None
+    # Seconds from starting the run to its finished draft
+    seconds: float
+    status: str
+    error: str = ""
+
+
+@dataclass
+class Samples:
+    connections: list[int] = field(default_factory=list)
+    queued_jobs: list[int] = field(default_factory=list)
+    running_runs: list[int] = field(default_factory=list)
+
+
+async def follow_run(client: httpx.AsyncClient, run_id: uuid.UUID) -> str:
+    """Read the events of the run until it is finished, its final status."""
+    status = "running"
+    event_type = ""
+    async with client.stream("GET", f"/agent/{run_id}/events") as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event_type = line.removeprefix("event: ")
+            elif line.startswith("data: ") and event_type in ("run", "status", "done"):
+                status = json.loads(line.removeprefix("data: "))["status"]
+    return status
+
+
+async def agent_run(
+    client: httpx.AsyncClient, index: int, pipeline: str | None
+) -> RunResult:
+    subject, body = MAILS[index % len(MAILS)]
+    params = {"subject": subject, "body": body, "sender": SENDER}
+    if pipeline:
+        params["pipeline"] = pipeline
+    start_time = time.perf_counter()
+    run_id = None
+    try:
+        response = await client.get("/agent/langgraph", params=params)
+        response.raise_for_status()
+        run_id = uuid.UUID(response.json()["run_id"])
+        status = await follow_run(client, run_id)
+    except httpx.HTTPError as e:
+        return RunResult(run_id, time.perf_counter() - start_time, "error", repr(e))
+    return RunResult(run_id, time.perf_counter() - start_time, status)
+
+
+async def sample_database(samples: Samples, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        async with AsyncSession(async_engine) as session:
+            connections = (await session.exec(CONNECTIONS_STATEMENT)).one()[0]
+            queued_jobs = (
+                await session.exec(
+                    select(func.count()).where(AgentJob.status == "queued")
+                )
+            ).one()
+            running_runs = (
+                await session.exec(
+                    select(func.count()).where(
+                        AgentRun.status == "running", AgentRun.mail_sender == SENDER
+                    )
+                )
+            ).one()
+        samples.connections.append(connections)
+        samples.queued_jobs.append(queued_jobs)
+        samples.running_runs.append(running_runs)
+        try:
+            await asyncio.wait_for(stop.wait(), SAMPLE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_load_test(
+    url: str, runs: int, pipeline: str | None, timeout: float
+) -> tuple[list[RunResult], Samples, float]:
+    """Results of `runs` concurrent runs, the database samples and the seconds taken."""
+    samples = Samples()
+    stop = asyncio.Event()
+    # No keep-alive, the server closing an idle connection races with reusing it
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=0)
+    async with httpx.AsyncClient(
+        base_url=f"{url}{settings.API_V1_STR}", timeout=timeout, limits=limits
+    ) as client:
+        sampler = asyncio.create_task(sample_database(samples, stop))
+        start_time = time.perf_counter()
+        results = await asyncio.gather(
+            *(agent_run(client, index, pipeline) for index in range(runs))
+        )
+        seconds = time.perf_counter() - start_time
+        stop.set()
+        await sampler
+    await async_engine.dispose()
+    return results, samples, seconds
+
+
+def percentile(values: list[float], percent: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
+
+
+def report(results: list[RunResult], samples: Samples, seconds: float) -> None:
+    completed = [result.seconds for result in results if result.status == "completed"]
+    failed = [result for result in results if result.status != "completed"]
+    print(f"🏁 {len(results)} runs in {seconds:.2f}s")
+    print(f"   throughput: {len(completed) / seconds:.2f} runs/s")
+    print(
+        "   time to draft: "
+        + ", ".join(
+            f"p{percent} {percentile(completed, percent):.2f}s"
+            for percent in (50, 95, 99)
+        )
+    )
+    print(f"   failed: {len(failed)}")
+    for result in failed[:5]:
+        print(f"     {result.run_id}: {result.status} {result.error}")
+    for name, values in (
+        ("db connections", samples.connections),
+        ("queued jobs", samples.queued_jobs),
+        ("running runs", samples.running_runs),
+    ):
+        if values:
+            print(f"   {name}: max {max(values)}, mean {statistics.fmean(values):.1f}")
+
+
+def delete_runs() -> None:
+    with Session(engine) as session:
+        session.exec(delete(AgentRun).where(col(AgentRun.mail_sender) == SENDER))
+        session.commit()
+
+
+def wait_for_server(url: str, server: subprocess.Popen[bytes]) -> None:
+    end = time.monotonic() + SERVER_STARTUP_TIMEOUT
+    while time.monotonic() < end:
+        if server.poll() is not None:
+            raise RuntimeError(f"API exited with code {server.returncode}")
+        try:
+            httpx.get(
+                f"{url}{settings.API_V1_STR}/utils/health-check/"
+            ).raise_for_status()
+            return
+        except httpx.HTTPError:
+            time.sleep(0.5)
+    raise RuntimeError(f"API did not start within {SERVER_STARTUP_TIMEOUT}s")
+
+
+def start_server(port: int, workers: int) -> subprocess.Popen[bytes]:
+    """The API with the fake LLM, configured by the environment otherwise."""
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app.main:app",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+        ],
+        env=os.environ | {"LLM_FAKE": "true"},
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=100)
+    parser.add_argument("--pipeline", choices=["staged", "fused"])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument(
+        "--serve", action="store_true", help="start the API with the fake LLM"
+    )
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--timeout", type=float, default=300.0, help="seconds per request"
+    )
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if args.serve:
+        url = f"http://127.0.0.1:{args.port}"
+        server = start_server(args.port, args.workers)
+    try:
+        if server:
+            wait_for_server(url, server)
+        results, samples, seconds = asyncio.run(
+            run_load_test(url, args.runs, args.pipeline, args.timeout)
+        )
+        report(results, samples, seconds)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+        delete_runs()
+
+
+if __name__ == "__main__":
+    main()
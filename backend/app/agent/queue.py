@@ -0,0 +1,171 @@
+import uuid
+from datetime import datetime, timedelta
+
+from sqlmodel import Session, and_, col, delete, or_, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import settings
+from app.tables import AgentJob, AgentRun, Step
+
+
+class LeaseLost(Exception):
+    """The job's lease expired and another worker claimed it."""
+
+
+def enqueue_run(session: Session, agent_run: AgentRun) -> AgentJob:
+    """Add a queued job for the agent run, committed with the caller's transaction."""
+    job = AgentJob(agent_run=agent_run)
+    session.add(job)
+    return job
+
+
+def has_active_job(session: Session, agent_run_id: uuid.UUID) -> bool:
+    """Whether a job of the agent run is queued or running."""
+    statement = select(AgentJob.id).where(
+        col(AgentJob.agent_run_id) == agent_run_id,
+        col(AgentJob.status).in_(("queued", "running")),
+    )
+    return session.exec(statement).first() is not None
+
+
+def lease_expired_at() -> datetime:
+    """Running jobs locked before this lost their worker."""
+    return datetime.now() - timedelta(seconds=settings.AGENT_JOB_LEASE_SECONDS)
+
+
+async def fail_abandoned_jobs(session: AsyncSession) -> None:
+    """Fail the jobs whose worker died on their last attempt, and their runs.
+
+    A job that keeps killing its worker would otherwise be reclaimed forever.
+    """
+    statement = (
+        update(AgentJob)
+        .where(
+            col(AgentJob.status) == "running",
+            col(AgentJob.locked_at) < lease_expired_at(),
+            col(AgentJob.attempts) >= settings.AGENT_JOB_MAX_ATTEMPTS,
+        )
+        .values(status="failed", last_error="Lease expired on the last attempt")
+        .returning(col(AgentJob.agent_run_id))
+    )
+    result = await session.exec(statement)  # type: ignore[call-overload]
+    failed_run_ids: list[uuid.UUID] = list(result.scalars())
+    if failed_run_ids:
+        fail_runs = (
+            update(AgentRun)
+            .where(col(AgentRun.id).in_(failed_run_ids))
+            .values(status="failed", status_message="Agent processing failed")
+        )
+        await session.exec(fail_runs)  # type: ignore[call-overload]
+    await session.commit()
+
+
+async def claim_job(session: AsyncSession) -> AgentJob | None:
+    """Lock the oldest runnable job for this worker.
+
+    Queued jobs past their backoff and running jobs whose lease expired (their
+    worker crashed) with attempts left are runnable. `SKIP LOCKED` lets
+    concurrent workers claim different rows without waiting on each other.
+    """
+    await fail_abandoned_jobs(session)
+    statement = (
+        select(AgentJob)
+        .where(
+            or_(
+                and_(
+                    col(AgentJob.status) == "queued",
+                    or_(
+                        col(AgentJob.not_before).is_(None),
+                        col(AgentJob.not_before) <= datetime.now(),
+                    ),
+                ),
+                and_(
+                    col(AgentJob.status) == "running",
+                    col(AgentJob.locked_at) < lease_expired_at(),
+                    col(AgentJob.attempts) < settings.AGENT_JOB_MAX_ATTEMPTS,
+                ),
+            )
+        )
+        .order_by(col(AgentJob.created_at))
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+    job = (await session.exec(statement)).first()
+    if not job:
+        await session.commit()
+        return None
+
+    job.status = "running"
+    job.locked_at = datetime.now()
+    job.attempts += 1
+    session.add(job)
+    await session.commit()
+    return job
+
+
+async def renew_lease(session: AsyncSession, job: AgentJob) -> bool:
+    """Extend the lease of a job still running, so no other worker claims it.
+
+    False if the job is not this worker's claim anymore: it finished, or its
+    lease expired and another worker claimed it again.
+    """
+    statement = (
+        update(AgentJob)
+        .where(
+            col(AgentJob.id) == job.id,
+            col(AgentJob.status) == "running",
+            col(AgentJob.attempts) == job.attempts,
+        )
+        .values(locked_at=datetime.now())
+    )
+    result = await session.exec(statement)  # type: ignore[call-overload]
+    await session.commit()
+    return bool(result.rowcount)
+
+
+async def complete_job(session: AsyncSession, job: AgentJob) -> None:
+    job.status = "completed"
+    session.add(job)
+    await session.commit()
+
+
+def retry_backoff(attempts: int) -> timedelta:
+    """Wait before the next attempt of a job that failed `attempts` times."""
+    return timedelta(
+        seconds=settings.AGENT_JOB_RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1)
+    )
+
+
+async def reset_run(session: AsyncSession, agent_run: AgentRun) -> None:
+    """Set a failed run back to running for the next attempt of its job.
+
+    With checkpointing the attempt resumes at the last checkpoint and keeps
+    the steps before it, otherwise it starts over without the failed steps.
+    """
+    agent_run.status = "running"
+    agent_run.status_message = "Agent processing failed, retrying"
+    if not settings.AGENT_CHECKPOINTING:
+        statement = delete(Step).where(col(Step.agent_run_id) == agent_run.id)
+        await session.exec(statement)  # type: ignore[call-overload]
+        agent_run.prompt_tokens = 0
+        agent_run.completion_tokens = 0
+    session.add(agent_run)
+
+
+async def fail_job(session: AsyncSession, job: AgentJob, error: str) -> None:
+    """Requeue the job with a backoff, or fail its run after the last attempt."""
+    job.last_error = error
+    agent_run = await session.get(AgentRun, job.agent_run_id)
+    if job.attempts < settings.AGENT_JOB_MAX_ATTEMPTS:
+        job.status = "queued"
+        job.not_before = datetime.now() + retry_backoff(job.attempts)
+        if agent_run:
+            await reset_run(session, agent_run)
+    else:
+        job.status = "failed"
+        if agent_run:
+            agent_run.status = "failed"
+            agent_run.status_message = "Agent processing failed"
+            session.add(agent_run)
+    session.add(job)
+    await session.commit()
@@ -0,0 +1,149 @@
+"""In-process fan-out of agent run events to Server-Sent Event clients.
+
+The persistence helpers of the graph publish every step and status change,
+the email drafter every draft token, and `GET /agent/{run_id}/events` and
+`GET /agent/{run_id}/stream` push them to subscribed clients instead of
+clients polling the database. Sync runs publish from a worker thread, so
+events are handed to each subscriber's event loop with `call_soon_threadsafe`.
+Tokens of a draft in progress are kept until it is finished, so clients
+connecting late first receive the text generated so far.
+
+Only runs executing in the API process publish events, clients of runs
+executed by `app.worker` fall back to re-reading the run from the database.
+"""
+
+import asyncio
+import threading
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any
+
+from app.agent.run_state import StepRecord
+from app.tables import AgentRun
+
+TERMINAL_STATUSES = ("completed", "failed")
+
+
+@dataclass
+class RunEvent:
+    # "step", "status", "token" (a piece of the draft), "done" (draft persisted)
+    # or "run" (the full state of the run)
+    type: str
+    data: dict[str, Any]
+
+
+@dataclass
+class _Run:
+    tokens: list[str] = field(default_factory=list)
+    subscribers: list[tuple[asyncio.AbstractEventLoop, asyncio.Queue[RunEvent]]] = (
+        field(default_factory=list)
+    )
+
+
+_lock = threading.Lock()
+_runs: defaultdict[uuid.UUID, _Run] = defaultdict(_Run)
+
+
+def is_terminal(event: RunEvent) -> bool:
+    """Whether no further events follow for the run."""
+    if event.type in ("status", "run"):
+        return event.data["status"] in TERMINAL_STATUSES
+    return event.type == "done"
+
+
+def publish(agent_run_id: uuid.UUID, event: RunEvent) -> None:
+    with _lock:
+        if is_terminal(event):
+            run = _runs.pop(agent_run_id, None)
+        elif event.type == "token":
+            run = _runs[agent_run_id]
+            run.tokens.append(event.data["text"])
+        else:
+            run = _runs.get(agent_run_id)
+        if not run:
+            return
+        subscribers = list(run.subscribers)
+
+    for loop, queue in subscribers:
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+        except RuntimeError:
+            # The subscriber's event loop is closed
+            pass
+
+
+def step_event(step: StepRecord) -> RunEvent:
+    data = step.to_dict()
+    return RunEvent(
+        "step",
+        data
+        | {"id": str(step.id)}
+        | {
+            key: value.isoformat()
+            for key, value in data.items()
+            if isinstance(value, datetime)
+        },
+    )
+
+
+def status_event(status: str, status_message: str) -> RunEvent:
+    return RunEvent("status", {"status": status, "status_message": status_message})
+
+
+def done_event(agent_run: AgentRun) -> RunEvent:
+    return RunEvent(
+        "done",
+        {
+            "status": agent_run.status,
+            "status_message": agent_run.status_message,
+            "draft_subject": agent_run.draft_subject,
+            "draft_body": agent_run.draft_body,
+        },
+    )
+
+
+def publish_token(agent_run_id: uuid.UUID, text: str) -> None:
+    if text:
+        publish(agent_run_id, RunEvent("token", {"text": text}))
+
+
+class Subscription:
+    """Events of one run for one client, registered on creation.
+
+    Register before reading the run's current state, so no event published in
+    between is lost.
+    """
+
+    def __init__(self, agent_run_id: uuid.UUID) -> None:
+        self.agent_run_id = agent_run_id
+        self.queue: asyncio.Queue[RunEvent] = asyncio.Queue()
+        self._subscriber = (asyncio.get_running_loop(), self.queue)
+        with _lock:
+            run = _runs[agent_run_id]
+            backlog = "".join(run.tokens)
+            run.subscribers.append(self._subscriber)
+        if backlog:
+            self.queue.put_nowait(RunEvent("token", {"text": backlog}))
+
+    async def get(self, timeout: float) -> RunEvent | None:
+        """The next event, None if none arrived within `timeout` seconds."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self) -> None:
+        with _lock:
+            run = _runs.get(self.agent_run_id)
+            if run:
+                run.subscribers.remove(self._subscriber)
+                if not run.subscribers and not run.tokens:
+                    del _runs[self.agent_run_id]
+
+    def __enter__(self) -> "Subscription":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
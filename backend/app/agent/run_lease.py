@@ -0,0 +1,93 @@
+"""Leases of the agent runs executing in this process.
+
+`POST /agent/{run_id}/resume` must not start a run again that another API
+worker or `app.worker` is still executing. The process executing a run holds
+its lease: a background thread sets `AgentRun.lease_renewed_at` of all runs
+it holds, three times per AGENT_RUN_LEASE_SECONDS and in one UPDATE. A run
+whose lease was not renewed for longer lost its process.
+"""
+
+import threading
+import time
+import uuid
+from collections import Counter
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import ColumnElement
+from sqlmodel import Session, and_, col, or_, update
+
+from app.core.config import settings
+from app.core.db import engine
+from app.tables import AgentRun
+
+_lock = threading.Lock()
+# A run is held once by its batch and once by its graph run
+_held: Counter[uuid.UUID] = Counter()
+_renewer: threading.Thread | None = None
+
+
+def lease_expired_at() -> datetime:
+    """Runs whose lease was renewed before this lost their process."""
+    return datetime.now() - timedelta(seconds=settings.AGENT_RUN_LEASE_SECONDS)
+
+
+def is_resumable() -> ColumnElement[bool]:
+    """Runs that failed, or that are unfinished and lost their process."""
+    return or_(
+        col(AgentRun.status) == "failed",
+        and_(
+            col(AgentRun.status) != "completed",
+            or_(
+                col(AgentRun.lease_renewed_at).is_(None),
+                col(AgentRun.lease_renewed_at) < lease_expired_at(),
+            ),
+        ),
+    )
+
+
+def renew_leases(agent_run_ids: list[uuid.UUID]) -> None:
+    with Session(engine) as session:
+        statement = (
+            update(AgentRun)
+            .where(col(AgentRun.id).in_(agent_run_ids))
+            .values(lease_renewed_at=datetime.now())
+        )
+        session.exec(statement)  # type: ignore[call-overload]
+        session.commit()
+
+
+def _renew_forever() -> None:
+    while True:
+        time.sleep(settings.AGENT_RUN_LEASE_SECONDS / 3)
+        with _lock:
+            agent_run_ids = list(_held)
+        if not agent_run_ids:
+            continue
+        try:
+            renew_leases(agent_run_ids)
+        except Exception as e:
+            print(f"⚠️  Renewing the leases of {len(agent_run_ids)} runs failed: {e!r}")
+
+
+@contextmanager
+def hold_leases(agent_run_ids: Iterable[uuid.UUID]) -> Iterator[None]:
+    """Renew the leases of the runs until they finished executing here."""
+    global _renewer
+    agent_run_ids = list(agent_run_ids)
+    with _lock:
+        _held.update(agent_run_ids)
+        if not _renewer:
+            _renewer = threading.Thread(
+                target=_renew_forever, name="run-lease", daemon=True
+            )
+            _renewer.start()
+    try:
+        yield
+    finally:
+        with _lock:
+            _held.subtract(agent_run_ids)
+            for agent_run_id in agent_run_ids:
+                if _held[agent_run_id] <= 0:
+                    del _held[agent_run_id]
@@ -0,0 +1,162 @@
+"""In-process state of the agent runs executing in this process.
+
+Compact `__slots__` records of each run and its steps, updated by the nodes as
+they go. Steps are addressed by their primary key, and readers in the same
+process (`GET /agent/{run_id}`, the event stream) get the current state
+without a query, while the database only catches up once per node.
+"""
+
+import threading
+import uuid
+from datetime import datetime
+from typing import Any
+
+
+class StepRecord:
+    __slots__ = (
+        "id",
+        "type",
+        "text",
+        "status",
+        "created_at",
+        "started_at",
+        "finished_at",
+        "llm_seconds",
+        "db_seconds",
+        "prompt_tokens",
+        "completion_tokens",
+        "models",
+    )
+
+    def __init__(self, step_type: str, text: str, status: str) -> None:
+        self.id = uuid.uuid4()
+        self.type = step_type
+        self.text = text
+        self.status = status
+        self.created_at = datetime.now()
+        self.started_at = self.created_at
+        # Steps created already completed took no time of their own
+        self.finished_at = self.created_at if status == "completed" else None
+        self.llm_seconds = 0.0
+        self.db_seconds = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.models: list[str] = []
+
+    @classmethod
+    def restore(cls, values: dict[str, Any]) -> "StepRecord":
+        """A step an earlier attempt of the run wrote, from its `Step` columns."""
+        step = cls(values["type"], values["text"], values["status"])
+        step.id = values["id"]
+        step.created_at = values["created_at"]
+        step.started_at = values["started_at"] or values["created_at"]
+        step.finished_at = values["finished_at"]
+        step.llm_seconds = values["llm_seconds"]
+        step.db_seconds = values["db_seconds"]
+        step.prompt_tokens = values["prompt_tokens"]
+        step.completion_tokens = values["completion_tokens"]
+        step.models = values["model"].split(", ") if values["model"] else []
+        return step
+
+    def telemetry(self) -> dict[str, Any]:
+        """The timing and usage columns of the step."""
+        return {
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "llm_seconds": self.llm_seconds,
+            "db_seconds": self.db_seconds,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "model": ", ".join(self.models) or None,
+        }
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "type": self.type,
+            "text": self.text,
+            "status": self.status,
+            "created_at": self.created_at,
+        } | self.telemetry()
+
+
+class RunState:
+    __slots__ = (
+        "agent_run_id",
+        "status",
+        "status_message",
+        "draft_subject",
+        "draft_body",
+        "prompt_tokens",
+        "completion_tokens",
+        "steps",
+        "latest_steps",
+    )
+
+    def __init__(self, agent_run_id: uuid.UUID) -> None:
+        # Same initial values as the AgentRun rows created by the API
+        self.agent_run_id = agent_run_id
+        self.status = "running"
+        self.status_message = "Agent processing started"
+        self.draft_subject = ""
+        self.draft_body = ""
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.steps: list[StepRecord] = []
+        # Most recent step of each type
+        self.latest_steps: dict[str, StepRecord] = {}
+
+    def add_step(self, step_type: str, text: str, status: str) -> StepRecord:
+        step = StepRecord(step_type, text, status)
+        self.steps.append(step)
+        self.latest_steps[step_type] = step
+        return step
+
+    def restore(self, agent_run: dict[str, Any], steps: list[dict[str, Any]]) -> None:
+        """Continue from the `AgentRun` and `Step` columns of an earlier attempt."""
+        for field in (
+            "status",
+            "status_message",
+            "draft_subject",
+            "draft_body",
+            "prompt_tokens",
+            "completion_tokens",
+        ):
+            setattr(self, field, agent_run[field])
+        for values in sorted(steps, key=lambda values: values["created_at"]):
+            step = StepRecord.restore(values)
+            self.steps.append(step)
+            self.latest_steps[step.type] = step
+
+    def snapshot(self) -> dict[str, Any]:
+        """The run in the shape of `GET /agent/{run_id}`."""
+        return {
+            "steps": [step.to_dict() for step in list(self.steps)],
+            "status": self.status,
+            "status_message": self.status_message,
+            "draft_body": self.draft_body,
+            "draft_subject": self.draft_subject,
+        }
+
+
+_lock = threading.Lock()
+_runs: dict[uuid.UUID, RunState] = {}
+
+
+def track(agent_run_id: uuid.UUID) -> RunState:
+    """Start tracking a run executing in this process."""
+    run_state = RunState(agent_run_id)
+    with _lock:
+        _runs[agent_run_id] = run_state
+    return run_state
+
+
+def untrack(agent_run_id: uuid.UUID) -> None:
+    """Stop tracking a run once all its updates are written to the database."""
+    with _lock:
+        _runs.pop(agent_run_id, None)
+
+
+def get_run_state(agent_run_id: uuid.UUID) -> RunState | None:
+    with _lock:
+        return _runs.get(agent_run_id)
@@ -0,0 +1,150 @@
+"""Embedding based routing for the master agent.
+
+Each mail is embedded once and compared against the embeddings of labelled
+exemplar mails, the routing decisions the master agent already stored. The
+exemplar matrix is a memory-mapped .npy file, so all workers on a host share
+the same pages instead of each loading a copy.
+
+    python -m app.agent.semantic_router --output routing_exemplars
+
+Set ROUTING_EXEMPLARS_PATH to the output directory to enable it. Mails whose
+nearest exemplars disagree (ROUTING_EMBEDDING_THRESHOLD) still go through the
+LLM.
+"""
+
+import argparse
+import os
+from functools import lru_cache
+
+import numpy as np
+from sqlmodel import Session
+
+from app.agent.classifier import load_training_data
+from app.core.config import settings
+from app.core.db import engine
+from app.services.watsonx_provider import WatsonxProvider
+
+EMBEDDINGS_FILE = "embeddings.npy"
+LABELS_FILE = "labels.npy"
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1)
+
+
+class SemanticRouter:
+    def __init__(self, embeddings: np.ndarray, labels: np.ndarray, k: int) -> None:
+        # Rows are L2-normalized, so a dot product is the cosine similarity
+        self.embeddings = embeddings
+        classes, label_indices = np.unique(labels, return_inverse=True)
+        self.classes: list[str] = classes.tolist()
+        self.label_indices = label_indices
+        self.k = min(k, len(labels))
+
+    def route(self, embedding: list[float]) -> tuple[str, float]:
+        """Similarity-weighted vote of the k nearest exemplars and its share."""
+        similarities = self.embeddings @ normalize(np.asarray(embedding, np.float32))
+        nearest = np.argpartition(-similarities, self.k - 1)[: self.k]
+        votes = np.bincount(
+            self.label_indices[nearest],
+            weights=np.clip(similarities[nearest], 0, None),
+            minlength=len(self.classes),
+        )
+        best = int(votes.argmax())
+        total = votes.sum()
+        return self.classes[best], float(votes[best] / total) if total > 0 else 0.0
+
+    @classmethod
+    def load(cls, path: str, k: int) -> "SemanticRouter":
+        return cls(
+            np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode="r"),
+            np.load(os.path.join(path, LABELS_FILE)),
+            k,
+        )
+
+    @staticmethod
+    def save(path: str, embeddings: list[list[float]], labels: list[str]) -> None:
+        os.makedirs(path, exist_ok=True)
+        np.save(
+            os.path.join(path, EMBEDDINGS_FILE),
+            normalize(np.asarray(embeddings, dtype=np.float32)),
+        )
+        np.save(os.path.join(path, LABELS_FILE), np.asarray(labels))
+
+
+@lru_cache
+def get_semantic_router() -> SemanticRouter | None:
+    if not settings.ROUTING_EXEMPLARS_PATH:
+        return None
+    try:
+        return SemanticRouter.load(
+            settings.ROUTING_EXEMPLARS_PATH, settings.ROUTING_EMBEDDING_NEIGHBOURS
+        )
+    except FileNotFoundError:
+        print(
+            f"⚠️  Routing exemplars '{settings.ROUTING_EXEMPLARS_PATH}' not found, routing with the LLM"
+        )
+        return None
+
+
+def decide(router: SemanticRouter, embedding: list[float]) -> str | None:
+    expert_agent, confidence = router.route(embedding)
+    if confidence < settings.ROUTING_EMBEDDING_THRESHOLD:
+        return None
+
+    print(
+        f"🧭 Embedding router routed to '{expert_agent}' (confidence {confidence:.2f})"
+    )
+    return expert_agent
+
+
+def route_with_embeddings(mail: str) -> str | None:
+    """Expert agent for `mail` if its nearest exemplars agree on one."""
+    router = get_semantic_router()
+    if not router:
+        return None
+    try:
+        [embedding] = WatsonxProvider.instance().embed(
+            settings.ROUTING_EMBEDDING_MODEL, [mail]
+        )
+    except Exception as e:
+        print(f"⚠️  Embedding mail failed, routing with the LLM: {e!r}")
+        return None
+    return decide(router, embedding)
+
+
+async def aroute_with_embeddings(mail: str) -> str | None:
+    """Async variant of `route_with_embeddings`."""
+    router = get_semantic_router()
+    if not router:
+        return None
+    try:
+        [embedding] = await WatsonxProvider.instance().aembed(
+            settings.ROUTING_EMBEDDING_MODEL, [mail]
+        )
+    except Exception as e:
+        print(f"⚠️  Embedding mail failed, routing with the LLM: {e!r}")
+        return None
+    return decide(router, embedding)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build the routing exemplars")
+    parser.add_argument("--output", default="routing_exemplars")
+    args = parser.parse_args()
+
+    with Session(engine) as session:
+        texts, labels = load_training_data(session)
+    if not texts:
+        raise SystemExit("No routing decisions to build exemplars from")
+
+    embeddings = WatsonxProvider.instance().embed(
+        settings.ROUTING_EMBEDDING_MODEL, texts
+    )
+    SemanticRouter.save(args.output, embeddings, labels)
+    print(f"Saved {len(texts)} routing exemplars to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
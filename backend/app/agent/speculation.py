@@ -0,0 +1,76 @@
+"""Speculative expert execution for the async graph.
+
+While the master agent is still routing with the LLM, the most likely experts
+already analyze the mail. The analysis of the expert the master agent picks
+is handed to the expert node, the other speculative calls are cancelled.
+Every speculated expert costs an additional LLM call, AGENT_SPECULATIVE_EXPERTS
+bounds how many are started per run.
+"""
+
+import asyncio
+from collections.abc import Awaitable, Callable
+
+from app.agent.classifier import get_routing_classifier
+from app.agent.experts import EXPERTS
+
+
+def speculative_candidates(mail: str, k: int) -> list[str]:
+    """The `k` most likely expert agents for `mail`."""
+    classifier = get_routing_classifier()
+    if classifier:
+        return [
+            expert_agent
+            for expert_agent, _ in classifier.rank(mail)
+            if expert_agent in EXPERTS
+        ][:k]
+
+    # Cheap prior when no routing classifier is trained
+    text = mail.lower()
+    hits = {
+        expert_agent: sum(text.count(keyword) for keyword in expert.keywords)
+        for expert_agent, expert in EXPERTS.items()
+    }
+    ranking = sorted(hits, key=hits.__getitem__, reverse=True)
+    return [expert_agent for expert_agent in ranking if hits[expert_agent] > 0][:k]
+
+
+def start_speculation(
+    mail: str, k: int, analyze: Callable[[str], Awaitable[str]]
+) -> dict[str, asyncio.Task[str]]:
+    """Start `analyze` for the `k` most likely experts in the background."""
+    if k <= 0:
+        return {}
+    candidates = speculative_candidates(mail, k)
+    if candidates:
+        print(f"🔮 Speculatively running experts: {', '.join(candidates)}")
+    return {
+        expert_agent: asyncio.create_task(analyze(expert_agent))
+        for expert_agent in candidates
+    }
+
+
+def cancel_speculation(tasks: dict[str, asyncio.Task[str]]) -> None:
+    for task in tasks.values():
+        task.cancel()
+
+
+async def resolve_speculation(
+    tasks: dict[str, asyncio.Task[str]], expert_agent: str
+) -> str | None:
+    """Analysis of the chosen expert if it was speculated, cancelling the others."""
+    task = tasks.pop(expert_agent, None)
+    cancel_speculation(tasks)
+    # The LLM calls of the others are all recorded once they stopped
+    await asyncio.gather(*tasks.values(), return_exceptions=True)
+    if not task:
+        if tasks:
+            print(f"🔮 Speculation missed, '{expert_agent}' was not speculated")
+        return None
+
+    try:
+        analysis = await task
+    except Exception as e:
+        print(f"⚠️  Speculative '{expert_agent}' analysis failed: {e!r}")
+        return None
+    print(f"🔮 Speculation hit for '{expert_agent}'")
+    return analysis
@@ -0,0 +1,89 @@
+"""Token budgets of the LLM calls of the agent graph.
+
+Prompts are counted locally before every call, so an oversize prompt fails
+before it is sent and `max_tokens` never asks for more than the context window
+has left. The tokenizer of the served model is not available locally, the
+count is a conservative estimate from the length of the text. The usage
+watsonx reports for a call replaces the estimate when it is recorded on the
+run.
+"""
+
+import math
+from collections.abc import Sequence
+from typing import Any
+
+from langchain_core.messages import BaseMessage
+
+from app.core.config import settings
+
+# Llama tokenizers average about 4 characters per token on German text,
+# estimating with 3 overcounts rather than undercounts
+CHARS_PER_TOKEN = 3
+# Tokens of the chat template around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+# Smallest completion budget worth sending a prompt for
+MIN_COMPLETION_TOKENS = 256
+TRUNCATION_MARKER = "\n[...]\n"
+
+
+class ContextWindowExceeded(Exception):
+    pass
+
+
+def count_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def content_text(content: str | list[str | dict[Any, Any]]) -> str:
+    """Text of message content, also of content given as a list of parts."""
+    if isinstance(content, str):
+        return content
+    return "".join(
+        part if isinstance(part, str) else str(part.get("text", "")) for part in content
+    )
+
+
+def count_prompt_tokens(messages: Sequence[BaseMessage]) -> int:
+    return sum(
+        count_tokens(content_text(message.content)) + MESSAGE_OVERHEAD_TOKENS
+        for message in messages
+    )
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Shorten `text` to about `max_tokens` by cutting out its middle.
+
+    Mails state their request at the start and the sender at the end, quoted
+    history and attachments in between are the first to go.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    keep = max_chars - len(TRUNCATION_MARKER)
+    head = keep * 3 // 4
+    return text[:head] + TRUNCATION_MARKER + text[len(text) - (keep - head) :]
+
+
+def completion_budget(
+    messages: Sequence[BaseMessage], max_tokens: int
+) -> tuple[int, int]:
+    """Prompt tokens of `messages` and `max_tokens` clamped to the context window.
+
+    Raises `ContextWindowExceeded` if the prompt leaves no room for an answer.
+    """
+    prompt_tokens = count_prompt_tokens(messages)
+    available = settings.AGENT_CONTEXT_WINDOW - prompt_tokens
+    if available < min(max_tokens, MIN_COMPLETION_TOKENS):
+        raise ContextWindowExceeded(
+            f"Prompt of about {prompt_tokens} tokens exceeds the context window "
+            f"of {settings.AGENT_CONTEXT_WINDOW} tokens"
+        )
+    return prompt_tokens, min(max_tokens, available)
+
+
+def usage(response: BaseMessage, prompt_tokens: int) -> tuple[int, int]:
+    """Prompt and completion tokens of a call, as reported by watsonx or estimated."""
+    usage_metadata = getattr(response, "usage_metadata", None)
+    if usage_metadata:
+        return usage_metadata["input_tokens"], usage_metadata["output_tokens"]
+    return prompt_tokens, count_tokens(content_text(response.content))
@@ -0,0 +1,296 @@
+"""Write-behind buffer for the Step and AgentRun updates of an agent run.
+
+Nodes record their steps and status changes in memory, `build_graph` flushes
+them in a single transaction once the node finished. A step created and
+completed within one node is inserted once, already completed, and all status
+updates of a node collapse into one UPDATE. New steps are inserted in creation
+order and each node's updates are committed atomically, so the database always
+shows the run as of its last finished node. Updates whose transaction failed
+stay buffered and are written with the next flush.
+
+The run's `RunState` and the SSE clients see every update right away, the
+`done` event is published once the draft is committed, and the `failed`
+status once the failure is.
+
+The step a node is running collects the time and tokens of its LLM calls and
+the time the node's updates took to write. A write is timed once it is
+committed, so its time is written with the next flush of the run. Speculative
+expert analyses record their calls in an `LLMUsage` instead, which the
+expert's step takes over if the master agent picks that expert.
+"""
+
+import time
+import uuid
+from datetime import datetime
+from typing import Any, NamedTuple
+
+from sqlalchemy.sql.dml import UpdateBase
+from sqlmodel import Session, col, insert, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.agent.run_events import RunEvent, publish, status_event, step_event
+from app.agent.run_state import RunState, StepRecord
+from app.core.metrics import SPECULATION_DISCARDED_TOKENS
+from app.tables import AgentRun, Step
+
+# Steps to insert, steps to update and the updated AgentRun fields
+Updates = tuple[
+    dict[uuid.UUID, StepRecord], dict[uuid.UUID, StepRecord], dict[str, Any]
+]
+Statements = list[tuple[UpdateBase, list[dict[str, Any]] | None]]
+
+
+class LLMCall(NamedTuple):
+    model: str
+    seconds: float
+    prompt_tokens: int
+    completion_tokens: int
+
+
+class LLMUsage:
+    """LLM calls recorded apart from the run, like those of a speculative analysis."""
+
+    def __init__(self) -> None:
+        self.calls: list[LLMCall] = []
+
+    def record_llm_call(
+        self, model: str, seconds: float, prompt_tokens: int, completion_tokens: int
+    ) -> None:
+        self.calls.append(LLMCall(model, seconds, prompt_tokens, completion_tokens))
+
+    @property
+    def tokens(self) -> int:
+        return sum(call.prompt_tokens + call.completion_tokens for call in self.calls)
+
+
+class RunBuffer:
+    def __init__(self, run_state: RunState) -> None:
+        self.run_state = run_state
+        self.agent_run_id = run_state.agent_run_id
+        # Steps not inserted yet, and inserted steps changed since, by id
+        self._new_steps: dict[uuid.UUID, StepRecord] = {}
+        self._changed_steps: dict[uuid.UUID, StepRecord] = {}
+        self._run_updates: dict[str, Any] = {}
+        self._done: RunEvent | None = None
+        # Most recent running step, the one of the node in progress
+        self._current_step: StepRecord | None = None
+        # Speculative analysis the master agent picked, and its LLM calls
+        self._adopted: tuple[str, LLMUsage] | None = None
+
+    def _changed(self, step: StepRecord) -> None:
+        if step.id not in self._new_steps:
+            self._changed_steps[step.id] = step
+
+    def create_step(
+        self, step_type: str, text: str, status: str = "completed"
+    ) -> StepRecord:
+        step = self.run_state.add_step(step_type, text, status)
+        self._new_steps[step.id] = step
+        if status == "running":
+            self._current_step = step
+        publish(self.agent_run_id, step_event(step))
+        return step
+
+    def finish_step(self, step: StepRecord, text: str) -> None:
+        """Mark `step` as completed."""
+        step.status = "completed"
+        step.text = text
+        step.finished_at = datetime.now()
+        self._changed(step)
+        publish(self.agent_run_id, step_event(step))
+
+    def complete_step(self, step_type: str, text: str) -> None:
+        """Mark the most recent step of a type as completed."""
+        step = self.run_state.latest_steps.get(step_type)
+        if step:
+            self.finish_step(step, text)
+
+    def _update_run(self, **updates: Any) -> None:
+        for field, value in updates.items():
+            setattr(self.run_state, field, value)
+        self._run_updates |= updates
+
+    def update_run_status(self, status: str, status_message: str) -> None:
+        self._update_run(status=status, status_message=status_message)
+        publish(self.agent_run_id, status_event(status, status_message))
+
+    def record_usage(self, prompt_tokens: int, completion_tokens: int) -> None:
+        """Add the tokens of an LLM call to the run's totals."""
+        self._update_run(
+            prompt_tokens=self.run_state.prompt_tokens + prompt_tokens,
+            completion_tokens=self.run_state.completion_tokens + completion_tokens,
+        )
+
+    def record_llm_call(
+        self, model: str, seconds: float, prompt_tokens: int, completion_tokens: int
+    ) -> None:
+        """Add an LLM call to the current step and its tokens to the run's totals."""
+        self.record_usage(prompt_tokens, completion_tokens)
+        self._book_llm_call(model, seconds, prompt_tokens, completion_tokens)
+
+    def _book_llm_call(
+        self, model: str, seconds: float, prompt_tokens: int, completion_tokens: int
+    ) -> None:
+        step = self._current_step
+        if not step:
+            return
+        step.llm_seconds += seconds
+        step.prompt_tokens += prompt_tokens
+        step.completion_tokens += completion_tokens
+        if model not in step.models:
+            step.models.append(model)
+        self._changed(step)
+
+    def record_speculation(
+        self, usage: dict[str, LLMUsage], adopted: str | None
+    ) -> None:
+        """Add the tokens of speculative analyses, by expert, to the run's totals.
+
+        The calls of the `adopted` analysis are booked on its expert's step by
+        `adopt_speculation`, the tokens of the others are counted as discarded.
+        """
+        for expert_agent, expert_usage in usage.items():
+            for call in expert_usage.calls:
+                self.record_usage(call.prompt_tokens, call.completion_tokens)
+            if expert_agent == adopted:
+                self._adopted = (expert_agent, expert_usage)
+            elif expert_usage.tokens:
+                SPECULATION_DISCARDED_TOKENS.labels(expert_agent).inc(
+                    expert_usage.tokens
+                )
+
+    def adopt_speculation(self, expert_agent: str) -> None:
+        """Book the LLM calls of the adopted analysis on the current step."""
+        if self._adopted and self._adopted[0] == expert_agent:
+            for call in self._adopted[1].calls:
+                self._book_llm_call(*call)
+        self._adopted = None
+
+    def _record_db_time(self, seconds: float) -> None:
+        step = self._current_step
+        if step:
+            step.db_seconds += seconds
+            self._changed(step)
+
+    def complete_run(self, draft_subject: str, draft_body: str) -> None:
+        """Save the draft and mark the run as completed."""
+        self._update_run(
+            status="completed",
+            status_message="Email response generated successfully",
+            draft_subject=draft_subject,
+            draft_body=draft_body,
+        )
+        self._done = RunEvent("done", dict(self._run_updates))
+
+    def fail_run(self) -> None:
+        """Mark the run as failed, its clients are told once that is written."""
+        self._update_run(status="failed", status_message="Agent processing failed")
+        self._done = status_event("failed", "Agent processing failed")
+
+    def restore(self, agent_run: AgentRun) -> None:
+        """Continue a run an earlier attempt left unfinished.
+
+        Steps still running were interrupted with their node, which runs again
+        with a new step.
+        """
+        self.run_state.restore(
+            agent_run.model_dump(), [step.model_dump() for step in agent_run.steps]
+        )
+        for step in self.run_state.steps:
+            if step.status == "running":
+                step.status = "interrupted"
+                step.finished_at = datetime.now()
+                self._changed(step)
+        self.update_run_status("running", "Resuming agent run")
+
+    def _take(self) -> Updates:
+        """The buffered updates, emptying the buffer."""
+        updates = (self._new_steps, self._changed_steps, self._run_updates)
+        self._new_steps = {}
+        self._changed_steps = {}
+        self._run_updates = {}
+        return updates
+
+    def _put_back(self, updates: Updates) -> None:
+        """Buffer updates whose transaction failed again, before newer ones."""
+        new_steps, changed_steps, run_updates = updates
+        self._new_steps = new_steps | self._new_steps
+        self._changed_steps = {
+            step_id: step
+            for step_id, step in (changed_steps | self._changed_steps).items()
+            if step_id not in self._new_steps
+        }
+        self._run_updates = run_updates | self._run_updates
+
+    def _statements(self, updates: Updates) -> Statements:
+        """The statements writing `updates`."""
+        new_steps, changed_steps, run_updates = updates
+        statements: Statements = []
+        if new_steps:
+            statements.append(
+                (
+                    insert(Step),
+                    [
+                        step.to_dict() | {"agent_run_id": self.agent_run_id}
+                        for step in new_steps.values()
+                    ],
+                )
+            )
+        for step in changed_steps.values():
+            statement: UpdateBase = (
+                update(Step)
+                .where(col(Step.id) == step.id)
+                .values(status=step.status, text=step.text, **step.telemetry())
+            )
+            statements.append((statement, None))
+        if run_updates:
+            statement = (
+                update(AgentRun)
+                .where(col(AgentRun.id) == self.agent_run_id)
+                .values(**run_updates)
+            )
+            statements.append((statement, None))
+        return statements
+
+    def publish_done(self) -> None:
+        """Publish the final event of a completed or failed run, once."""
+        if self._done:
+            publish(self.agent_run_id, self._done)
+            self._done = None
+
+    def flush(self, session: Session) -> None:
+        """Write the buffered updates in one transaction.
+
+        If it fails they stay buffered, the caller rolls `session` back.
+        """
+        updates = self._take()
+        statements = self._statements(updates)
+        if not statements:
+            return
+        start_time = time.perf_counter()
+        try:
+            for statement, params in statements:
+                session.exec(statement, params=params)  # type: ignore[call-overload]
+            session.commit()
+        except BaseException:
+            self._put_back(updates)
+            raise
+        self._record_db_time(time.perf_counter() - start_time)
+        self.publish_done()
+
+    async def aflush(self, session: AsyncSession) -> None:
+        """Async variant of `flush`."""
+        updates = self._take()
+        statements = self._statements(updates)
+        if not statements:
+            return
+        start_time = time.perf_counter()
+        try:
+            for statement, params in statements:
+                await session.exec(statement, params=params)  # type: ignore[call-overload]
+            await session.commit()
+        except BaseException:
+            self._put_back(updates)
+            raise
+        self._record_db_time(time.perf_counter() - start_time)
+        self.publish_done()
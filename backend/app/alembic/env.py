@@ -20,6 +20,7 @@ fileConfig(config.config_file_name)
 
 from app.tables import SQLModel  # noqa
 from app.core.config import settings # noqa
+from app.agent.checkpoint import CHECKPOINT_TABLES # noqa
 
 target_metadata = SQLModel.metadata
 
@@ -29,6 +30,11 @@ target_metadata = SQLModel.metadata
 # ... etc.
 
 
+def include_name(name, type_, *_):
+    # Tables of the graph checkpointer are created by `app/initial_data.py`
+    return not (type_ == "table" and name in CHECKPOINT_TABLES)
+
+
 def get_url():
     return str(settings.SQLALCHEMY_DATABASE_URI)
 
@@ -47,7 +53,11 @@ def run_migrations_offline():
     """
     url = get_url()
     context.configure(
-        url=url, target_metadata=target_metadata, literal_binds=True, compare_type=True
+        url=url,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        compare_type=True,
+        include_name=include_name,
     )
 
     with context.begin_transaction():
@@ -71,7 +81,10 @@ def run_migrations_online():
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata, compare_type=True
+            connection=connection,
+            target_metadata=target_metadata,
+            compare_type=True,
+            include_name=include_name,
         )
 
         with context.begin_transaction():
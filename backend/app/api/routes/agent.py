@@ -1,16 +1,53 @@
+import asyncio
+import importlib
+import json
 import uuid
+from collections.abc import AsyncIterator
 from datetime import datetime
+from types import ModuleType
+from typing import Any, Literal
 
-from fastapi import APIRouter, BackgroundTasks, HTTPException
-from sqlmodel import SQLModel
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter, ValidationError
+from sqlmodel import Session, SQLModel, col, func, select, update
 
-from app.agent.langflow import run_langflow
-from app.agent.langgraph import run_graph
+from app.agent.queue import enqueue_run, has_active_job
+from app.agent.run_events import (
+    TERMINAL_STATUSES,
+    RunEvent,
+    Subscription,
+    done_event,
+    is_terminal,
+)
+from app.agent.run_lease import is_resumable
+from app.agent.run_state import get_run_state
 from app.api.deps import SessionDep
+from app.core.config import settings
+from app.core.db import engine
 from app.tables import AgentRun
 
 router = APIRouter()
 
+# The handlers starting runs import the agents when called. `app.agent.langgraph`
+# loads LangGraph, LangChain and the watsonx SDK, which takes seconds, the API
+# serves everything else meanwhile and the lifespan loads it in the background
+
+
+async def import_langgraph() -> ModuleType:
+    """`app.agent.langgraph`, imported in a worker thread.
+
+    Until the lifespan finished loading it the import waits for it, without
+    blocking the event loop.
+    """
+    return await asyncio.to_thread(importlib.import_module, "app.agent.langgraph")
+
+
+# Seconds between keepalive comments of the event streams, which also re-read
+# the run in case it is executed by another process
+RUN_EVENTS_KEEPALIVE = 5.0
+
 
 class AgentRunResponse(SQLModel):
     run_id: uuid.UUID
@@ -24,6 +61,24 @@ class Step(SQLModel):
     created_at: datetime
 
 
+class Mail(SQLModel):
+    subject: str
+    body: str
+    sender: str
+
+
+class BatchRunResponse(SQLModel):
+    batch_id: uuid.UUID
+    run_ids: list[uuid.UUID]
+
+
+class BatchStatusResponse(SQLModel):
+    batch_id: uuid.UUID
+    total: int
+    # Number of runs per AgentRun status, e.g. {"running": 3, "completed": 7}
+    statuses: dict[str, int]
+
+
 class AgentStatusResponse(SQLModel):
     steps: list[Step]
     status: str
@@ -32,6 +87,35 @@ class AgentStatusResponse(SQLModel):
     draft_subject: str
 
 
+class TimelineStep(SQLModel):
+    id: uuid.UUID
+    type: str
+    status: str
+    # Models of the step's LLM calls, None if it made none
+    model: str | None
+    started_at: datetime
+    finished_at: datetime | None
+    # Seconds from the start of the run to the start of the step, and its length
+    offset_seconds: float
+    duration_seconds: float | None
+    # Seconds spent on the step's LLM calls, and on writing its updates once done
+    llm_seconds: float
+    db_seconds: float
+    prompt_tokens: int
+    completion_tokens: int
+
+
+class AgentTimelineResponse(SQLModel):
+    status: str
+    started_at: datetime | None
+    # Seconds from the start of the first step to the end of the last one,
+    # None while a step is running
+    duration_seconds: float | None
+    prompt_tokens: int
+    completion_tokens: int
+    steps: list[TimelineStep]
+
+
 @router.get("/langgraph", response_model=AgentRunResponse)
 async def start_agent(
     session: SessionDep,
@@ -39,8 +123,11 @@ async def start_agent(
     subject: str,
     body: str,
     sender: str,
+    pipeline: Literal["staged", "fused"] | None = None,
 ):
-    mail = f"Subject: {subject}\nBody: {body}\nSender: {sender}"
+    langgraph = await import_langgraph()
+    mail = langgraph.format_mail(subject, body, sender)
+    pipeline = pipeline or settings.AGENT_PIPELINE
 
     # Create new agent run record
     agent_run = AgentRun(
@@ -51,28 +138,149 @@ async def start_agent(
         status_message="Agent processing started",
         draft_body="",
         draft_subject="",
+        pipeline=pipeline,
+        # Renewed once the run executes
+        lease_renewed_at=datetime.now(),
     )
     session.add(agent_run)
+    if settings.AGENT_RUN_BACKEND == "queue":
+        # Persisted in the same transaction, picked up by `app.worker`
+        enqueue_run(session, agent_run)
+    # Read before the commit expires it, reloading it would hold a pooled
+    # connection until the background task is done
+    run_id = agent_run.id
+    session.commit()
+
+    if settings.AGENT_RUN_BACKEND == "background":
+        if settings.AGENT_EXECUTION_MODE == "async":
+            background_tasks.add_task(langgraph.arun_graph, mail, run_id, pipeline)
+        else:
+            background_tasks.add_task(
+                langgraph.run_graph, mail, session, run_id, pipeline
+            )
+
+    return AgentRunResponse(run_id=run_id)
+
+
+async def read_mails(request: Request) -> list[Mail]:
+    """Parse a JSON array of mails, or one mail per line for NDJSON bodies.
+
+    A body without any mail is rejected like an invalid one.
+    """
+    try:
+        if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+            mails = []
+            buffer = b""
+            async for chunk in request.stream():
+                *lines, buffer = (buffer + chunk).split(b"\n")
+                mails += [
+                    Mail.model_validate_json(line) for line in lines if line.strip()
+                ]
+            if buffer.strip():
+                mails.append(Mail.model_validate_json(buffer))
+        else:
+            mails = TypeAdapter(list[Mail]).validate_json(await request.body())
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    if not mails:
+        raise RequestValidationError(
+            [{"type": "too_short", "loc": ("body",), "msg": "No mails given"}]
+        )
+    return mails
+
+
+@router.post(
+    "/langgraph/batch",
+    response_model=BatchRunResponse,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {"type": "array", "items": Mail.model_json_schema()}
+                },
+                "application/x-ndjson": {"schema": Mail.model_json_schema()},
+            },
+        }
+    },
+)
+async def start_agent_batch(
+    session: SessionDep,
+    background_tasks: BackgroundTasks,
+    request: Request,
+    pipeline: Literal["staged", "fused"] | None = None,
+) -> BatchRunResponse:
+    """
+    Start one agent run per mail, created in a single bulk insert.
+    """
+    mails = await read_mails(request)
+    pipeline = pipeline or settings.AGENT_PIPELINE
+    batch_id = uuid.uuid4()
+    created_at = datetime.now()
+    agent_runs = [
+        AgentRun(
+            mail_sender=mail.sender,
+            mail_subject=mail.subject,
+            mail_body=mail.body,
+            status="running",
+            status_message="Agent processing started",
+            draft_body="",
+            draft_subject="",
+            batch_id=batch_id,
+            pipeline=pipeline,
+            lease_renewed_at=created_at,
+        )
+        for mail in mails
+    ]
+    session.add_all(agent_runs)
+    if settings.AGENT_RUN_BACKEND == "queue":
+        for agent_run in agent_runs:
+            enqueue_run(session, agent_run)
+    run_ids = [agent_run.id for agent_run in agent_runs]
     session.commit()
-    session.refresh(agent_run)
 
-    background_tasks.add_task(run_graph, mail, session, agent_run.id)
+    if settings.AGENT_RUN_BACKEND == "background":
+        langgraph = await import_langgraph()
+        background_tasks.add_task(
+            langgraph.run_graph_batch,
+            [
+                (langgraph.format_mail(mail.subject, mail.body, mail.sender), run_id)
+                for mail, run_id in zip(mails, run_ids, strict=True)
+            ],
+            settings.AGENT_BATCH_CONCURRENCY,
+            pipeline,
+        )
 
-    return AgentRunResponse(run_id=agent_run.id)
+    return BatchRunResponse(batch_id=batch_id, run_ids=run_ids)
+
+
+@router.get("/batch/{batch_id}", response_model=BatchStatusResponse)
+async def get_agent_batch(
+    session: SessionDep, batch_id: uuid.UUID
+) -> BatchStatusResponse:
+    statement = (
+        select(AgentRun.status, func.count())
+        .where(AgentRun.batch_id == batch_id)
+        .group_by(AgentRun.status)
+    )
+    statuses = dict(session.exec(statement).all())
+    if not statuses:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    return BatchStatusResponse(
+        batch_id=batch_id, total=sum(statuses.values()), statuses=statuses
+    )
 
 
 @router.get("/langflow", response_model=AgentRunResponse)
 async def start_agent_langflow():
+    from app.agent.langflow import run_langflow
+
     response = run_langflow()
     return AgentRunResponse(message=response)
 
 
-@router.get("/{run_id}", response_model=AgentStatusResponse)
-async def get_agent_run(session: SessionDep, run_id: uuid.UUID):
-    agent_run = session.get(AgentRun, run_id)
-    if not agent_run:
-        raise HTTPException(status_code=404, detail="Agent run not found")
-
+def agent_status(agent_run: AgentRun) -> AgentStatusResponse:
     return AgentStatusResponse(
         steps=agent_run.steps,
         status=agent_run.status,
@@ -80,3 +288,249 @@ async def get_agent_run(session: SessionDep, run_id: uuid.UUID):
         draft_body=agent_run.draft_body,
         draft_subject=agent_run.draft_subject,
     )
+
+
+@router.get("/{run_id}", response_model=AgentStatusResponse)
+async def get_agent_run(session: SessionDep, run_id: uuid.UUID) -> AgentStatusResponse:
+    # Runs executing in this process, fresher than the database
+    run_state = get_run_state(run_id)
+    if run_state:
+        return AgentStatusResponse.model_validate(run_state.snapshot())
+
+    agent_run = session.get(AgentRun, run_id)
+    if not agent_run:
+        raise HTTPException(status_code=404, detail="Agent run not found")
+
+    return agent_status(agent_run)
+
+
+@router.post("/{run_id}/resume", response_model=AgentRunResponse)
+async def resume_agent_run(
+    session: SessionDep, background_tasks: BackgroundTasks, run_id: uuid.UUID
+) -> AgentRunResponse:
+    """
+    Execute a run again that a crashed or restarted process left unfinished.
+
+    With AGENT_CHECKPOINTING it continues after its last completed node,
+    otherwise it starts over. Only failed runs and runs whose lease expired,
+    as no process executes them anymore, are resumed.
+    """
+    agent_run = session.get(AgentRun, run_id)
+    if not agent_run:
+        raise HTTPException(status_code=404, detail="Agent run not found")
+    if get_run_state(run_id) or has_active_job(session, run_id):
+        raise HTTPException(status_code=409, detail="Agent run is not interrupted")
+    # Taking over the lease, concurrent requests resume the run once
+    statement = (
+        update(AgentRun)
+        .where(col(AgentRun.id) == run_id, is_resumable())
+        .values(lease_renewed_at=datetime.now())
+    )
+    if not session.exec(statement).rowcount:  # type: ignore[call-overload]
+        session.rollback()
+        raise HTTPException(status_code=409, detail="Agent run is not interrupted")
+
+    if settings.AGENT_RUN_BACKEND == "queue":
+        enqueue_run(session, agent_run)
+    session.commit()
+    if settings.AGENT_RUN_BACKEND == "background":
+        langgraph = await import_langgraph()
+        mail = langgraph.format_mail(
+            agent_run.mail_subject, agent_run.mail_body, agent_run.mail_sender
+        )
+        background_tasks.add_task(
+            langgraph.execute_run, mail, run_id, agent_run.pipeline
+        )
+
+    return AgentRunResponse(run_id=run_id)
+
+
+def agent_timeline(
+    status: str, prompt_tokens: int, completion_tokens: int, steps: list[dict[str, Any]]
+) -> AgentTimelineResponse:
+    """Gantt-style timeline of the steps given as `Step` columns."""
+    steps = sorted(steps, key=lambda step: step["created_at"])
+    # Steps written before the telemetry columns existed only have `created_at`
+    starts = [step["started_at"] or step["created_at"] for step in steps]
+    started_at = min(starts, default=None)
+    timeline_steps = [
+        TimelineStep.model_validate(
+            step
+            | {
+                "started_at": start,
+                "offset_seconds": (start - started_at).total_seconds(),
+                "duration_seconds": (step["finished_at"] - start).total_seconds()
+                if step["finished_at"]
+                else None,
+            }
+        )
+        for step, start in zip(steps, starts, strict=True)
+    ]
+    # Runs with unfinished steps have no duration yet
+    finished = [step.finished_at for step in timeline_steps if step.finished_at]
+    duration_seconds = None
+    if started_at and finished and len(finished) == len(timeline_steps):
+        duration_seconds = (max(finished) - started_at).total_seconds()
+    return AgentTimelineResponse(
+        status=status,
+        started_at=started_at,
+        duration_seconds=duration_seconds,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        steps=timeline_steps,
+    )
+
+
+@router.get("/{run_id}/timeline", response_model=AgentTimelineResponse)
+async def get_agent_timeline(
+    session: SessionDep, run_id: uuid.UUID
+) -> AgentTimelineResponse:
+    """
+    When each step of the run started and finished, and where its time went.
+
+    Per step the seconds spent on LLM calls and database writes, its tokens
+    and the models it called, to tell whether routing, the expert, the email
+    drafter or the database made a run slow.
+    """
+    run_state = get_run_state(run_id)
+    if run_state:
+        return agent_timeline(
+            run_state.status,
+            run_state.prompt_tokens,
+            run_state.completion_tokens,
+            [step.to_dict() for step in list(run_state.steps)],
+        )
+
+    agent_run = session.get(AgentRun, run_id)
+    if not agent_run:
+        raise HTTPException(status_code=404, detail="Agent run not found")
+
+    return agent_timeline(
+        agent_run.status,
+        agent_run.prompt_tokens,
+        agent_run.completion_tokens,
+        [step.model_dump() for step in agent_run.steps],
+    )
+
+
+def server_sent_event(event: RunEvent) -> str:
+    return f"event: {event.type}\ndata: {json.dumps(event.data)}\n\n"
+
+
+# The event streams read the run without a request session, it would hold a
+# pooled connection while streaming. The reads run in a worker thread, so they
+# do not block the event loop serving the streams.
+
+
+def read_agent_run(run_id: uuid.UUID) -> AgentRun | None:
+    with Session(engine) as session:
+        return session.get(AgentRun, run_id)
+
+
+def read_run_event(run_id: uuid.UUID) -> RunEvent | None:
+    with Session(engine) as session:
+        agent_run = session.get(AgentRun, run_id)
+        if not agent_run:
+            return None
+        return RunEvent("run", agent_status(agent_run).model_dump(mode="json"))
+
+
+async def load_agent_run(run_id: uuid.UUID) -> AgentRun | None:
+    return await asyncio.to_thread(read_agent_run, run_id)
+
+
+async def load_run_event(run_id: uuid.UUID) -> RunEvent | None:
+    """The full state of the run as a `run` event."""
+    run_state = get_run_state(run_id)
+    if run_state:
+        status = AgentStatusResponse.model_validate(run_state.snapshot())
+        return RunEvent("run", status.model_dump(mode="json"))
+
+    return await asyncio.to_thread(read_run_event, run_id)
+
+
+def event_stream_response(events: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def run_events(subscription: Subscription) -> AsyncIterator[str]:
+    with subscription:
+        snapshot = await load_run_event(subscription.agent_run_id)
+        if not snapshot:
+            return
+        yield server_sent_event(snapshot)
+        while not is_terminal(snapshot):
+            event = await subscription.get(RUN_EVENTS_KEEPALIVE)
+            if event:
+                yield server_sent_event(event)
+                if is_terminal(event):
+                    return
+                continue
+
+            # No events for a while, the run may be executed by another process
+            current = await load_run_event(subscription.agent_run_id)
+            if not current or current == snapshot:
+                yield ": keepalive\n\n"
+                continue
+            snapshot = current
+            yield server_sent_event(snapshot)
+
+
+async def draft_events(subscription: Subscription) -> AsyncIterator[str]:
+    with subscription:
+        while True:
+            event = await subscription.get(RUN_EVENTS_KEEPALIVE)
+            if event and event.type in ("token", "done"):
+                yield server_sent_event(event)
+                if event.type == "done":
+                    return
+            elif not event or is_terminal(event):
+                agent_run = await load_agent_run(subscription.agent_run_id)
+                if not agent_run:
+                    return
+                if agent_run.status in TERMINAL_STATUSES:
+                    yield server_sent_event(done_event(agent_run))
+                    return
+                yield ": keepalive\n\n"
+
+
+@router.get("/{run_id}/events")
+async def stream_agent_run_events(run_id: uuid.UUID) -> StreamingResponse:
+    """
+    Push the state of the run as Server-Sent Events until it is finished.
+
+    Starts with a `run` event (the same data as `GET /agent/{run_id}`),
+    followed by `step`, `status` and draft `token` events as they happen,
+    and ends with a `done` event or a `failed` status.
+    """
+    if not await load_agent_run(run_id):
+        raise HTTPException(status_code=404, detail="Agent run not found")
+
+    return event_stream_response(run_events(Subscription(run_id)))
+
+
+@router.get("/{run_id}/stream")
+async def stream_agent_draft(run_id: uuid.UUID) -> StreamingResponse:
+    """
+    Stream the email draft as Server-Sent Events while it is generated.
+
+    `token` events carry pieces of the draft, the final `done` event the
+    persisted draft.
+    """
+    subscription = Subscription(run_id)
+    agent_run = await load_agent_run(run_id)
+    if not agent_run or agent_run.status in TERMINAL_STATUSES:
+        subscription.close()
+        if not agent_run:
+            raise HTTPException(status_code=404, detail="Agent run not found")
+
+        async def finished() -> AsyncIterator[str]:
+            yield server_sent_event(done_event(agent_run))
+
+        return event_stream_response(finished())
+
+    return event_stream_response(draft_events(subscription))
@@ -1,4 +1,4 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Request
 
 router = APIRouter()
 
@@ -6,3 +6,12 @@ router = APIRouter()
 @router.get("/health-check/", include_in_schema=False)
 async def health_check() -> bool:
     return True
+
+
+@router.get("/ready/", include_in_schema=False)
+async def ready(request: Request) -> bool:
+    """Whether the API is warmed up and should get traffic."""
+    warm_up = getattr(request.app.state, "warm_up", None)
+    if warm_up and not warm_up.done():
+        raise HTTPException(status_code=503, detail="Warming up")
+    return True
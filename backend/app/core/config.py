@@ -58,6 +58,90 @@ class Settings(BaseSettings):
     WATSONX_API_KEY: str = ""
     WATSONX_URL: str = ""
     WATSONX_PROJECT_ID: str = ""
+    # HTTP connections to watsonx shared by all models of this process, one
+    # pool for sync and one for async calls. Hedged calls take two connections
+    WATSONX_HTTP_MAX_CONNECTIONS: int = 128
+    # Idle connections kept open, and for how many seconds, so calls skip the
+    # TCP and TLS handshake
+    WATSONX_HTTP_KEEPALIVE_CONNECTIONS: int = 64
+    WATSONX_HTTP_KEEPALIVE_SECONDS: float = 30.0
+    # watsonx models by tier, stages escalate from the small to the large one
+    LLM_MODEL_SMALL: str = "meta-llama/llama-3-2-3b-instruct"
+    LLM_MODEL_LARGE: str = "meta-llama/llama-4-maverick-17b-128e-instruct-fp8"
+    # Model tier the master agent routes with
+    AGENT_ROUTING_TIER: Literal["small", "large"] = "small"
+    # Replaces watsonx with `app.agent.fake_llm` for load tests, no credentials needed
+    LLM_FAKE: bool = False
+    # Median seconds to the first token and its log-normal spread, answer tokens
+    # per second (0 answers at once) and share of failing calls of the fake LLM
+    LLM_FAKE_LATENCY: float = 0.5
+    LLM_FAKE_LATENCY_SIGMA: float = 0.5
+    LLM_FAKE_TOKENS_PER_SECOND: float = 50
+    LLM_FAKE_ERROR_RATE: float = 0.0
+    LLM_FAKE_SEED: int = 0
+    # Record the LLM calls into the cassette at LLM_CASSETTE_PATH, or answer them
+    # from it, see `app.agent.cassette`
+    LLM_CASSETTE_MODE: Literal["off", "record", "replay"] = "off"
+    LLM_CASSETTE_PATH: str = ""
+    # "recorded" replays calls as slow as they were, "zero" answers at once
+    LLM_CASSETTE_LATENCY: Literal["recorded", "zero"] = "recorded"
+    # "sync" runs the graph in the threadpool, "async" on the event loop
+    AGENT_EXECUTION_MODE: Literal["sync", "async"] = "sync"
+    # "background" runs the graph in the API process, "queue" hands it to `app.worker`
+    AGENT_RUN_BACKEND: Literal["background", "queue"] = "background"
+    AGENT_WORKER_CONCURRENCY: int = 8
+    AGENT_WORKER_POLL_INTERVAL: float = 1.0
+    # Workers renew the lease of their jobs while running them, jobs whose lease
+    # expired are considered crashed and claimed again
+    AGENT_JOB_LEASE_SECONDS: float = 15 * 60
+    AGENT_JOB_MAX_ATTEMPTS: int = 3
+    # A failed job is retried after this, doubled with every further attempt
+    AGENT_JOB_RETRY_BACKOFF_SECONDS: float = 30
+    # The process executing a run renews its lease, runs whose lease expired
+    # lost their process and may be resumed
+    AGENT_RUN_LEASE_SECONDS: float = 60
+    # Save the graph state after each node, so interrupted runs resume after the
+    # last completed one instead of starting over. Off by default, the writes
+    # after each node cost about a third of the runs per second of a process
+    AGENT_CHECKPOINTING: bool = False
+    # Connections of the checkpoint writes, shared by the runs of a process
+    AGENT_CHECKPOINT_POOL_SIZE: int = 10
+    # Runs of one batch executed at the same time by the API process
+    AGENT_BATCH_CONCURRENCY: int = 10
+    # Trained with `python -m app.agent.classifier`, empty routes every mail with the LLM
+    ROUTING_CLASSIFIER_PATH: str = ""
+    ROUTING_CLASSIFIER_THRESHOLD: float = 0.8
+    # Built with `python -m app.agent.semantic_router`, empty disables embedding routing
+    ROUTING_EXEMPLARS_PATH: str = ""
+    ROUTING_EMBEDDING_MODEL: str = "ibm/granite-embedding-278m-multilingual"
+    ROUTING_EMBEDDING_NEIGHBOURS: int = 10
+    ROUTING_EMBEDDING_THRESHOLD: float = 0.7
+    # Experts started while the master agent routes (async mode only), 0 disables
+    AGENT_SPECULATIVE_EXPERTS: int = 0
+    # Default pipeline, "fused" routes, analyzes and drafts in one LLM call
+    AGENT_PIPELINE: Literal["staged", "fused"] = "staged"
+    # Context window of the served model, prompts are checked against it
+    AGENT_CONTEXT_WINDOW: int = 128_000
+    # Longer mails are shortened before they reach the agents
+    AGENT_MAX_MAIL_TOKENS: int = 8_000
+    # Seconds for an LLM call including its retries, unless its node sets its own
+    LLM_DEADLINE_SECONDS: float = 60.0
+    # Retries of timed out, throttled (429) and failed (5xx) LLM calls
+    LLM_RETRIES: int = 2
+    LLM_RETRY_BACKOFF_SECONDS: float = 0.5
+    # Duplicate LLM calls taking longer than the p95 of their node
+    LLM_HEDGING: bool = True
+    # Concurrent watsonx requests of this process, adapted within the bounds
+    LLM_CONCURRENCY_INITIAL: int = 32
+    LLM_CONCURRENCY_MIN: int = 1
+    LLM_CONCURRENCY_MAX: int = 128
+    # Consecutive failed watsonx requests opening the circuit breaker, and
+    # seconds it stays open
+    LLM_BREAKER_FAILURES: int = 5
+    LLM_BREAKER_COOLDOWN_SECONDS: float = 30.0
+    # watsonx quota shared by all API and worker processes, 0 disables a limit
+    LLM_QUOTA_REQUESTS_PER_SECOND: float = 0
+    LLM_QUOTA_TOKENS_PER_MINUTE: int = 0
 
     @computed_field  # type: ignore[prop-decorator]
     @property
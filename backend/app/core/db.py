@@ -1,11 +1,56 @@
+import time
+from typing import Any
+
+from sqlalchemy import Engine, event
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, ConnectionPoolEntry, QueuePool
 from sqlmodel import Session, create_engine, select
 
 from app import crud
 from app.core.config import settings
+from app.core.metrics import DB_POOL_CHECKED_OUT, DB_POOL_CHECKOUT_SECONDS
 from app.models import UserCreate
 from app.tables import User
 
-engine = create_engine(str(settings.SQLALCHEMY_DATABASE_URI))
+
+class TimedQueuePool(QueuePool):
+    """`QueuePool` observing how long checkouts wait for a connection."""
+
+    metrics_label = "sync"
+
+    def _do_get(self) -> ConnectionPoolEntry:
+        start_time = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_SECONDS.labels(self.metrics_label).observe(
+                time.perf_counter() - start_time
+            )
+
+
+class TimedAsyncQueuePool(TimedQueuePool, AsyncAdaptedQueuePool):
+    metrics_label = "async"
+
+
+def count_checkouts(engine: Engine, label: str) -> None:
+    checked_out = DB_POOL_CHECKED_OUT.labels(label)
+
+    @event.listens_for(engine, "checkout")
+    def checkout(*_: Any) -> None:
+        checked_out.inc()
+
+    @event.listens_for(engine, "checkin")
+    def checkin(*_: Any) -> None:
+        checked_out.dec()
+
+
+engine = create_engine(str(settings.SQLALCHEMY_DATABASE_URI), poolclass=TimedQueuePool)
+# psycopg 3 serves both engines, the async one is used by the async agent graph
+async_engine = create_async_engine(
+    str(settings.SQLALCHEMY_DATABASE_URI), poolclass=TimedAsyncQueuePool
+)
+count_checkouts(engine, "sync")
+count_checkouts(async_engine.sync_engine, "async")
 
 
 # make sure all SQLModel models are imported (app.tables) before initializing DB
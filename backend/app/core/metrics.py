@@ -0,0 +1,170 @@
+"""Prometheus metrics of the API and the agent pipeline, served at `/metrics`.
+
+Hot paths only observe into in-memory histograms and counters. Values that
+take a query, like the depth of the `agentjob` queue, are read when Prometheus
+scrapes.
+
+With several uvicorn workers each process counts on its own. Set
+PROMETHEUS_MULTIPROC_DIR to a directory shared by all of them, emptied on
+start, and every scrape returns the sum over the workers and `app.worker`
+processes on the host.
+"""
+
+import os
+import time
+from collections.abc import Iterator
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Seconds, from a local classifier hit to a long draft on a busy model
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+TOKEN_BUCKETS = (16, 64, 256, 1024, 4096, 16384, 65536)
+# Seconds, an idle pool hands out connections in microseconds
+POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+
+AGENT_NODE_SECONDS = Histogram(
+    "agent_node_seconds",
+    "Duration of agent graph nodes, including the write of their updates",
+    ["node"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_CALL_SECONDS = Histogram(
+    "llm_call_seconds",
+    "Duration of LLM calls including retries, hedging and admission",
+    ["model"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_TOKENS = Histogram(
+    "llm_tokens",
+    "Tokens of LLM calls, `prompt` in and `completion` out",
+    ["model", "type"],
+    buckets=TOKEN_BUCKETS,
+)
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_seconds",
+    "Time waited for a connection from the database pool",
+    ["engine"],
+    buckets=POOL_WAIT_BUCKETS,
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out",
+    "Connections checked out of the database pool",
+    ["engine"],
+    multiprocess_mode="livesum",
+)
+AGENT_RUNS_IN_PROGRESS = Gauge(
+    "agent_runs_in_progress",
+    "Agent runs executing",
+    multiprocess_mode="livesum",
+)
+AGENT_RUNS = Counter(
+    "agent_runs",
+    "Finished agent runs by pipeline, expert category and outcome",
+    ["pipeline", "category", "outcome"],
+)
+SPECULATION_DISCARDED_TOKENS = Counter(
+    "agent_speculation_discarded_tokens",
+    "Tokens of speculative expert analyses the master agent did not pick, by expert",
+    ["expert"],
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds",
+    "Duration of HTTP requests until their response is sent completely",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+
+
+def observe_llm_call(
+    model: str, seconds: float, prompt_tokens: int, completion_tokens: int
+) -> None:
+    LLM_CALL_SECONDS.labels(model).observe(seconds)
+    LLM_TOKENS.labels(model, "prompt").observe(prompt_tokens)
+    LLM_TOKENS.labels(model, "completion").observe(completion_tokens)
+
+
+class QueueCollector(Collector):
+    """Depth of the `agentjob` queue by status, queried on each scrape."""
+
+    def describe(self) -> Iterator[GaugeMetricFamily]:
+        # Registering calls `collect` unless described, before the database is set up
+        yield self._family()
+
+    def _family(self) -> GaugeMetricFamily:
+        return GaugeMetricFamily(
+            "agent_jobs", "Jobs of the agentjob queue by status", labels=["status"]
+        )
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        # Imported here, the database module observes into the metrics above
+        from sqlmodel import Session, func, select
+
+        from app.core.db import engine
+        from app.tables import AgentJob
+
+        with Session(engine) as session:
+            counts = session.exec(
+                select(AgentJob.status, func.count()).group_by(AgentJob.status)
+            ).all()
+        family = self._family()
+        for status in ("queued", "running"):
+            family.add_metric([status], dict(counts).get(status, 0))
+        yield family
+
+
+queue_collector = QueueCollector()
+REGISTRY.register(queue_collector)
+
+
+def metrics() -> Response:
+    """The metrics in the Prometheus text format."""
+    registry = REGISTRY
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)  # type: ignore[no-untyped-call]
+        registry.register(queue_collector)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+
+class MetricsMiddleware:
+    """Observe the duration of HTTP requests by route template."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Templates like /api/v1/agent/{run_id}, unmatched paths share one
+            # label so probing clients cannot create series without bound
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                scope["method"], route.path if route else "unmatched", str(status)
+            ).observe(time.perf_counter() - start_time)
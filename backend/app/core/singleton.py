@@ -1,13 +1,22 @@
+import threading
+
+
 class Singleton:
     def __init__(self, decorated):
         self._decorated = decorated
+        self._instance = None
+        self._lock = threading.Lock()
 
     def instance(self):
-        try:
-            return self._instance
-        except AttributeError:
-            self._instance = self._decorated()
-            return self._instance
+        # Concurrent first calls, e.g. of background runs, create one instance
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._decorated()
+        return self._instance
+
+    def created(self) -> bool:
+        return self._instance is not None
 
     def __call__(self):
         raise TypeError("Singletons must be accessed through `instance()`.")
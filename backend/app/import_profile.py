@@ -0,0 +1,84 @@
+"""Report the cumulative import time of the modules loaded by a module.
+
+Imports the module in a fresh interpreter with `-X importtime` and lists the
+modules taking longest including their own imports, indented by depth. With
+`--budget` it fails if the whole import takes longer, to keep the startup of
+the API in check:
+
+    python -m app.import_profile app.main --top 30 --budget 2.5
+    python -m app.import_profile app.agent.langgraph --min-ms 50
+"""
+
+import argparse
+import subprocess
+import sys
+from dataclasses import dataclass
+
+
+@dataclass
+class ImportTime:
+    module: str
+    depth: int
+    # Microseconds, `cumulative` includes the imports of the module
+    self_us: int
+    cumulative_us: int
+
+
+def parse_importtime(output: str) -> list[ImportTime]:
+    """The entries of `-X importtime` output, in the order they finished."""
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        # The header repeats the column names
+        if not self_us.strip().isdigit():
+            continue
+        module = name.strip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append(ImportTime(module, depth, int(self_us), int(cumulative_us)))
+    return imports
+
+
+def profile_import(module: str) -> list[ImportTime]:
+    """Import `module` in a new interpreter and time its imports."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+    return parse_importtime(result.stderr)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("module", nargs="?", default="app.main")
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--min-ms", type=float, default=0, help="Hide faster modules")
+    parser.add_argument(
+        "--budget", type=float, help="Fail if the import takes more seconds"
+    )
+    args = parser.parse_args()
+
+    imports = profile_import(args.module)
+    total = next(i for i in reversed(imports) if i.module == args.module)
+    slowest = sorted(imports, key=lambda i: i.cumulative_us, reverse=True)
+    print(f"{'cumulative':>10} {'self':>8}  module")
+    for entry in slowest[: args.top]:
+        if entry.cumulative_us < args.min_ms * 1000:
+            break
+        print(
+            f"{entry.cumulative_us / 1000:>8.1f}ms {entry.self_us / 1000:>6.1f}ms  "
+            f"{'  ' * entry.depth}{entry.module}"
+        )
+    seconds = total.cumulative_us / 1_000_000
+    print(f"⏱️ Importing {args.module} took {seconds:.2f}s, {len(imports)} modules")
+    if args.budget is not None and seconds > args.budget:
+        print(f"❌ Over the budget of {args.budget:.2f}s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
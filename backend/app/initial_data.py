@@ -2,6 +2,7 @@ import logging
 
 from sqlmodel import Session
 
+from app.agent.checkpoint import setup_checkpoints
 from app.core.db import engine, init_db
 
 logging.basicConfig(level=logging.INFO)
@@ -11,6 +12,7 @@ logger = logging.getLogger(__name__)
 def init() -> None:
     with Session(engine) as session:
         init_db(session)
+    setup_checkpoints()
 
 
 def main() -> None:
@@ -1,17 +1,44 @@
+import asyncio
+import sys
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.routing import APIRoute
 from starlette.middleware.cors import CORSMiddleware
 
 from app.api.main import api_router
 from app.core.config import settings
+from app.core.metrics import MetricsMiddleware, metrics
 
 
 def custom_generate_unique_id(route: APIRoute) -> str:
     return f"{route.tags[0]}-{route.name}"
 
 
+def load_agents() -> None:
+    """Import the agent stack and connect to watsonx, which takes seconds."""
+    from app.agent.langgraph import warm_up
+
+    warm_up()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # Load the agents while the server already accepts requests,
+    # `/utils/ready/` answers 503 until they are
+    app.state.warm_up = asyncio.create_task(asyncio.to_thread(load_agents))
+    yield
+    # Async runs of this loop checkpointed through a pool of its own, not
+    # imported at all if the agents never loaded
+    checkpoint = sys.modules.get("app.agent.checkpoint")
+    if checkpoint:
+        await checkpoint.aclose_checkpointer()
+
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
+    lifespan=lifespan,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
     generate_unique_id_function=custom_generate_unique_id,
     swagger_ui_parameters={"persistAuthorization": True},
@@ -29,4 +56,8 @@ if settings.all_cors_origins:
     )
 
 
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(api_router, prefix=settings.API_V1_STR)
+# Scraped by Prometheus, outside the versioned API
+app.add_api_route("/metrics", metrics, include_in_schema=False, tags=["metrics"])
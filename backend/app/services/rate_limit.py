@@ -0,0 +1,187 @@
+"""Token buckets shared by all processes of the app, kept in Postgres.
+
+The API workers and `app.worker` each talk to watsonx on their own, and
+together they must stay within one quota. Each bucket is a row holding its
+tokens as of its last update. Taking from it refills it for the time passed
+and subtracts the cost, with the row locked for one short transaction, so
+concurrent processes take from the same count.
+"""
+
+import asyncio
+import time
+from datetime import datetime
+
+from sqlalchemy import ColumnElement, Update
+from sqlalchemy.dialects.postgresql import Insert, insert
+from sqlmodel import Session, col, func, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlmodel.sql.expression import SelectOfScalar
+
+from app.core.config import settings
+from app.core.db import async_engine, engine
+from app.tables import RateLimitBucket
+
+
+class TokenBucket:
+    def __init__(self, name: str, rate: float, capacity: float) -> None:
+        self.name = name
+        # Tokens added per second, and the most the bucket holds
+        self.rate = rate
+        self.capacity = capacity
+        self._created = False
+
+    def _create_statement(self) -> Insert:
+        return (
+            insert(RateLimitBucket)
+            .values(name=self.name, tokens=self.capacity, updated_at=datetime.now())
+            .on_conflict_do_nothing()
+        )
+
+    def _lock_statement(self) -> SelectOfScalar[RateLimitBucket]:
+        return (
+            select(RateLimitBucket)
+            .where(col(RateLimitBucket.name) == self.name)
+            .with_for_update()
+        )
+
+    def _refund_statement(self, amount: float) -> Update:
+        tokens: ColumnElement[float] = func.least(
+            col(RateLimitBucket.tokens) + amount, self.capacity
+        )
+        return (
+            update(RateLimitBucket)
+            .where(col(RateLimitBucket.name) == self.name)
+            .values(tokens=tokens)
+        )
+
+    def _take(self, bucket: RateLimitBucket, cost: float) -> float:
+        """Refill `bucket` and take `cost`, or the seconds until it holds `cost`."""
+        now = datetime.now()
+        elapsed = max((now - bucket.updated_at).total_seconds(), 0)
+        tokens = min(bucket.tokens + elapsed * self.rate, self.capacity)
+        # A cost above the capacity would never fit, it empties a full bucket
+        cost = min(cost, self.capacity)
+        bucket.updated_at = now
+        if tokens >= cost:
+            bucket.tokens = tokens - cost
+            return 0
+        bucket.tokens = tokens
+        return (cost - tokens) / self.rate
+
+    def take(self, cost: float) -> float:
+        """Take `cost` tokens, 0 if taken or the seconds until they are available."""
+        with Session(engine) as session:
+            if not self._created:
+                session.exec(self._create_statement())  # type: ignore[call-overload]
+                self._created = True
+            bucket = session.exec(self._lock_statement()).one()
+            wait = self._take(bucket, cost)
+            session.add(bucket)
+            session.commit()
+        return wait
+
+    async def atake(self, cost: float) -> float:
+        """Async variant of `take`."""
+        async with AsyncSession(async_engine) as session:
+            if not self._created:
+                await session.exec(self._create_statement())  # type: ignore[call-overload]
+                self._created = True
+            bucket = (await session.exec(self._lock_statement())).one()
+            wait = self._take(bucket, cost)
+            session.add(bucket)
+            await session.commit()
+        return wait
+
+    def refund(self, amount: float) -> None:
+        """Put back tokens taken but not used."""
+        with Session(engine) as session:
+            session.exec(self._refund_statement(amount))  # type: ignore[call-overload]
+            session.commit()
+
+    async def arefund(self, amount: float) -> None:
+        """Async variant of `refund`."""
+        async with AsyncSession(async_engine) as session:
+            await session.exec(self._refund_statement(amount))  # type: ignore[call-overload]
+            await session.commit()
+
+
+class Quota:
+    """Requests per second and tokens per minute of a provider, either optional.
+
+    A request is admitted once both buckets granted it. LLM calls reserve their
+    prompt plus `max_tokens` up front and refund what the answer did not use.
+    """
+
+    def __init__(
+        self, requests: TokenBucket | None, tokens: TokenBucket | None
+    ) -> None:
+        self.requests = requests
+        self.tokens = tokens
+
+    @classmethod
+    def from_settings(cls) -> "Quota":
+        requests_per_second = settings.LLM_QUOTA_REQUESTS_PER_SECOND
+        tokens_per_minute = settings.LLM_QUOTA_TOKENS_PER_MINUTE
+        return cls(
+            requests=TokenBucket(
+                "watsonx:requests",
+                requests_per_second,
+                # Bursts of up to one second of requests
+                max(requests_per_second, 1),
+            )
+            if requests_per_second
+            else None,
+            tokens=TokenBucket(
+                "watsonx:tokens", tokens_per_minute / 60, tokens_per_minute
+            )
+            if tokens_per_minute
+            else None,
+        )
+
+    def _costs(self, tokens: int) -> list[tuple[TokenBucket, float]]:
+        costs = [(self.tokens, tokens), (self.requests, 1)]
+        return [(bucket, cost) for bucket, cost in costs if bucket and cost]
+
+    def acquire(self, tokens: int, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for a request of `tokens` tokens.
+
+        False if it is not admitted in time, nothing is taken then.
+        """
+        end = time.monotonic() + timeout
+        taken: list[tuple[TokenBucket, float]] = []
+        for bucket, cost in self._costs(tokens):
+            while wait := bucket.take(cost):
+                if time.monotonic() + wait > end:
+                    for taken_bucket, taken_cost in taken:
+                        taken_bucket.refund(taken_cost)
+                    return False
+                time.sleep(wait)
+            taken.append((bucket, cost))
+        return True
+
+    async def aacquire(self, tokens: int, timeout: float) -> bool:
+        """Async variant of `acquire`."""
+        end = time.monotonic() + timeout
+        taken: list[tuple[TokenBucket, float]] = []
+        for bucket, cost in self._costs(tokens):
+            while wait := await bucket.atake(cost):
+                if time.monotonic() + wait > end:
+                    for taken_bucket, taken_cost in taken:
+                        await taken_bucket.arefund(taken_cost)
+                    return False
+                await asyncio.sleep(wait)
+            taken.append((bucket, cost))
+        return True
+
+    def refund(self, tokens: int) -> None:
+        """Return `tokens` reserved by an admitted request but not used."""
+        if self.tokens and tokens > 0:
+            self.tokens.refund(tokens)
+
+    async def arefund(self, tokens: int) -> None:
+        """Async variant of `refund`."""
+        if self.tokens and tokens > 0:
+            await self.tokens.arefund(tokens)
+
+
+quota = Quota.from_settings()
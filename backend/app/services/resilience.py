@@ -0,0 +1,682 @@
+"""Deadlines, retries, hedging and admission control for remote LLM calls.
+
+Every call gets a deadline for all its attempts together. Transient failures
+(timeouts, connection errors, 429 and 5xx answers) are retried with jittered
+exponential backoff while the deadline allows. Once enough latencies of a call
+site are known, an attempt still running after their p95 gets a duplicate
+request, and whichever answers first wins. Hedging costs at most one extra
+request for the slowest 5% of calls and cuts their latency to about p95 plus
+a typical call.
+
+Requests first wait for the quota shared by all processes
+(`app.services.rate_limit`), then for a slot of the process' `AdaptiveLimiter`.
+It adapts the number of requests in flight to what watsonx currently handles
+(AIMD): one more per round of fast successful requests, half as many after a
+throttled, failed or slow one. Until the first such signal the limit grows by
+one per successful request, so a fresh process quickly finds the capacity.
+After a run of consecutive failures its circuit breaker opens, and requests
+wait for the cooldown instead of adding to the overload. Requests that cannot
+be admitted before their deadline fail with `DeadlineExceeded`.
+
+Each request reserves `CallPolicy.tokens` of the quota. The caller settles the
+request whose answer it gets and refunds what the answer did not use. The
+reservations of all other requests (failed, lost to a hedge, abandoned at the
+deadline or never admitted by the limiter) are refunded whole here.
+"""
+
+import asyncio
+import functools
+import random
+import threading
+import time
+from collections import deque
+from collections.abc import (
+    AsyncGenerator,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Generator,
+    Iterator,
+    Sequence,
+)
+from concurrent import futures
+from dataclasses import dataclass
+from typing import Any, TypeVar
+
+import httpx
+import requests
+from ibm_watsonx_ai.wml_client_error import ApiRequestFailure
+
+from app.core.config import settings
+from app.services.rate_limit import quota
+
+T = TypeVar("T")
+
+# Latencies kept per call site, and needed before hedging starts
+LATENCY_WINDOW = 200
+MIN_HEDGE_SAMPLES = 20
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+@dataclass(frozen=True)
+class CallPolicy:
+    # Seconds for all attempts of a call together
+    deadline: float
+    retries: int
+    # Backoff before retry n is drawn from [0, backoff * 2**n]
+    backoff: float
+    hedge: bool
+    # Quota tokens each request reserves, see `app.services.rate_limit`
+    tokens: int = 0
+
+    @classmethod
+    def default(cls, deadline: float | None = None, tokens: int = 0) -> "CallPolicy":
+        return cls(
+            deadline=deadline or settings.LLM_DEADLINE_SECONDS,
+            retries=settings.LLM_RETRIES,
+            backoff=settings.LLM_RETRY_BACKOFF_SECONDS,
+            hedge=settings.LLM_HEDGING,
+            tokens=tokens,
+        )
+
+
+class LatencyTracker:
+    """Latencies of the recent successful calls of each call site."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._latencies: dict[str, deque[float]] = {}
+
+    def record(self, key: str, latency: float) -> None:
+        with self._lock:
+            self._latencies.setdefault(key, deque(maxlen=LATENCY_WINDOW)).append(
+                latency
+            )
+
+    def p95(self, key: str) -> float | None:
+        """None until enough calls of `key` finished."""
+        with self._lock:
+            latencies = sorted(self._latencies.get(key, ()))
+        if len(latencies) < MIN_HEDGE_SAMPLES:
+            return None
+        return latencies[int(len(latencies) * 0.95) - 1]
+
+    def median(self, key: str) -> float | None:
+        with self._lock:
+            latencies = sorted(self._latencies.get(key, ()))
+        if len(latencies) < MIN_HEDGE_SAMPLES:
+            return None
+        return latencies[len(latencies) // 2]
+
+
+latencies = LatencyTracker()
+
+
+class CircuitBreaker:
+    """Stops requests after `failures` consecutive failures for `cooldown` seconds.
+
+    The first request after the cooldown is a trial (half-open), its success
+    closes the breaker, its failure opens it again.
+    """
+
+    def __init__(self, failures: int, cooldown: float) -> None:
+        self.failures = failures
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.opened_at: float | None = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half-open"
+
+    def retry_after(self) -> float | None:
+        """Seconds until the breaker lets a trial request through, if open."""
+        opened_at = self.opened_at
+        if opened_at is None or self.state != "open":
+            return None
+        return opened_at + self.cooldown - time.monotonic()
+
+    def success(self) -> None:
+        self.consecutive_failures = 0
+        self.opened_at = None
+
+    def failure(self) -> None:
+        self.consecutive_failures += 1
+        if self.state == "half-open" or self.consecutive_failures >= self.failures:
+            if self.state != "open":
+                print(f"⛔ Circuit breaker opened for {self.cooldown:.0f}s")
+            self.opened_at = time.monotonic()
+
+
+def _wake(woken: asyncio.Future[None]) -> None:
+    if not woken.done():
+        woken.set_result(None)
+
+
+class AdaptiveLimiter:
+    """Limit of concurrent requests, adapted to the provider's capacity (AIMD).
+
+    Shared by threads and event loops, waiters are woken whenever a slot frees
+    up and retry to take it.
+    """
+
+    # Requests slower than this multiple of their call site's median count as
+    # a sign of overload
+    SLOW_FACTOR = 2.0
+    # At most one decrease per interval, requests failing together are one signal
+    DECREASE_INTERVAL = 1.0
+
+    def __init__(
+        self, initial: int, minimum: int, maximum: int, breaker: CircuitBreaker
+    ) -> None:
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.breaker = breaker
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._waiters: list[Callable[[], object]] = []
+        self._last_decrease = 0.0
+        # Until the first overload signal the limit doubles per round
+        self.slow_start = True
+
+    def _admit(self) -> bool:
+        state = self.breaker.state
+        if state == "open":
+            return False
+        limit = 1 if state == "half-open" else int(self.limit)
+        if self.in_flight >= limit:
+            return False
+        self.in_flight += 1
+        return True
+
+    def try_acquire(self) -> bool:
+        """Take a slot if one is free right away."""
+        with self._lock:
+            return self._admit()
+
+    def acquire(self, timeout: float) -> None:
+        """Wait up to `timeout` seconds for a slot."""
+        end = time.monotonic() + timeout
+        while True:
+            event = threading.Event()
+            with self._lock:
+                if self._admit():
+                    return
+                self._waiters.append(event.set)
+                wait = self._wait_time(end)
+            if wait <= 0:
+                raise DeadlineExceeded("No LLM request slot before the deadline")
+            event.wait(wait)
+
+    async def aacquire(self, timeout: float) -> None:
+        """Async variant of `acquire`."""
+        loop = asyncio.get_running_loop()
+        end = time.monotonic() + timeout
+        while True:
+            woken = loop.create_future()
+            with self._lock:
+                if self._admit():
+                    return
+                self._waiters.append(
+                    functools.partial(loop.call_soon_threadsafe, _wake, woken)
+                )
+                wait = self._wait_time(end)
+            if wait <= 0:
+                raise DeadlineExceeded("No LLM request slot before the deadline")
+            await asyncio.wait({woken}, timeout=wait)
+
+    def _wait_time(self, end: float) -> float:
+        """Seconds to wait for a wake-up, at most until the breaker's cooldown ends."""
+        wait = end - time.monotonic()
+        retry_after = self.breaker.retry_after()
+        return wait if retry_after is None else min(wait, retry_after)
+
+    def release(
+        self,
+        key: str | None,
+        latency: float,
+        error: BaseException | None,
+    ) -> None:
+        """Free a slot and adapt the limit to the outcome of its request."""
+        with self._lock:
+            self.in_flight -= 1
+            self._record(key, latency, error)
+            waiters, self._waiters = self._waiters, []
+        for wake in waiters:
+            try:
+                wake()
+            except RuntimeError:
+                # The waiter's event loop is closed
+                pass
+
+    def _record(
+        self, key: str | None, latency: float, error: BaseException | None
+    ) -> None:
+        if error is not None and not is_transient(error):
+            # Failed on our side, says nothing about the provider
+            return
+        if error is not None:
+            self.breaker.failure()
+            self._decrease()
+            return
+
+        self.breaker.success()
+        median = latencies.median(key) if key else None
+        if median is not None and latency > self.SLOW_FACTOR * median:
+            self._decrease()
+        elif self.in_flight + 1 >= self.limit / 2:
+            # Grow only while the limit is actually used
+            increase = 1 if self.slow_start else 1 / self.limit
+            self.limit = min(self.limit + increase, self.maximum)
+
+    def _decrease(self) -> None:
+        now = time.monotonic()
+        self.slow_start = False
+        if now - self._last_decrease >= self.DECREASE_INTERVAL:
+            self.limit = max(self.limit / 2, self.minimum)
+            self._last_decrease = now
+
+    def timed_out(self) -> None:
+        """Count a request abandoned at its deadline as an overload signal."""
+        with self._lock:
+            self.breaker.failure()
+            self._decrease()
+
+
+limiter = AdaptiveLimiter(
+    settings.LLM_CONCURRENCY_INITIAL,
+    settings.LLM_CONCURRENCY_MIN,
+    settings.LLM_CONCURRENCY_MAX,
+    CircuitBreaker(
+        settings.LLM_BREAKER_FAILURES, settings.LLM_BREAKER_COOLDOWN_SECONDS
+    ),
+)
+
+# Runs the attempts of sync calls, so they can be hedged and abandoned. More
+# threads than the anyio threadpool running sync graphs, so attempts and their
+# hedges start right away.
+_executor = futures.ThreadPoolExecutor(max_workers=100, thread_name_prefix="llm-call")
+
+
+def is_transient(error: BaseException) -> bool:
+    if isinstance(
+        error,
+        TimeoutError
+        | ConnectionError
+        | httpx.TransportError
+        | requests.ConnectionError
+        | requests.Timeout,
+    ):
+        return True
+    if isinstance(error, ApiRequestFailure):
+        status_code: int = error.response.status_code
+        return status_code == 429 or status_code >= 500
+    return False
+
+
+def backoff_delay(policy: CallPolicy, retry: int) -> float:
+    return random.uniform(0, policy.backoff * 2**retry)
+
+
+def _should_retry(
+    error: Exception, policy: CallPolicy, retry: int, time_left: float
+) -> bool:
+    """Whether a failed attempt is retried, `time_left` after the backoff."""
+    return retry < policy.retries and is_transient(error) and time_left > 0
+
+
+def _hedge_delay(key: str, policy: CallPolicy) -> float | None:
+    return latencies.p95(key) if policy.hedge else None
+
+
+def _admit(tokens: int, timeout: float) -> None:
+    """Wait for the quota shared with the other processes, then for a slot."""
+    end = time.monotonic() + timeout
+    if not quota.acquire(tokens, timeout):
+        raise DeadlineExceeded("No watsonx quota left before the deadline")
+    try:
+        limiter.acquire(end - time.monotonic())
+    except BaseException:
+        quota.refund(tokens)
+        raise
+
+
+async def _aadmit(tokens: int, timeout: float) -> None:
+    """Async variant of `_admit`."""
+    end = time.monotonic() + timeout
+    if not await quota.aacquire(tokens, timeout):
+        raise DeadlineExceeded("No watsonx quota left before the deadline")
+    try:
+        await limiter.aacquire(end - time.monotonic())
+    except BaseException:
+        await quota.arefund(tokens)
+        raise
+
+
+def _try_admit(tokens: int) -> bool:
+    """Admit a hedged request only if quota and a slot are free right away."""
+    if not limiter.try_acquire():
+        return False
+    if not quota.acquire(tokens, 0):
+        limiter.release(None, 0, None)
+        return False
+    return True
+
+
+async def _atry_admit(tokens: int) -> bool:
+    """Async variant of `_try_admit`."""
+    if not limiter.try_acquire():
+        return False
+    if not await quota.aacquire(tokens, 0):
+        limiter.release(None, 0, None)
+        return False
+    return True
+
+
+def _unused(attempts: Sequence[object], winner: object, tokens: int) -> int:
+    """Quota reserved by the attempts whose answer the caller does not get."""
+    return tokens * sum(attempt is not winner for attempt in attempts)
+
+
+def _release(
+    key: str, start: float, future: "futures.Future[Any] | asyncio.Future[Any]"
+) -> None:
+    """Free the limiter slot of a finished, failed or cancelled attempt."""
+    if future.cancelled():
+        # A hedge that lost, or an attempt given up at its deadline
+        limiter.release(None, 0, None)
+    else:
+        limiter.release(key, time.monotonic() - start, future.exception())
+
+
+def _submit(key: str, call: Callable[[], T]) -> "futures.Future[T]":
+    """Start `call` in an acquired limiter slot."""
+    start = time.monotonic()
+    future = _executor.submit(call)
+    future.add_done_callback(lambda future: _release(key, start, future))
+    return future
+
+
+def _start(key: str, call: Callable[[], Awaitable[T]]) -> "asyncio.Future[T]":
+    """Async variant of `_submit`."""
+    start = time.monotonic()
+    task = asyncio.ensure_future(call())
+    task.add_done_callback(lambda task: _release(key, start, task))
+    return task
+
+
+def _attempt(
+    key: str,
+    call: Callable[[], T],
+    deadline: float,
+    hedge_after: float | None,
+    tokens: int,
+) -> T:
+    """One attempt of `call`, plus a hedged duplicate if it is slow."""
+    _admit(tokens, deadline - time.monotonic())
+    start = time.monotonic()
+    attempts = [_submit(key, call)]
+    winner: futures.Future[T] | None = None
+    pending = set(attempts)
+    try:
+        if hedge_after is not None and hedge_after < deadline - start:
+            done, _ = futures.wait(pending, timeout=hedge_after)
+            # No hedging while the limiter is saturated
+            if not done and _try_admit(tokens):
+                print(f"🐢 LLM call '{key}' slower than p95, sending a hedged request")
+                attempts.append(_submit(key, call))
+                pending.add(attempts[-1])
+
+        error: BaseException | None = None
+        while pending:
+            done, pending = futures.wait(
+                pending,
+                timeout=max(deadline - time.monotonic(), 0),
+                return_when=futures.FIRST_COMPLETED,
+            )
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    latencies.record(key, time.monotonic() - start)
+                    winner = future
+                    return future.result()
+                error = future.exception()
+        if error and not pending:
+            raise error
+        limiter.timed_out()
+        raise DeadlineExceeded(f"LLM call '{key}' exceeded its deadline")
+    finally:
+        # Attempts already running cannot be cancelled, they report their
+        # outcome to the limiter once they finish
+        for future in pending:
+            future.cancel()
+        quota.refund(_unused(attempts, winner, tokens))
+
+
+def call_with_policy(key: str, call: Callable[[], T], policy: CallPolicy) -> T:
+    """Run `call` with the deadline, retries and hedging of `policy`.
+
+    Latencies are tracked per `key`, calls of one key should be comparable.
+    """
+    deadline = time.monotonic() + policy.deadline
+    retry = 0
+    while True:
+        try:
+            return _attempt(
+                key, call, deadline, _hedge_delay(key, policy), policy.tokens
+            )
+        except Exception as error:
+            delay = backoff_delay(policy, retry)
+            if not _should_retry(
+                error, policy, retry, deadline - time.monotonic() - delay
+            ):
+                raise
+            print(f"🔁 LLM call '{key}' failed with {error!r}, retrying")
+            time.sleep(delay)
+            retry += 1
+
+
+def _close_stream(chunks: Iterator[Any]) -> None:
+    if isinstance(chunks, Generator):
+        chunks.close()
+
+
+def _abandon_stream(chunks: Iterator[Any], tokens: int) -> None:
+    """Free the slot and quota of a stream given up at its deadline."""
+    try:
+        limiter.release(None, 0, None)
+        quota.refund(tokens)
+    finally:
+        _close_stream(chunks)
+
+
+def _next_chunk(
+    key: str, chunks: Iterator[T], deadline: float, start: float, tokens: int
+) -> T | None:
+    """The next chunk of a stream before the deadline, None at its end.
+
+    If the stream fails, its slot and quota are freed. If it sends nothing
+    before the deadline, the read cannot be cancelled: the stream keeps its
+    slot and quota until the read returns, and is closed then.
+    """
+    pending = _executor.submit(next, chunks, None)
+    done, _ = futures.wait([pending], timeout=max(deadline - time.monotonic(), 0))
+    if not done:
+        limiter.timed_out()
+        pending.add_done_callback(lambda _: _abandon_stream(chunks, tokens))
+        raise DeadlineExceeded(f"LLM stream '{key}' exceeded its deadline")
+    try:
+        return pending.result()
+    except BaseException as error:
+        limiter.release(None, time.monotonic() - start, error)
+        quota.refund(tokens)
+        raise
+
+
+def stream_with_policy(
+    key: str, stream: Callable[[], Iterator[T]], policy: CallPolicy
+) -> Iterator[T]:
+    """`stream()` with the deadline of `policy`, retried until its first chunk.
+
+    Chunks are passed on as they arrive, so a stream that already produced
+    one is neither retried nor hedged. The deadline bounds the whole stream.
+    """
+    deadline = time.monotonic() + policy.deadline
+    retry = 0
+    while True:
+        _admit(policy.tokens, deadline - time.monotonic())
+        start = time.monotonic()
+        chunks = stream()
+        try:
+            chunk = _next_chunk(key, chunks, deadline, start, policy.tokens)
+        except Exception as error:
+            delay = backoff_delay(policy, retry)
+            if not _should_retry(
+                error, policy, retry, deadline - time.monotonic() - delay
+            ):
+                raise
+            print(f"🔁 LLM stream '{key}' failed with {error!r}, retrying")
+            time.sleep(delay)
+            retry += 1
+            continue
+        while chunk is not None:
+            try:
+                yield chunk
+            except BaseException as error:
+                # The caller settles only streams that finished
+                _close_stream(chunks)
+                limiter.release(None, time.monotonic() - start, error)
+                quota.refund(policy.tokens)
+                raise
+            chunk = _next_chunk(key, chunks, deadline, start, policy.tokens)
+        limiter.release(None, time.monotonic() - start, None)
+        return
+
+
+async def _aattempt(
+    key: str,
+    call: Callable[[], Awaitable[T]],
+    deadline: float,
+    hedge_after: float | None,
+    tokens: int,
+) -> T:
+    """Async variant of `_attempt`."""
+    loop = asyncio.get_running_loop()
+    await _aadmit(tokens, deadline - loop.time())
+    start = loop.time()
+    attempts = [_start(key, call)]
+    winner: asyncio.Future[T] | None = None
+    pending = set(attempts)
+    try:
+        if hedge_after is not None and hedge_after < deadline - start:
+            done, _ = await asyncio.wait(pending, timeout=hedge_after)
+            if not done and await _atry_admit(tokens):
+                print(f"🐢 LLM call '{key}' slower than p95, sending a hedged request")
+                attempts.append(_start(key, call))
+                pending.add(attempts[-1])
+
+        error: BaseException | None = None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=max(deadline - loop.time(), 0),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                break
+            for task in done:
+                if task.exception() is None:
+                    latencies.record(key, loop.time() - start)
+                    winner = task
+                    return task.result()
+                error = task.exception()
+        if error and not pending:
+            raise error
+        limiter.timed_out()
+        raise DeadlineExceeded(f"LLM call '{key}' exceeded its deadline")
+    finally:
+        for task in pending:
+            task.cancel()
+        await quota.arefund(_unused(attempts, winner, tokens))
+
+
+async def acall_with_policy(
+    key: str, call: Callable[[], Awaitable[T]], policy: CallPolicy
+) -> T:
+    """Async variant of `call_with_policy`, `call` creates a new coroutine."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + policy.deadline
+    retry = 0
+    while True:
+        try:
+            return await _aattempt(
+                key, call, deadline, _hedge_delay(key, policy), policy.tokens
+            )
+        except Exception as error:
+            delay = backoff_delay(policy, retry)
+            if not _should_retry(error, policy, retry, deadline - loop.time() - delay):
+                raise
+            print(f"🔁 LLM call '{key}' failed with {error!r}, retrying")
+            await asyncio.sleep(delay)
+            retry += 1
+
+
+async def _anext_chunk(
+    key: str, chunks: AsyncIterator[T], deadline: float, start: float, tokens: int
+) -> T | None:
+    """Async variant of `_next_chunk`, the read is cancelled at the deadline."""
+    loop = asyncio.get_running_loop()
+    try:
+        return await asyncio.wait_for(
+            anext(chunks, None), max(deadline - loop.time(), 0)
+        )
+    except BaseException as error:
+        limiter.release(None, time.monotonic() - start, error)
+        await quota.arefund(tokens)
+        if isinstance(error, asyncio.TimeoutError):
+            raise DeadlineExceeded(f"LLM stream '{key}' exceeded its deadline")
+        raise
+
+
+async def astream_with_policy(
+    key: str, stream: Callable[[], AsyncIterator[T]], policy: CallPolicy
+) -> AsyncIterator[T]:
+    """Async variant of `stream_with_policy`."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + policy.deadline
+    retry = 0
+    while True:
+        await _aadmit(policy.tokens, deadline - loop.time())
+        start = time.monotonic()
+        chunks = stream()
+        try:
+            chunk = await _anext_chunk(key, chunks, deadline, start, policy.tokens)
+        except Exception as error:
+            delay = backoff_delay(policy, retry)
+            if not _should_retry(error, policy, retry, deadline - loop.time() - delay):
+                raise
+            print(f"🔁 LLM stream '{key}' failed with {error!r}, retrying")
+            await asyncio.sleep(delay)
+            retry += 1
+            continue
+        while chunk is not None:
+            try:
+                yield chunk
+            except BaseException as error:
+                if isinstance(chunks, AsyncGenerator):
+                    await chunks.aclose()
+                limiter.release(None, time.monotonic() - start, error)
+                await quota.arefund(policy.tokens)
+                raise
+            chunk = await _anext_chunk(key, chunks, deadline, start, policy.tokens)
+        limiter.release(None, time.monotonic() - start, None)
+        return
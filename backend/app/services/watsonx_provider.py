@@ -1,15 +1,82 @@
+import threading
 import time
+from collections.abc import Iterator
+from dataclasses import dataclass
+from typing import Any
 
+import httpx
 from ibm_watsonx_ai import APIClient, Credentials
 from ibm_watsonx_ai import foundation_models as wx
 from ibm_watsonx_ai.foundation_models import Embeddings
+from ibm_watsonx_ai.utils.utils import HttpClientConfig
+from langchain_core.messages import convert_to_messages
+from prometheus_client import REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
 
+from app.agent.token_budget import completion_budget
 from app.core.config import settings
 from app.core.singleton import Singleton
+from app.services.rate_limit import quota
+from app.services.resilience import CallPolicy, call_with_policy
+
+
+@dataclass
+class PoolStats:
+    """Connections of an HTTP connection pool and the requests waiting for one."""
+
+    max_connections: int
+    # Connections serving a request, and open ones waiting for the next
+    active: int
+    idle: int
+    queued_requests: int
+
+
+def pool_stats(client: httpx.Client | httpx.AsyncClient) -> PoolStats:
+    """A snapshot of the connection pools of `client`, summed over its proxies.
+
+    Reads private attributes of httpx and httpcore 1.x, which other versions
+    may not have.
+    """
+    stats = PoolStats(max_connections=0, active=0, idle=0, queued_requests=0)
+    transports = [client._transport, *client._mounts.values()]
+    for transport in transports:
+        # httpcore pools, their lists are copied since other threads change them
+        pool = getattr(transport, "_pool", None)
+        if pool is None:
+            continue
+        stats.max_connections += pool._max_connections
+        for connection in list(pool.connections):
+            if connection.is_idle():
+                stats.idle += 1
+            else:
+                stats.active += 1
+        stats.queued_requests += sum(
+            request.is_queued() for request in list(pool._requests)
+        )
+    return stats
+
+
+def http_client_config() -> HttpClientConfig:
+    return HttpClientConfig(
+        limits=httpx.Limits(
+            max_connections=settings.WATSONX_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.WATSONX_HTTP_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.WATSONX_HTTP_KEEPALIVE_SECONDS,
+        )
+    )
 
 
 @Singleton
 class WatsonxProvider:
+    """The watsonx client of the process and its models.
+
+    All models, including the chat models of the agents, send their requests
+    through the keep-alive connection pools of the one `APIClient`, sized by
+    WATSONX_HTTP_*. Models are created once per model ID, also when threads
+    ask for them at the same time.
+    """
+
     name = "watsonx"
 
     def __init__(self) -> None:
@@ -21,41 +88,150 @@ class WatsonxProvider:
                 url=settings.WATSONX_URL,
                 api_key=settings.WATSONX_API_KEY,
             ),
+            httpx_client=http_client_config(),
+            async_httpx_client=http_client_config(),
         )
         print(f"APIClient initialization took {time.time() - start_time:.2f} seconds")
+        self._lock = threading.Lock()
         self._model_inference_cache: dict[str, wx.inference.ModelInference] = {}
+        self._embeddings_cache: dict[str, Embeddings] = {}
 
     def get_model_inference(self, model_id: str) -> wx.inference.ModelInference:
         if model_id not in self._model_inference_cache:
-            start_time = time.time()
-            self._model_inference_cache[model_id] = wx.inference.ModelInference(
-                api_client=self.client, model_id=model_id
-            )
-            print(
-                f"ModelInference for '{model_id}' initialized in {time.time() - start_time:.2f} seconds"
-            )
+            with self._lock:
+                if model_id not in self._model_inference_cache:
+                    start_time = time.time()
+                    self._model_inference_cache[model_id] = wx.inference.ModelInference(
+                        api_client=self.client, model_id=model_id
+                    )
+                    print(
+                        f"ModelInference for '{model_id}' initialized in {time.time() - start_time:.2f} seconds"
+                    )
         return self._model_inference_cache[model_id]
 
+    def get_embeddings(self, model_id: str) -> Embeddings:
+        if model_id not in self._embeddings_cache:
+            with self._lock:
+                if model_id not in self._embeddings_cache:
+                    start_time = time.time()
+                    self._embeddings_cache[model_id] = Embeddings(
+                        api_client=self.client,
+                        model_id=model_id,
+                        # Longer inputs are cut instead of failing the request
+                        params={"truncate_input_tokens": 512},
+                    )
+                    print(
+                        f"Embeddings for '{model_id}' initialized in {time.time() - start_time:.2f} seconds"
+                    )
+        return self._embeddings_cache[model_id]
+
+    def pool_stats(self) -> dict[str, PoolStats]:
+        """The connection pools to watsonx, of sync and of async calls."""
+        return {
+            "sync": pool_stats(self.client.httpx_client),
+            "async": pool_stats(self.client.async_httpx_client),
+        }
+
+    def embed(self, model: str, texts: list[str]) -> list[list[float]]:
+        vectors: list[list[float]] = self.get_embeddings(model).embed_documents(texts)
+        return vectors
+
+    async def aembed(self, model: str, texts: list[str]) -> list[list[float]]:
+        embeddings = self.get_embeddings(model)
+        vectors: list[list[float]] = await embeddings.aembed_documents(texts)
+        return vectors
+
     def chat(
-        self, model: str, messages: list[dict], parameters: dict = None
+        self,
+        model: str,
+        messages: list[dict[str, Any]],
+        parameters: dict[str, Any] | None = None,
     ) -> str | None:
         if parameters is None:
             parameters = {}
         model_inference = self.get_model_inference(model)
 
-        response = model_inference.chat(
-            messages,
-            params=wx.schema.TextChatParameters(
-                temperature=parameters.get("temperature"),
-                max_tokens=parameters.get("max_tokens"),
-                top_p=parameters.get("top_p"),
-                response_format=parameters.get("response_format"),
-            ),
+        # Reserves the prompt and the answer like the agents' calls, without
+        # `max_tokens` the answer may take what the context window leaves
+        prompt_tokens, max_tokens = completion_budget(
+            convert_to_messages(messages),
+            parameters.get("max_tokens") or settings.AGENT_CONTEXT_WINDOW,
+        )
+        reserved = prompt_tokens + max_tokens
+        params = wx.schema.TextChatParameters(
+            temperature=parameters.get("temperature"),
+            max_tokens=max_tokens,
+            top_p=parameters.get("top_p"),
+            response_format=parameters.get("response_format"),
+        )
+        response: dict[str, Any] | None = call_with_policy(
+            f"chat:{model}",
+            lambda: model_inference.chat(messages, params=params),
+            CallPolicy.default(parameters.get("deadline"), reserved),
         )
 
-        print(f"USAGE: {response.get('usage')}")
+        # What the answer did not use of its reservation, all of it if watsonx
+        # reported no usage
+        usage = (response or {}).get("usage") or {}
+        quota.refund(
+            reserved - usage.get("prompt_tokens", 0) - usage.get("completion_tokens", 0)
+        )
 
-        if not (response and response.get("choices") and response.get("usage")):
+        if not (response and response.get("choices")):
             return None
+        content: str | None = response["choices"][0]["message"]["content"]
+        return content
+
+
+class PoolCollector(Collector):
+    """The connection pools to watsonx, on each scrape once the client exists.
+
+    Read from the scraped process only, so not served with
+    PROMETHEUS_MULTIPROC_DIR. If the pools cannot be read, the gauges stay
+    empty instead of failing the scrape.
+    """
+
+    def __init__(self) -> None:
+        self._failed = False
+
+    def _pool_stats(self) -> dict[str, PoolStats]:
+        # `Singleton` replaces the class, which mypy does not see
+        if not WatsonxProvider.created():  # type: ignore[attr-defined]
+            return {}
+        try:
+            provider = WatsonxProvider.instance()  # type: ignore[attr-defined]
+            stats: dict[str, PoolStats] = provider.pool_stats()
+            return stats
+        except Exception as e:
+            if not self._failed:
+                print(f"⚠️  Reading the watsonx connection pools failed: {e!r}")
+                self._failed = True
+            return {}
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        connections = GaugeMetricFamily(
+            "watsonx_http_connections",
+            "Open HTTP connections to watsonx by client and state",
+            labels=["client", "state"],
+        )
+        queued = GaugeMetricFamily(
+            "watsonx_http_queued_requests",
+            "Requests to watsonx waiting for a connection of the pool",
+            labels=["client"],
+        )
+        limit = GaugeMetricFamily(
+            "watsonx_http_max_connections",
+            "Size of the HTTP connection pools to watsonx",
+            labels=["client"],
+        )
+        for client, stats in self._pool_stats().items():
+            connections.add_metric([client, "active"], stats.active)
+            connections.add_metric([client, "idle"], stats.idle)
+            queued.add_metric([client], stats.queued_requests)
+            limit.add_metric([client], stats.max_connections)
+        yield connections
+        yield queued
+        yield limit
+
 
-        return response["choices"][0]["message"]["content"]
+REGISTRY.register(PoolCollector())
@@ -34,7 +34,19 @@ class AgentRun(SQLModel, table=True):
     status_message: str = Field()
     draft_body: str = Field()
     draft_subject: str = Field()
+    # Set for runs submitted together through the batch endpoint
+    batch_id: uuid.UUID | None = Field(default=None, index=True)
+    # "staged" (master -> expert -> email drafter) or "fused" (single LLM call)
+    pipeline: str = Field(default="staged")
+    # Tokens of all LLM calls of the run, as reported by watsonx or estimated
+    prompt_tokens: int = Field(default=0)
+    completion_tokens: int = Field(default=0)
+    # Renewed by the process executing the run, see `app.agent.run_lease`
+    lease_renewed_at: datetime | None = Field(default=None)
     steps: list["Step"] = Relationship(back_populates="agent_run", cascade_delete=True)
+    jobs: list["AgentJob"] = Relationship(
+        back_populates="agent_run", cascade_delete=True
+    )
 
 
 class Step(SQLModel, table=True):
@@ -43,7 +55,40 @@ class Step(SQLModel, table=True):
     text: str = Field()
     status: str = Field()
     created_at: datetime = Field(default_factory=datetime.now)
+    # Telemetry of the node that ran the step, see `GET /agent/{run_id}/timeline`
+    started_at: datetime | None = Field(default=None)
+    finished_at: datetime | None = Field(default=None)
+    # Seconds spent waiting for LLM calls and for writes to the database
+    llm_seconds: float = Field(default=0)
+    db_seconds: float = Field(default=0)
+    prompt_tokens: int = Field(default=0)
+    completion_tokens: int = Field(default=0)
+    # Models of the step's LLM calls in call order, e.g. escalated from small to large
+    model: str | None = Field(default=None)
     agent_run_id: uuid.UUID = Field(
         foreign_key="agentrun.id", nullable=False, ondelete="CASCADE"
     )
     agent_run: AgentRun | None = Relationship(back_populates="steps")
+
+
+# Durable queue entry for an agent run, claimed by `app.worker`
+class AgentJob(SQLModel, table=True):
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    status: str = Field(default="queued", index=True)
+    attempts: int = Field(default=0)
+    last_error: str | None = Field(default=None)
+    created_at: datetime = Field(default_factory=datetime.now)
+    locked_at: datetime | None = Field(default=None)
+    # A queued job is not claimed before this, set when a failed attempt backs off
+    not_before: datetime | None = Field(default=None)
+    agent_run_id: uuid.UUID = Field(
+        foreign_key="agentrun.id", nullable=False, ondelete="CASCADE"
+    )
+    agent_run: AgentRun | None = Relationship(back_populates="jobs")
+
+
+class RateLimitBucket(SQLModel, table=True):
+    # Token bucket shared by all processes, see `app.services.rate_limit`
+    name: str = Field(primary_key=True)
+    tokens: float = Field()
+    updated_at: datetime = Field()
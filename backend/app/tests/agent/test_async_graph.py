@@ -0,0 +1,218 @@
+import asyncio
+from typing import Any
+
+import pytest
+from langchain_core.messages import AIMessage, BaseMessage
+from prometheus_client import REGISTRY
+from sqlmodel import Session, select
+
+from app.agent import langgraph, run_events
+from app.agent.fake_llm import DRAFT, FakeChatModel
+from app.agent.run_events import RunEvent, Subscription, status_event
+from app.agent.run_state import get_run_state
+from app.core.config import settings
+from app.core.db import async_engine
+from app.tables import AgentRun, Step
+
+
+class FailingDrafter(FakeChatModel):
+    """Loses the connection in the middle of the draft."""
+
+    def __init__(self) -> None:
+        super().__init__(latency=0)
+
+    def stream(self, messages: list, **kwargs):
+        for chunk in super().stream(messages, **kwargs):
+            yield chunk
+            raise RuntimeError("Drafter crashed")
+
+    async def astream(self, messages: list, **kwargs):
+        async for chunk in super().astream(messages, **kwargs):
+            yield chunk
+            # Not transient, so neither retried nor counted by the breaker
+            raise RuntimeError("Drafter crashed")
+
+
+class SlowRouter(FakeChatModel):
+    """Routes only once the speculative expert analyses finished."""
+
+    def __init__(self) -> None:
+        super().__init__(latency=0)
+
+    async def ainvoke(self, messages: list[BaseMessage], **kwargs: Any) -> AIMessage:
+        if messages[0] is langgraph.MASTER_SYSTEM_MESSAGE:
+            await asyncio.sleep(0.1)
+        return await super().ainvoke(messages, **kwargs)
+
+
+@pytest.fixture(autouse=True)
+def no_checkpoints(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "AGENT_CHECKPOINTING", False)
+
+
+def create_agent_run(db: Session) -> AgentRun:
+    agent_run = AgentRun(
+        mail_sender="max.mustermann@example.com",
+        mail_subject="Krankengeld",
+        mail_body="Wann wird das Krankengeld überwiesen?",
+        status="running",
+        status_message="Agent processing started",
+        draft_body="",
+        draft_subject="",
+    )
+    db.add(agent_run)
+    db.commit()
+    return agent_run
+
+
+def run_async(
+    agent_run: AgentRun, events: list[RunEvent], pipeline: str = "staged"
+) -> None:
+    """Run the async graph, collecting the events a client subscribed to it got."""
+    mail = langgraph.format_mail(
+        agent_run.mail_subject, agent_run.mail_body, agent_run.mail_sender
+    )
+
+    async def run() -> None:
+        try:
+            with Subscription(agent_run.id) as subscription:
+                try:
+                    await langgraph.arun_graph(mail, agent_run.id, pipeline)
+                finally:
+                    while event := await subscription.get(timeout=0.1):
+                        events.append(event)
+        finally:
+            # Connections of the engine belong to this event loop
+            await async_engine.dispose()
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("pipeline", ["staged", "fused"])
+def test_async_run_completes(
+    db: Session, monkeypatch: pytest.MonkeyPatch, pipeline: str
+) -> None:
+    fake = FakeChatModel(latency=0)
+    monkeypatch.setattr(langgraph, "small_llm", fake)
+    monkeypatch.setattr(langgraph, "llm", fake)
+    agent_run = create_agent_run(db)
+
+    events: list[RunEvent] = []
+    run_async(agent_run, events, pipeline)
+
+    assert events[-1].type == "done"
+    db.refresh(agent_run)
+    assert agent_run.status == "completed"
+    assert agent_run.draft_body == DRAFT
+    steps = db.exec(
+        select(Step.type, Step.status)
+        .where(Step.agent_run_id == agent_run.id)
+        .order_by(Step.created_at)
+    ).all()
+    assert steps == [
+        ("master_agent", "completed"),
+        ("krankengeld_expert", "completed"),
+        ("email_drafter", "completed"),
+    ]
+    assert get_run_state(agent_run.id) is None
+
+    db.delete(agent_run)
+    db.commit()
+
+
+def test_failed_async_run_is_marked_failed(
+    db: Session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    fake = FailingDrafter()
+    monkeypatch.setattr(langgraph, "small_llm", fake)
+    monkeypatch.setattr(langgraph, "llm", fake)
+    agent_run = create_agent_run(db)
+
+    events: list[RunEvent] = []
+    with pytest.raises(RuntimeError):
+        run_async(agent_run, events)
+
+    db.refresh(agent_run)
+    assert (agent_run.status, agent_run.status_message) == (
+        "failed",
+        "Agent processing failed",
+    )
+    # Clients got the draft's first token and then the end of the run
+    assert events[-2].type == "token"
+    assert events[-1] == status_event("failed", "Agent processing failed")
+    assert get_run_state(agent_run.id) is None
+    assert agent_run.id not in run_events._runs
+
+    db.delete(agent_run)
+    db.commit()
+
+
+def test_failed_sync_run_is_marked_failed(
+    db: Session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    fake = FailingDrafter()
+    monkeypatch.setattr(langgraph, "small_llm", fake)
+    monkeypatch.setattr(langgraph, "llm", fake)
+    agent_run = create_agent_run(db)
+
+    with pytest.raises(RuntimeError):
+        langgraph.run_graph(
+            langgraph.format_mail(
+                agent_run.mail_subject, agent_run.mail_body, agent_run.mail_sender
+            ),
+            db,
+            agent_run.id,
+        )
+
+    db.refresh(agent_run)
+    assert agent_run.status == "failed"
+    assert get_run_state(agent_run.id) is None
+
+    db.delete(agent_run)
+    db.commit()
+
+
+def test_speculative_usage_is_booked_on_the_expert(
+    db: Session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    fake = SlowRouter()
+    monkeypatch.setattr(langgraph, "small_llm", fake)
+    monkeypatch.setattr(langgraph, "llm", fake)
+    monkeypatch.setattr(settings, "AGENT_SPECULATIVE_EXPERTS", 2)
+    agent_run = create_agent_run(db)
+    agent_run.mail_body = (
+        "Wann wird das Krankengeld überwiesen? Brauche ich dafür einen Termin?"
+    )
+    db.commit()
+
+    def discarded() -> float:
+        return (
+            REGISTRY.get_sample_value(
+                "agent_speculation_discarded_tokens_total",
+                {"expert": "terminvermittlung"},
+            )
+            or 0
+        )
+
+    before = discarded()
+    run_async(agent_run, [])
+
+    db.refresh(agent_run)
+    steps = {
+        step.type: step
+        for step in db.exec(select(Step).where(Step.agent_run_id == agent_run.id))
+    }
+    master, expert = steps["master_agent"], steps["krankengeld_expert"]
+    # The master agent's step only has its routing call
+    assert master.model == fake.model_id
+    assert expert.prompt_tokens > 0 and expert.llm_seconds >= 0
+    assert expert.model == fake.model_id
+    # The analysis of the expert not picked only counts on the run
+    wasted = discarded() - before
+    assert wasted > 0
+    assert agent_run.prompt_tokens + agent_run.completion_tokens == wasted + sum(
+        step.prompt_tokens + step.completion_tokens for step in steps.values()
+    )
+
+    db.delete(agent_run)
+    db.commit()
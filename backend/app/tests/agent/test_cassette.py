@@ -0,0 +1,91 @@
+import asyncio
+import json
+import threading
+from pathlib import Path
+
+import pytest
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from app.agent.cassette import (
+    Cassette,
+    CassetteMiss,
+    RecordingChatModel,
+    ReplayChatModel,
+)
+from app.agent.fake_llm import DRAFT, FakeChatModel
+
+MAIL = HumanMessage(content="Wann überweisen Sie mein Krankengeld?")
+DRAFTER = SystemMessage(content="Schreibe eine Antwort auf die E-Mail.")
+
+
+def record(path: Path, latency: float = 0) -> FakeChatModel:
+    fake = FakeChatModel(latency=latency)
+    recorder = RecordingChatModel("large", fake, Cassette(str(path)))
+    recorder.invoke([DRAFTER, MAIL], max_tokens=10)
+    list(recorder.stream([DRAFTER, MAIL]))
+    recorder.cassette.close()
+    return fake
+
+
+@pytest.mark.parametrize("name", ["cassette.jsonl", "cassette.jsonl.gz"])
+def test_replays_recorded_answers(tmp_path: Path, name: str) -> None:
+    path = tmp_path / name
+    fake = record(path)
+    replay = ReplayChatModel("large", Cassette(str(path)), latency=False)
+
+    answer = replay.invoke([DRAFTER, MAIL], max_tokens=10)
+    assert answer.content == fake.invoke([DRAFTER, MAIL], max_tokens=10).content
+    assert answer.response_metadata["finish_reason"] == "length"
+    chunks = list(replay.stream([DRAFTER, MAIL]))
+    assert len(chunks) > 1
+    response = sum(chunks[1:], chunks[0])
+    assert response.content == DRAFT
+    assert response.usage_metadata == fake.invoke([DRAFTER, MAIL]).usage_metadata
+
+
+def test_replays_recorded_latency(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    path = tmp_path / "cassette.jsonl"
+    record(path, latency=0.05)
+    recorded = json.loads(path.read_text().splitlines()[0])["chunks"][-1][0]
+    sleeps: list[float] = []
+
+    async def sleep(seconds: float) -> None:
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    for latency in (True, False):
+        replay = ReplayChatModel("large", Cassette(str(path)), latency)
+        asyncio.run(replay.ainvoke([DRAFTER, MAIL], max_tokens=10))
+    assert recorded >= 0.05
+    assert sleeps == [recorded, 0]
+
+
+def test_records_hedged_duplicates_once(tmp_path: Path) -> None:
+    path = tmp_path / "cassette.jsonl"
+    recorder = RecordingChatModel(
+        "large", FakeChatModel(latency=0.05), Cassette(str(path))
+    )
+
+    def call() -> None:
+        recorder.invoke([DRAFTER, MAIL], max_tokens=10)
+
+    # A request and its hedged duplicate, then the same request again
+    hedges = [threading.Thread(target=call) for _ in range(2)]
+    for hedge in hedges:
+        hedge.start()
+    for hedge in hedges:
+        hedge.join()
+    call()
+    recorder.cassette.close()
+
+    assert len(path.read_text().splitlines()) == 2
+
+
+def test_misses_unrecorded_requests(tmp_path: Path) -> None:
+    path = tmp_path / "cassette.jsonl"
+    record(path)
+    replay = ReplayChatModel("small", Cassette(str(path)), latency=False)
+    with pytest.raises(CassetteMiss):
+        replay.invoke([DRAFTER, MAIL], max_tokens=10)
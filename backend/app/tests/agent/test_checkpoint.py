@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+from psycopg_pool import AsyncConnectionPool
+from sqlmodel import Session, select
+
+from app.agent import checkpoint, langgraph
+from app.agent.checkpoint import (
+    aclose_checkpointer,
+    aget_checkpointer,
+    get_checkpointer,
+    setup_checkpoints,
+)
+from app.agent.fake_llm import DRAFT, FakeChatModel
+from app.core.config import settings
+from app.tables import AgentRun, Step
+
+
+class CrashingDrafter(FakeChatModel):
+    """Fails the email drafter once, like a worker dying mid-run."""
+
+    def __init__(self) -> None:
+        super().__init__(latency=0)
+        self.invoked = 0
+        self.crash = True
+
+    def invoke(self, messages: list, **kwargs):
+        self.invoked += 1
+        return super().invoke(messages, **kwargs)
+
+    def stream(self, messages: list, **kwargs):
+        if self.crash:
+            raise RuntimeError("Worker crashed")
+        yield from super().stream(messages, **kwargs)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def checkpoints() -> None:
+    setup_checkpoints()
+
+
+@pytest.fixture(autouse=True)
+def checkpointing(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "AGENT_CHECKPOINTING", True)
+
+
+def test_resumes_after_the_last_completed_node(
+    db: Session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    fake = CrashingDrafter()
+    monkeypatch.setattr(langgraph, "small_llm", fake)
+    monkeypatch.setattr(langgraph, "llm", fake)
+    agent_run = AgentRun(
+        mail_sender="max.mustermann@example.com",
+        mail_subject="Krankengeld",
+        mail_body="Wann wird das Krankengeld überwiesen?",
+        status="running",
+        status_message="Agent processing started",
+        draft_body="",
+        draft_subject="",
+    )
+    db.add(agent_run)
+    db.commit()
+    mail = langgraph.format_mail(
+        agent_run.mail_subject, agent_run.mail_body, agent_run.mail_sender
+    )
+
+    with pytest.raises(RuntimeError):
+        langgraph.run_graph(mail, db, agent_run.id)
+    # The master and the expert agent called the LLM before the crash
+    assert fake.invoked == 2
+
+    fake.crash = False
+    assert langgraph.run_graph(mail, db, agent_run.id) == DRAFT
+    assert fake.invoked == 2
+
+    db.refresh(agent_run)
+    assert agent_run.status == "completed"
+    assert agent_run.prompt_tokens > 0
+    steps = db.exec(
+        select(Step.type, Step.status)
+        .where(Step.agent_run_id == agent_run.id)
+        .order_by(Step.created_at)
+    ).all()
+    assert steps == [
+        ("master_agent", "completed"),
+        ("krankengeld_expert", "completed"),
+        ("email_drafter", "interrupted"),
+        ("email_drafter", "completed"),
+    ]
+    config = langgraph.run_config(agent_run.id)
+    assert get_checkpointer().get_tuple(config) is None
+
+    db.delete(agent_run)
+    db.commit()
+
+
+def test_async_pool_is_closed_with_its_loop() -> None:
+    async def run() -> AsyncConnectionPool:
+        saver = await aget_checkpointer()
+        # Runs of the same loop share its pool
+        assert (await aget_checkpointer()).conn is saver.conn
+        await aclose_checkpointer()
+        return saver.conn
+
+    pools = [asyncio.run(run()) for _ in range(2)]
+    assert pools[0] is not pools[1]
+    assert all(pool.closed for pool in pools)
+    assert not checkpoint._async_pools
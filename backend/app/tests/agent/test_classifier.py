@@ -0,0 +1,45 @@
+from pathlib import Path
+
+from app.agent.classifier import RoutingClassifier, tokenize
+
+TRAINING_DATA = [
+    ("Wann wird mein Krankengeld überwiesen?", "krankengeld"),
+    ("Ich bin krank, bekomme ich Krankengeld?", "krankengeld"),
+    ("Krankengeld nach der Lohnfortzahlung", "krankengeld"),
+    ("Ich brauche einen Termin beim Facharzt", "terminvermittlung"),
+    ("Können Sie mir einen Termin vermitteln?", "terminvermittlung"),
+    ("Die Wartezeit auf einen Termin ist zu lang", "terminvermittlung"),
+]
+
+
+def test_tokenize() -> None:
+    assert tokenize("Mein Krankengeld, bitte!") == [
+        "mein",
+        "krankengeld",
+        "bitte",
+        "mein krankengeld",
+        "krankengeld bitte",
+    ]
+
+
+def test_train_and_predict() -> None:
+    texts, labels = zip(*TRAINING_DATA, strict=True)
+    classifier = RoutingClassifier.train(list(texts), list(labels), min_df=1)
+
+    expert_agent, confidence = classifier.predict("Wann kommt mein Krankengeld?")
+    assert expert_agent == "krankengeld"
+    assert 0.5 < confidence <= 1.0
+
+    expert_agent, _ = classifier.predict("Bitte einen Termin beim Facharzt")
+    assert expert_agent == "terminvermittlung"
+
+
+def test_save_and_load(tmp_path: Path) -> None:
+    texts, labels = zip(*TRAINING_DATA, strict=True)
+    classifier = RoutingClassifier.train(list(texts), list(labels), min_df=1)
+    path = str(tmp_path / "routing_classifier.npz")
+    classifier.save(path)
+
+    loaded = RoutingClassifier.load(path)
+    mail = "Krankengeld Termin"
+    assert loaded.predict(mail) == classifier.predict(mail)
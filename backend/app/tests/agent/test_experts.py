@@ -0,0 +1,21 @@
+from app.agent.experts import EXPERT_DESCRIPTIONS, EXPERTS, Expert
+
+
+def test_chat_params_skip_unset_values() -> None:
+    expert = Expert(
+        icon="",
+        label="Test",
+        description="",
+        running_text="",
+        completed_text="",
+        system_message="",
+        max_tokens=500,
+        timeout=2.5,
+    )
+    assert expert.chat_params() == {"max_tokens": 500, "time_limit": 2500}
+
+
+def test_descriptions_list_every_expert() -> None:
+    assert EXPERT_DESCRIPTIONS.splitlines() == [
+        f"- {name}: {expert.description}" for name, expert in EXPERTS.items()
+    ]
@@ -0,0 +1,71 @@
+import asyncio
+import json
+
+import pytest
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from app.agent import langgraph
+from app.agent.fake_llm import ANALYSIS, DRAFT, FakeChatModel, route_by_keywords
+from app.agent.token_budget import count_tokens
+
+MAIL = HumanMessage(content="Wann überweisen Sie mein Krankengeld?")
+DRAFTER = SystemMessage(content="Schreibe eine Antwort auf die E-Mail.")
+
+
+def test_routes_by_expert_keywords() -> None:
+    assert route_by_keywords("Wann kommt mein Krankengeld?") == "krankengeld"
+    assert route_by_keywords("Ich lege Widerspruch ein.") == "widerspruch"
+    assert route_by_keywords("Guten Tag") == "sonstiges"
+
+
+def test_answers_each_stage() -> None:
+    fake = FakeChatModel(latency=0)
+
+    master = fake.invoke([langgraph.MASTER_SYSTEM_MESSAGE, MAIL])
+    assert langgraph.parse_expert_agent(master.content) == "krankengeld"
+    fused = fake.invoke([langgraph.FUSED_SYSTEM_MESSAGE, MAIL])
+    assert json.loads(fused.content)["category"] == "krankengeld"
+    expert = langgraph.EXPERTS["krankengeld"]
+    assert fake.invoke([expert.system_message, MAIL]).content == ANALYSIS
+    draft = fake.invoke([DRAFTER, MAIL])
+    assert draft.content == DRAFT
+    assert draft.usage_metadata["output_tokens"] == count_tokens(DRAFT)
+
+
+def test_cuts_off_at_max_tokens() -> None:
+    fake = FakeChatModel(latency=0)
+    draft = fake.invoke([DRAFTER, MAIL], max_tokens=10)
+    assert draft.response_metadata["finish_reason"] == "length"
+    assert draft.usage_metadata["output_tokens"] == 10
+
+
+def test_stream_adds_up_to_the_answer() -> None:
+    fake = FakeChatModel(latency=0)
+    messages = [DRAFTER, MAIL]
+    chunks = list(fake.stream(messages))
+    assert len(chunks) > 1
+    response = sum(chunks[1:], chunks[0])
+    assert response.content == DRAFT
+    assert response.usage_metadata == fake.invoke(messages).usage_metadata
+
+
+def test_injects_errors_reproducibly() -> None:
+    def failures(seed: int) -> list[bool]:
+        fake = FakeChatModel(latency=0.001, error_rate=0.5, seed=seed)
+        results = []
+        for _ in range(20):
+            try:
+                fake.invoke([MAIL])
+                results.append(False)
+            except ConnectionError:
+                results.append(True)
+        return results
+
+    assert failures(1) == failures(1)
+    assert 0 < sum(failures(1)) < 20
+
+
+def test_async_invoke_fails_like_sync() -> None:
+    fake = FakeChatModel(latency=0, error_rate=1)
+    with pytest.raises(ConnectionError):
+        asyncio.run(fake.ainvoke([MAIL]))
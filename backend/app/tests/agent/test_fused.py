@@ -0,0 +1,29 @@
+import json
+
+from app.agent.langgraph import parse_fused_response, route_after_fused
+
+
+def test_parse_fused_response() -> None:
+    content = json.dumps(
+        {"category": " Krankengeld", "analysis": "Analyse", "draft": "Entwurf"}
+    )
+    response = parse_fused_response(f"```json\n{content}\n```")
+    assert response
+    assert response.category == "krankengeld"
+    assert response.draft == "Entwurf"
+
+
+def test_parse_fused_response_rejects_unusable_answers() -> None:
+    assert parse_fused_response("krankengeld") is None
+    assert parse_fused_response(json.dumps({"category": "krankengeld"})) is None
+    assert (
+        parse_fused_response(
+            json.dumps({"category": "urlaub", "analysis": "", "draft": ""})
+        )
+        is None
+    )
+
+
+def test_route_after_fused_falls_back_to_master() -> None:
+    assert route_after_fused({"next_agent": "krankengeld"}) == "__end__"
+    assert route_after_fused({}) == "master"
@@ -0,0 +1,66 @@
+import uuid
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from app.agent import langgraph
+from app.agent.run_state import RunState
+from app.agent.write_behind import RunBuffer
+
+
+class FakeChatModel:
+    model_id = "fake"
+
+    def __init__(self, *answers: AIMessage) -> None:
+        self.answers = list(answers)
+        self.calls = 0
+
+    def invoke(self, messages: list, **kwargs) -> AIMessage:
+        self.calls += 1
+        return self.answers.pop(0)
+
+
+@pytest.fixture
+def models(monkeypatch: pytest.MonkeyPatch):
+    def install(small: FakeChatModel, large: FakeChatModel) -> None:
+        monkeypatch.setattr(langgraph, "small_llm", small)
+        monkeypatch.setattr(langgraph, "llm", large)
+
+    return install
+
+
+def test_routing_escalates_invalid_answers(models) -> None:
+    small = FakeChatModel(AIMessage(content="Das ist eine Krankengeld-Anfrage."))
+    large = FakeChatModel(AIMessage(content="krankengeld"))
+    models(small, large)
+
+    buffer = RunBuffer(RunState(uuid.uuid4()))
+    messages = [HumanMessage(content="Wann kommt mein Krankengeld?")]
+    assert langgraph.route_with_llm(messages, buffer) == ("krankengeld", "large")
+    assert (small.calls, large.calls) == (1, 1)
+
+
+def test_routing_stays_on_small_model(models) -> None:
+    small = FakeChatModel(AIMessage(content=" Krankengeld\n"))
+    large = FakeChatModel()
+    models(small, large)
+
+    buffer = RunBuffer(RunState(uuid.uuid4()))
+    messages = [HumanMessage(content="Wann kommt mein Krankengeld?")]
+    assert langgraph.route_with_llm(messages, buffer) == ("krankengeld", "small")
+    assert large.calls == 0
+
+
+def test_truncated_analysis_is_redone_by_large_model(models) -> None:
+    truncated = AIMessage(
+        content="Der Termin", response_metadata={"finish_reason": "length"}
+    )
+    small = FakeChatModel(truncated)
+    large = FakeChatModel(AIMessage(content="Vollständige Analyse"))
+    models(small, large)
+
+    buffer = RunBuffer(RunState(uuid.uuid4()))
+    messages = [HumanMessage(content="Ich brauche einen Facharzttermin.")]
+    analysis = langgraph.analyze_with_expert("terminvermittlung", messages, buffer)
+    assert analysis == "Vollständige Analyse"
+    assert buffer.run_state.completion_tokens > 0
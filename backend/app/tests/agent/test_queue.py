@@ -0,0 +1,294 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timedelta
+from typing import TypeVar
+
+import pytest
+from sqlmodel import Session, delete, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import worker
+from app.agent.queue import (
+    LeaseLost,
+    claim_job,
+    complete_job,
+    enqueue_run,
+    fail_job,
+    renew_lease,
+)
+from app.core.config import settings
+from app.core.db import async_engine
+from app.tables import AgentJob, AgentRun, Step
+
+T = TypeVar("T")
+
+
+def run(test: Callable[[AsyncSession], Awaitable[T]]) -> T:
+    async def main() -> T:
+        try:
+            async with AsyncSession(async_engine, expire_on_commit=False) as session:
+                return await test(session)
+        finally:
+            # Connections of the engine belong to this event loop
+            await async_engine.dispose()
+
+    return asyncio.run(main())
+
+
+@pytest.fixture(autouse=True)
+def empty_queue(db: Session) -> None:
+    # Jobs are claimed oldest first, whoever queued them
+    db.exec(delete(AgentJob))
+    db.commit()
+
+
+def queue_run(db: Session, **job: object) -> AgentJob:
+    agent_run = AgentRun(
+        mail_sender="max.mustermann@example.com",
+        mail_subject="Krankengeld",
+        mail_body="Wann wird das Krankengeld überwiesen?",
+        status="running",
+        status_message="Agent processing started",
+        draft_body="",
+        draft_subject="",
+    )
+    db.add(agent_run)
+    queued = enqueue_run(db, agent_run)
+    for field, value in job.items():
+        setattr(queued, field, value)
+    db.commit()
+    db.refresh(queued)
+    return queued
+
+
+def expired_lock() -> datetime:
+    return datetime.now() - timedelta(seconds=settings.AGENT_JOB_LEASE_SECONDS + 1)
+
+
+def delete_runs(db: Session, *jobs: AgentJob) -> None:
+    for job in jobs:
+        agent_run = db.get(AgentRun, job.agent_run_id)
+        if agent_run:
+            db.delete(agent_run)
+    db.commit()
+
+
+def test_claims_oldest_queued_job_once(db: Session) -> None:
+    first = queue_run(db)
+    second = queue_run(db)
+
+    async def claim_all(session: AsyncSession) -> list[AgentJob | None]:
+        return [await claim_job(session) for _ in range(3)]
+
+    claimed = run(claim_all)
+    assert [job.id if job else None for job in claimed] == [first.id, second.id, None]
+    assert claimed[0].status == "running"
+    assert claimed[0].attempts == 1
+    assert claimed[0].locked_at
+
+    delete_runs(db, first, second)
+
+
+def test_skips_jobs_locked_by_another_worker(db: Session) -> None:
+    first = queue_run(db)
+    second = queue_run(db)
+
+    async def claim_concurrently(session: AsyncSession) -> AgentJob | None:
+        # The first worker holds the row lock of the oldest job mid-claim
+        await session.exec(
+            select(AgentJob).where(AgentJob.id == first.id).with_for_update()
+        )
+        async with AsyncSession(async_engine, expire_on_commit=False) as other_session:
+            job = await asyncio.wait_for(claim_job(other_session), timeout=5)
+        await session.rollback()
+        return job
+
+    claimed = run(claim_concurrently)
+    assert claimed and claimed.id == second.id
+
+    delete_runs(db, first, second)
+
+
+def test_completes_job(db: Session) -> None:
+    job = queue_run(db)
+
+    async def claim_and_complete(session: AsyncSession) -> None:
+        claimed = await claim_job(session)
+        await complete_job(session, claimed)
+
+    run(claim_and_complete)
+    db.refresh(job)
+    assert job.status == "completed"
+
+    delete_runs(db, job)
+
+
+def test_failed_job_is_requeued_until_last_attempt(
+    db: Session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "AGENT_JOB_RETRY_BACKOFF_SECONDS", 0)
+    job = queue_run(db)
+
+    async def claim_and_fail(session: AsyncSession) -> None:
+        claimed = await claim_job(session)
+        await fail_job(session, claimed, "RuntimeError()")
+
+    for attempt in range(1, settings.AGENT_JOB_MAX_ATTEMPTS + 1):
+        run(claim_and_fail)
+        db.refresh(job)
+        assert job.attempts == attempt
+        last_attempt = attempt == settings.AGENT_JOB_MAX_ATTEMPTS
+        assert job.status == ("failed" if last_attempt else "queued")
+    assert job.last_error == "RuntimeError()"
+    agent_run = db.get(AgentRun, job.agent_run_id)
+    db.refresh(agent_run)
+    assert agent_run.status == "failed"
+
+    delete_runs(db, job)
+
+
+def test_failed_job_backs_off_and_starts_over(
+    db: Session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "AGENT_CHECKPOINTING", False)
+    job = queue_run(db)
+    db.add(
+        Step(
+            type="master_agent",
+            text="Analyzing",
+            status="running",
+            agent_run_id=job.agent_run_id,
+        )
+    )
+    db.commit()
+
+    async def claim_and_fail(session: AsyncSession) -> AgentJob | None:
+        claimed = await claim_job(session)
+        await fail_job(session, claimed, "RuntimeError()")
+        return await claim_job(session)
+
+    assert run(claim_and_fail) is None
+    db.refresh(job)
+    assert job.status == "queued"
+    assert job.not_before > datetime.now()
+    agent_run = db.get(AgentRun, job.agent_run_id)
+    db.refresh(agent_run)
+    assert agent_run.status == "running"
+    assert agent_run.steps == []
+
+    job.not_before = datetime.now()
+    db.commit()
+    claimed = run(claim_job)
+    assert claimed and claimed.id == job.id
+
+    delete_runs(db, job)
+
+
+def test_reclaims_job_whose_lease_expired(db: Session) -> None:
+    job = queue_run(db, status="running", attempts=1, locked_at=expired_lock())
+
+    claimed = run(claim_job)
+    assert claimed and claimed.id == job.id
+    assert claimed.attempts == 2
+
+    delete_runs(db, job)
+
+
+def test_renewed_lease_is_not_reclaimed(db: Session) -> None:
+    job = queue_run(db, status="running", attempts=1, locked_at=expired_lock())
+
+    async def renew_and_claim(session: AsyncSession) -> AgentJob | None:
+        await renew_lease(session, job)
+        return await claim_job(session)
+
+    assert run(renew_and_claim) is None
+    db.refresh(job)
+    assert job.locked_at > expired_lock()
+
+    delete_runs(db, job)
+
+
+def test_lease_of_reclaimed_job_is_not_renewed(db: Session) -> None:
+    job = queue_run(db, status="running", attempts=1, locked_at=expired_lock())
+
+    async def reclaim_and_renew(session: AsyncSession) -> bool:
+        await claim_job(session)
+        # The worker of the first attempt is still alive
+        return await renew_lease(session, job)
+
+    assert not run(reclaim_and_renew)
+
+    delete_runs(db, job)
+
+
+def test_fails_expired_job_without_attempts_left(db: Session) -> None:
+    job = queue_run(
+        db,
+        status="running",
+        attempts=settings.AGENT_JOB_MAX_ATTEMPTS,
+        locked_at=expired_lock(),
+    )
+
+    assert run(claim_job) is None
+    db.refresh(job)
+    assert job.status == "failed"
+    agent_run = db.get(AgentRun, job.agent_run_id)
+    db.refresh(agent_run)
+    assert (agent_run.status, agent_run.status_message) == (
+        "failed",
+        "Agent processing failed",
+    )
+
+    delete_runs(db, job)
+
+
+def test_worker_renews_lease_while_running(
+    db: Session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "AGENT_JOB_LEASE_SECONDS", 0.3)
+
+    async def slow_run(*_: object) -> None:
+        await asyncio.sleep(0.5)
+
+    monkeypatch.setattr(worker, "execute_run", slow_run)
+    job = queue_run(db)
+
+    async def claim_and_run(session: AsyncSession) -> datetime:
+        claimed = await claim_job(session)
+        await worker.run_job(claimed)
+        return claimed.locked_at
+
+    claimed_at = run(claim_and_run)
+    db.refresh(job)
+    assert job.locked_at > claimed_at
+
+    delete_runs(db, job)
+
+
+def test_worker_stops_job_claimed_by_another_worker(
+    db: Session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "AGENT_JOB_LEASE_SECONDS", 0.3)
+    stopped = asyncio.Event()
+
+    async def endless_run(*_: object) -> None:
+        try:
+            await asyncio.sleep(10)
+        finally:
+            stopped.set()
+
+    monkeypatch.setattr(worker, "execute_run", endless_run)
+    job = queue_run(db)
+
+    async def claim_and_run(session: AsyncSession) -> None:
+        claimed = await claim_job(session)
+        # Another worker claimed it again after its lease expired
+        db.exec(update(AgentJob).where(AgentJob.id == claimed.id).values(attempts=2))
+        db.commit()
+        with pytest.raises(LeaseLost):
+            await worker.run_job(claimed)
+        assert stopped.is_set()
+
+    run(claim_and_run)
+
+    delete_runs(db, job)
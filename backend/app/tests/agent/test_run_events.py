@@ -0,0 +1,48 @@
+import asyncio
+import threading
+import uuid
+
+from app.agent.run_events import (
+    RunEvent,
+    Subscription,
+    publish,
+    publish_token,
+    status_event,
+)
+
+
+def test_subscriber_receives_backlog_and_events_from_threads() -> None:
+    agent_run_id = uuid.uuid4()
+    publish_token(agent_run_id, "Sehr ")
+
+    async def run() -> list[RunEvent]:
+        with Subscription(agent_run_id) as subscription:
+            # Sync graph runs publish from worker threads
+            def draft() -> None:
+                publish_token(agent_run_id, "geehrte ")
+                publish(agent_run_id, RunEvent("done", {"draft_body": "Sehr geehrte"}))
+
+            threading.Thread(target=draft).start()
+            events = []
+            while not events or events[-1].type != "done":
+                event = await subscription.get(timeout=5)
+                assert event
+                events.append(event)
+            return events
+
+    assert asyncio.run(run()) == [
+        RunEvent("token", {"text": "Sehr "}),
+        RunEvent("token", {"text": "geehrte "}),
+        RunEvent("done", {"draft_body": "Sehr geehrte"}),
+    ]
+
+
+def test_events_without_subscribers_are_dropped() -> None:
+    agent_run_id = uuid.uuid4()
+    publish(agent_run_id, status_event("running", "Drafting email response"))
+
+    async def run() -> None:
+        with Subscription(agent_run_id) as subscription:
+            assert await subscription.get(timeout=0.01) is None
+
+    asyncio.run(run())
@@ -0,0 +1,73 @@
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from sqlmodel import Session, col, select
+
+from app.agent import run_lease
+from app.agent.run_lease import hold_leases, is_resumable
+from app.core.config import settings
+from app.tables import AgentRun
+
+
+def create_agent_run(db: Session, status: str, lease_age: float | None) -> AgentRun:
+    agent_run = AgentRun(
+        mail_sender="max.mustermann@example.com",
+        mail_subject="Krankengeld",
+        mail_body="Wann wird das Krankengeld überwiesen?",
+        status=status,
+        status_message="Agent processing started",
+        draft_body="",
+        draft_subject="",
+        lease_renewed_at=None
+        if lease_age is None
+        else datetime.now() - timedelta(seconds=lease_age),
+    )
+    db.add(agent_run)
+    db.commit()
+    return agent_run
+
+
+def resumable(db: Session, agent_runs: list[AgentRun]) -> list[uuid.UUID]:
+    statement = select(AgentRun.id).where(
+        col(AgentRun.id).in_([agent_run.id for agent_run in agent_runs]),
+        is_resumable(),
+    )
+    return list(db.exec(statement).all())
+
+
+def test_resumable_runs(db: Session) -> None:
+    expired = settings.AGENT_RUN_LEASE_SECONDS + 1
+    running = create_agent_run(db, "running", 0)
+    abandoned = create_agent_run(db, "running", expired)
+    never_leased = create_agent_run(db, "running", None)
+    failed = create_agent_run(db, "failed", 0)
+    completed = create_agent_run(db, "completed", expired)
+    agent_runs = [running, abandoned, never_leased, failed, completed]
+
+    assert set(resumable(db, agent_runs)) == {
+        abandoned.id,
+        never_leased.id,
+        failed.id,
+    }
+
+    for agent_run in agent_runs:
+        db.delete(agent_run)
+    db.commit()
+
+
+def test_held_leases_are_renewed(db: Session, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "AGENT_RUN_LEASE_SECONDS", 0.3)
+    # A renewer of its own, one started by an earlier test may sleep longer
+    monkeypatch.setattr(run_lease, "_renewer", None)
+    agent_run = create_agent_run(db, "running", 1)
+
+    with hold_leases([agent_run.id]):
+        assert resumable(db, [agent_run]) == [agent_run.id]
+        time.sleep(0.25)
+        assert resumable(db, [agent_run]) == []
+    assert agent_run.id not in run_lease._held
+
+    db.delete(agent_run)
+    db.commit()
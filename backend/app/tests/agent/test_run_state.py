@@ -0,0 +1,24 @@
+import uuid
+
+from app.agent.run_state import get_run_state, track, untrack
+
+
+def test_tracked_run_serves_current_snapshot() -> None:
+    agent_run_id = uuid.uuid4()
+    run_state = track(agent_run_id)
+    master = run_state.add_step("master_agent", "Analyzing request", "running")
+    run_state.add_step("krankengeld_expert", "Analyzing sick pay inquiry", "running")
+    master.status = "completed"
+
+    assert get_run_state(agent_run_id) is run_state
+    assert run_state.latest_steps["master_agent"] is master
+    snapshot = run_state.snapshot()
+    assert snapshot["status"] == "running"
+    assert [(step["type"], step["status"]) for step in snapshot["steps"]] == [
+        ("master_agent", "completed"),
+        ("krankengeld_expert", "running"),
+    ]
+    assert not hasattr(master, "__dict__")
+
+    untrack(agent_run_id)
+    assert get_run_state(agent_run_id) is None
@@ -0,0 +1,25 @@
+from pathlib import Path
+
+import numpy as np
+
+from app.agent.semantic_router import SemanticRouter
+
+EMBEDDINGS = [[1.0, 0.0], [0.9, 0.1], [0.0, 1.0], [0.1, 0.9]]
+LABELS = ["krankengeld", "krankengeld", "terminvermittlung", "terminvermittlung"]
+
+
+def test_route_to_nearest_exemplars(tmp_path: Path) -> None:
+    SemanticRouter.save(str(tmp_path), EMBEDDINGS, LABELS)
+    router = SemanticRouter.load(str(tmp_path), k=2)
+
+    assert isinstance(router.embeddings, np.memmap)
+    assert router.route([2.0, 0.1]) == ("krankengeld", 1.0)
+    assert router.route([0.0, 3.0])[0] == "terminvermittlung"
+
+
+def test_route_confidence_drops_when_neighbours_disagree(tmp_path: Path) -> None:
+    SemanticRouter.save(str(tmp_path), EMBEDDINGS, LABELS)
+    router = SemanticRouter.load(str(tmp_path), k=4)
+
+    _, confidence = router.route([1.0, 1.0])
+    assert 0.4 < confidence < 0.6
@@ -0,0 +1,43 @@
+import asyncio
+
+from app.agent.speculation import (
+    resolve_speculation,
+    speculative_candidates,
+    start_speculation,
+)
+
+
+def test_speculative_candidates_by_keywords() -> None:
+    mail = (
+        "Mein Krankengeld ist nicht angekommen, ich bin seit 8 Wochen krankgeschrieben."
+    )
+    assert speculative_candidates(mail, 2) == ["krankengeld"]
+    assert speculative_candidates("Hallo", 2) == []
+
+
+def test_resolve_speculation_cancels_other_experts() -> None:
+    async def analyze(expert_agent: str) -> str:
+        if expert_agent == "krankengeld":
+            return "analysis"
+        await asyncio.sleep(10)
+        return "too slow"
+
+    async def run() -> None:
+        tasks = start_speculation("Krankengeld und Termin beim Facharzt", 2, analyze)
+        others = [task for name, task in tasks.items() if name != "krankengeld"]
+        assert await resolve_speculation(tasks, "krankengeld") == "analysis"
+        await asyncio.sleep(0)
+        assert all(task.cancelled() for task in others)
+
+    asyncio.run(run())
+
+
+def test_resolve_speculation_miss() -> None:
+    async def analyze(_: str) -> str:
+        return "analysis"
+
+    async def run() -> None:
+        tasks = start_speculation("Termin beim Facharzt", 1, analyze)
+        assert await resolve_speculation(tasks, "widerspruch") is None
+
+    asyncio.run(run())
@@ -0,0 +1,51 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from app.agent.token_budget import (
+    ContextWindowExceeded,
+    completion_budget,
+    count_prompt_tokens,
+    count_tokens,
+    truncate_tokens,
+    usage,
+)
+from app.core.config import settings
+
+
+def test_truncate_keeps_start_and_end_of_mail() -> None:
+    mail = (
+        "Subject: Krankengeld\nBody: " + "Zitat " * 1000 + "\nSender: max@example.com"
+    )
+    truncated = truncate_tokens(mail, 100)
+    assert count_tokens(truncated) <= 100
+    assert truncated.startswith("Subject: Krankengeld")
+    assert truncated.endswith("Sender: max@example.com")
+    assert truncate_tokens("Kurze Mail", 100) == "Kurze Mail"
+
+
+def test_completion_budget_clamps_to_context_window() -> None:
+    messages = [HumanMessage(content="x" * (settings.AGENT_CONTEXT_WINDOW * 3 - 3000))]
+    prompt_tokens, max_tokens = completion_budget(messages, 2000)
+    assert max_tokens == settings.AGENT_CONTEXT_WINDOW - prompt_tokens < 2000
+
+    with pytest.raises(ContextWindowExceeded):
+        completion_budget(messages * 2, 2000)
+
+
+def test_usage_prefers_reported_tokens() -> None:
+    reported = AIMessage(
+        content="Antwort",
+        usage_metadata={"input_tokens": 120, "output_tokens": 7, "total_tokens": 127},
+    )
+    assert usage(reported, 100) == (120, 7)
+    assert usage(AIMessage(content="Antwort"), 100) == (100, count_tokens("Antwort"))
+
+
+def test_list_content_is_counted_by_its_text() -> None:
+    parts = HumanMessage(content=["Guten Tag, ", {"type": "text", "text": "Frage"}])
+    text = HumanMessage(content="Guten Tag, Frage")
+    assert count_prompt_tokens([parts]) == count_prompt_tokens([text])
+    assert usage(AIMessage(content=[{"type": "text", "text": "Antwort"}]), 100) == (
+        100,
+        count_tokens("Antwort"),
+    )
@@ -0,0 +1,126 @@
+import uuid
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from app.agent.run_state import RunState
+from app.agent.write_behind import RunBuffer
+from app.tables import AgentRun, Step
+
+
+def create_agent_run(db: Session, **fields: object) -> AgentRun:
+    agent_run = AgentRun(
+        mail_sender="max.mustermann@example.com",
+        mail_subject="Krankengeld",
+        mail_body="Wann wird das Krankengeld überwiesen?",
+        status="running",
+        status_message="Agent processing started",
+        draft_body="",
+        draft_subject="",
+        **fields,
+    )
+    db.add(agent_run)
+    db.commit()
+    return agent_run
+
+
+def test_flush_coalesces_node_updates(db: Session) -> None:
+    agent_run = create_agent_run(db)
+    buffer = RunBuffer(RunState(agent_run.id))
+    buffer.create_step("master_agent", "Analyzing request", "running")
+    buffer.update_run_status("running", "Master agent analyzing request")
+    buffer.complete_step("master_agent", "Routed request to krankengeld expert agent")
+    buffer.create_step("krankengeld_expert", "Analyzing sick pay inquiry", "running")
+    buffer.flush(db)
+
+    steps = db.exec(
+        select(Step).where(Step.agent_run_id == agent_run.id).order_by(Step.created_at)
+    ).all()
+    assert [(step.type, step.status) for step in steps] == [
+        ("master_agent", "completed"),
+        ("krankengeld_expert", "running"),
+    ]
+
+    # Completing a step inserted by an earlier flush updates it
+    buffer.complete_step("krankengeld_expert", "Completed analysis")
+    buffer.complete_run("Re: Krankengeld", "Sehr geehrter Herr Mustermann")
+    buffer.flush(db)
+
+    db.refresh(agent_run)
+    db.refresh(steps[1])
+    assert steps[1].status == "completed"
+    assert agent_run.status == "completed"
+    assert agent_run.draft_body == "Sehr geehrter Herr Mustermann"
+
+    db.delete(agent_run)
+    db.commit()
+
+
+def test_record_usage_sums_calls(db: Session) -> None:
+    agent_run = create_agent_run(db)
+    buffer = RunBuffer(RunState(agent_run.id))
+    buffer.record_usage(300, 10)
+    buffer.record_usage(500, 200)
+    buffer.flush(db)
+
+    db.refresh(agent_run)
+    assert (agent_run.prompt_tokens, agent_run.completion_tokens) == (800, 210)
+
+    db.delete(agent_run)
+    db.commit()
+
+
+def test_llm_calls_and_writes_are_timed_on_the_current_step(db: Session) -> None:
+    agent_run = create_agent_run(db)
+    buffer = RunBuffer(RunState(agent_run.id))
+    step = buffer.create_step("master_agent", "Analyzing request", "running")
+    buffer.record_llm_call("small", 0.5, 300, 2)
+    buffer.record_llm_call("large", 1.5, 300, 3)
+    buffer.complete_step("master_agent", "Routed request to krankengeld expert agent")
+    buffer.flush(db)
+
+    row = db.get(Step, step.id)
+    assert (row.llm_seconds, row.prompt_tokens, row.completion_tokens) == (
+        2.0,
+        600,
+        5,
+    )
+    assert row.model == "small, large"
+    assert row.finished_at is not None
+    assert row.db_seconds == 0
+
+    # The write is timed once committed and written with the next flush
+    db_seconds = step.db_seconds
+    assert db_seconds > 0
+    buffer.flush(db)
+    db.refresh(row)
+    assert row.db_seconds == db_seconds
+
+    db.delete(agent_run)
+    db.commit()
+
+
+def test_failed_flush_keeps_updates(db: Session) -> None:
+    # The run is not inserted yet, so inserting its steps fails
+    agent_run_id = uuid.uuid4()
+    buffer = RunBuffer(RunState(agent_run_id))
+    buffer.create_step("master_agent", "Analyzing request", "running")
+    with pytest.raises(IntegrityError):
+        buffer.flush(db)
+    db.rollback()
+
+    buffer.complete_step("master_agent", "Routed request to krankengeld expert agent")
+    buffer.update_run_status("running", "Drafting email response")
+    agent_run = create_agent_run(db, id=agent_run_id)
+    buffer.flush(db)
+
+    steps = db.exec(select(Step).where(Step.agent_run_id == agent_run_id)).all()
+    assert [(step.type, step.status) for step in steps] == [
+        ("master_agent", "completed")
+    ]
+    db.refresh(agent_run)
+    assert agent_run.status_message == "Drafting email response"
+
+    db.delete(agent_run)
+    db.commit()
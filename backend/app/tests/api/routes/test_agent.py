@@ -0,0 +1,403 @@
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select
+
+from app.agent import langgraph, run_events
+from app.agent.fake_llm import DRAFT, FakeChatModel
+from app.agent.run_events import RunEvent, publish, publish_token, status_event
+from app.core.config import settings
+from app.tables import AgentJob, AgentRun, Step
+
+MAILS = [
+    {
+        "subject": "Krankengeld",
+        "body": "Wann wird das Krankengeld überwiesen?",
+        "sender": "max.mustermann@example.com",
+    },
+    {
+        "subject": "Zahnersatz",
+        "body": "Übernehmen Sie die Kosten für eine Krone?",
+        "sender": "erika.musterfrau@example.com",
+    },
+]
+
+
+class FailingSenderDrafter(FakeChatModel):
+    """Fails the draft of the mails from `sender`."""
+
+    def __init__(self, sender: str) -> None:
+        super().__init__(latency=0)
+        self.sender = sender
+
+    def stream(self, messages: list, **kwargs):
+        if self.sender in messages[0].content:
+            raise RuntimeError("Drafter crashed")
+        yield from super().stream(messages, **kwargs)
+
+
+def batch_runs(db: Session, batch_id: str) -> list[AgentRun]:
+    statement = (
+        select(AgentRun)
+        .where(AgentRun.batch_id == uuid.UUID(batch_id))
+        .order_by(AgentRun.mail_sender)
+    )
+    return list(db.exec(statement).all())
+
+
+def delete_runs(db: Session, agent_runs: list[AgentRun]) -> None:
+    for agent_run in agent_runs:
+        db.delete(agent_run)
+    db.commit()
+
+
+def test_read_agent_timeline(client: TestClient, db: Session) -> None:
+    started_at = datetime(2025, 1, 1, 12)
+    agent_run = AgentRun(
+        mail_sender="max.mustermann@example.com",
+        mail_subject="Krankengeld",
+        mail_body="Wann wird das Krankengeld überwiesen?",
+        status="completed",
+        status_message="Email response generated successfully",
+        draft_body="",
+        draft_subject="",
+        prompt_tokens=900,
+        completion_tokens=400,
+        steps=[
+            Step(
+                type="master_agent",
+                text="Routed request to krankengeld expert agent",
+                status="completed",
+                created_at=started_at,
+                started_at=started_at,
+                finished_at=started_at + timedelta(seconds=1),
+                llm_seconds=0.8,
+                db_seconds=0.01,
+                prompt_tokens=300,
+                completion_tokens=2,
+                model="small",
+            ),
+            Step(
+                type="email_drafter",
+                text="Completed email draft",
+                status="completed",
+                created_at=started_at + timedelta(seconds=3),
+                started_at=started_at + timedelta(seconds=3),
+                finished_at=started_at + timedelta(seconds=7),
+                llm_seconds=3.9,
+                model="large",
+            ),
+        ],
+    )
+    db.add(agent_run)
+    db.commit()
+
+    response = client.get(f"{settings.API_V1_STR}/agent/{agent_run.id}/timeline")
+    assert response.status_code == 200
+    content = response.json()
+    assert content["duration_seconds"] == 7
+    assert content["prompt_tokens"] == 900
+    assert [
+        (step["type"], step["offset_seconds"], step["duration_seconds"])
+        for step in content["steps"]
+    ] == [("master_agent", 0, 1), ("email_drafter", 3, 4)]
+    assert content["steps"][0]["llm_seconds"] == 0.8
+
+    db.delete(agent_run)
+    db.commit()
+
+
+def test_read_agent_timeline_not_found(client: TestClient) -> None:
+    response = client.get(
+        f"{settings.API_V1_STR}/agent/00000000-0000-0000-0000-000000000000/timeline"
+    )
+    assert response.status_code == 404
+
+
+def test_resume_completed_agent_run(client: TestClient, db: Session) -> None:
+    agent_run = AgentRun(
+        mail_sender="max.mustermann@example.com",
+        mail_subject="Krankengeld",
+        mail_body="Wann wird das Krankengeld überwiesen?",
+        status="completed",
+        status_message="Email response generated successfully",
+        draft_body="",
+        draft_subject="",
+    )
+    db.add(agent_run)
+    db.commit()
+
+    response = client.post(f"{settings.API_V1_STR}/agent/{agent_run.id}/resume")
+    assert response.status_code == 409
+
+    db.delete(agent_run)
+    db.commit()
+
+
+def test_resume_agent_run_of_another_process(
+    client: TestClient, db: Session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "AGENT_RUN_BACKEND", "queue")
+    agent_run = create_agent_run(db, "running")
+    agent_run.lease_renewed_at = datetime.now()
+    db.commit()
+
+    # Still executed by another API worker, which renews its lease
+    response = client.post(f"{settings.API_V1_STR}/agent/{agent_run.id}/resume")
+    assert response.status_code == 409
+
+    # The worker died
+    agent_run.lease_renewed_at = datetime.now() - timedelta(
+        seconds=settings.AGENT_RUN_LEASE_SECONDS + 1
+    )
+    db.commit()
+    response = client.post(f"{settings.API_V1_STR}/agent/{agent_run.id}/resume")
+    assert response.status_code == 200
+    # Queued once
+    response = client.post(f"{settings.API_V1_STR}/agent/{agent_run.id}/resume")
+    assert response.status_code == 409
+
+    db.delete(agent_run)
+    db.commit()
+
+
+def test_resume_agent_run_not_found(client: TestClient) -> None:
+    response = client.post(
+        f"{settings.API_V1_STR}/agent/00000000-0000-0000-0000-000000000000/resume"
+    )
+    assert response.status_code == 404
+
+
+def test_start_agent_batch(
+    client: TestClient, db: Session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    # Queued for `app.worker`, so the runs stay running
+    monkeypatch.setattr(settings, "AGENT_RUN_BACKEND", "queue")
+
+    response = client.post(f"{settings.API_V1_STR}/agent/langgraph/batch", json=MAILS)
+    assert response.status_code == 200
+    content = response.json()
+    assert len(content["run_ids"]) == 2
+    agent_runs = batch_runs(db, content["batch_id"])
+    assert {str(agent_run.id) for agent_run in agent_runs} == set(content["run_ids"])
+    assert [
+        (agent_run.mail_sender, agent_run.mail_subject, agent_run.status)
+        for agent_run in agent_runs
+    ] == [
+        ("erika.musterfrau@example.com", "Zahnersatz", "running"),
+        ("max.mustermann@example.com", "Krankengeld", "running"),
+    ]
+    jobs = db.exec(
+        select(AgentJob).where(
+            AgentJob.agent_run_id.in_([agent_run.id for agent_run in agent_runs])
+        )
+    ).all()
+    assert [job.status for job in jobs] == ["queued", "queued"]
+
+    response = client.get(f"{settings.API_V1_STR}/agent/batch/{content['batch_id']}")
+    assert response.status_code == 200
+    assert response.json() == {
+        "batch_id": content["batch_id"],
+        "total": 2,
+        "statuses": {"running": 2},
+    }
+
+    delete_runs(db, agent_runs)
+
+
+def test_start_agent_batch_ndjson(
+    client: TestClient, db: Session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "AGENT_RUN_BACKEND", "queue")
+
+    # Blank lines are skipped, the last mail needs no line break
+    body = "\n".join(json.dumps(mail) for mail in MAILS).replace("\n", "\n\n", 1)
+    response = client.post(
+        f"{settings.API_V1_STR}/agent/langgraph/batch",
+        content=body.encode(),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    agent_runs = batch_runs(db, response.json()["batch_id"])
+    assert [agent_run.mail_subject for agent_run in agent_runs] == [
+        "Zahnersatz",
+        "Krankengeld",
+    ]
+
+    delete_runs(db, agent_runs)
+
+
+@pytest.mark.parametrize(
+    ("content", "content_type"),
+    [
+        (json.dumps([{"subject": "Krankengeld"}]), "application/json"),
+        ("{}\n", "application/x-ndjson"),
+        ("[]", "application/json"),
+        ("", "application/x-ndjson"),
+        ("\n", "application/x-ndjson"),
+    ],
+)
+def test_start_agent_batch_invalid_mails(
+    client: TestClient, content: str, content_type: str
+) -> None:
+    response = client.post(
+        f"{settings.API_V1_STR}/agent/langgraph/batch",
+        content=content.encode(),
+        headers={"Content-Type": content_type},
+    )
+    assert response.status_code == 422
+
+
+def test_agent_batch_with_failed_run(
+    client: TestClient, db: Session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "AGENT_RUN_BACKEND", "background")
+    monkeypatch.setattr(settings, "AGENT_EXECUTION_MODE", "sync")
+    monkeypatch.setattr(settings, "AGENT_CHECKPOINTING", False)
+    fake = FailingSenderDrafter("erika.musterfrau@example.com")
+    monkeypatch.setattr(langgraph, "small_llm", fake)
+    monkeypatch.setattr(langgraph, "llm", fake)
+
+    # The test client returns once the background tasks are done
+    response = client.post(f"{settings.API_V1_STR}/agent/langgraph/batch", json=MAILS)
+    assert response.status_code == 200
+    batch_id = response.json()["batch_id"]
+
+    response = client.get(f"{settings.API_V1_STR}/agent/batch/{batch_id}")
+    assert response.status_code == 200
+    assert response.json()["total"] == 2
+    assert response.json()["statuses"] == {"completed": 1, "failed": 1}
+    failed, completed = batch_runs(db, batch_id)
+    assert (failed.status, completed.status) == ("failed", "completed")
+    assert completed.draft_body == DRAFT
+
+    delete_runs(db, [failed, completed])
+
+
+def test_read_agent_batch_not_found(client: TestClient) -> None:
+    response = client.get(
+        f"{settings.API_V1_STR}/agent/batch/00000000-0000-0000-0000-000000000000"
+    )
+    assert response.status_code == 404
+
+
+def create_agent_run(db: Session, status: str, draft_body: str = "") -> AgentRun:
+    agent_run = AgentRun(
+        mail_sender="max.mustermann@example.com",
+        mail_subject="Krankengeld",
+        mail_body="Wann wird das Krankengeld überwiesen?",
+        status=status,
+        status_message="Agent processing started",
+        draft_body=draft_body,
+        draft_subject="Re: Krankengeld" if draft_body else "",
+    )
+    db.add(agent_run)
+    db.commit()
+    return agent_run
+
+
+def parse_server_sent_events(text: str) -> list[tuple[str, dict]]:
+    events = []
+    for block in text.split("\n\n"):
+        if block.startswith("event: "):
+            event, data = block.split("\n")
+            events.append(
+                (event.removeprefix("event: "), json.loads(data.removeprefix("data: ")))
+            )
+    return events
+
+
+def publish_once_subscribed(
+    agent_run_id: uuid.UUID, events: list[RunEvent]
+) -> threading.Thread:
+    """Publish from a thread like a sync run, once a client subscribed."""
+
+    def publish_events() -> None:
+        end = time.monotonic() + 5
+        while time.monotonic() < end:
+            run = run_events._runs.get(agent_run_id)
+            if run and run.subscribers:
+                break
+            time.sleep(0.01)
+        for event in events:
+            publish(agent_run_id, event)
+
+    publisher = threading.Thread(target=publish_events)
+    publisher.start()
+    return publisher
+
+
+def test_stream_events_of_finished_run(client: TestClient, db: Session) -> None:
+    agent_run = create_agent_run(db, "completed", DRAFT)
+
+    response = client.get(f"{settings.API_V1_STR}/agent/{agent_run.id}/events")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    [(event, data)] = parse_server_sent_events(response.text)
+    assert event == "run"
+    assert (data["status"], data["draft_body"]) == ("completed", DRAFT)
+
+    response = client.get(f"{settings.API_V1_STR}/agent/{agent_run.id}/stream")
+    assert response.status_code == 200
+    assert parse_server_sent_events(response.text) == [
+        (
+            "done",
+            {
+                "status": "completed",
+                "status_message": "Agent processing started",
+                "draft_subject": "Re: Krankengeld",
+                "draft_body": DRAFT,
+            },
+        )
+    ]
+
+    db.delete(agent_run)
+    db.commit()
+
+
+def test_stream_events_of_live_run(client: TestClient, db: Session) -> None:
+    agent_run = create_agent_run(db, "running")
+    done = RunEvent("done", {"status": "completed", "draft_body": "Sehr geehrte"})
+
+    publisher = publish_once_subscribed(
+        agent_run.id,
+        [status_event("running", "Drafting email response"), done],
+    )
+    response = client.get(f"{settings.API_V1_STR}/agent/{agent_run.id}/events")
+    publisher.join()
+    assert response.status_code == 200
+    assert [event for event, _ in parse_server_sent_events(response.text)] == [
+        "run",
+        "status",
+        "done",
+    ]
+
+    # Clients of the draft connecting late get the text generated so far
+    publish_token(agent_run.id, "Sehr ")
+    publisher = publish_once_subscribed(
+        agent_run.id, [RunEvent("token", {"text": "geehrte"}), done]
+    )
+    response = client.get(f"{settings.API_V1_STR}/agent/{agent_run.id}/stream")
+    publisher.join()
+    assert response.status_code == 200
+    assert parse_server_sent_events(response.text) == [
+        ("token", {"text": "Sehr "}),
+        ("token", {"text": "geehrte"}),
+        ("done", done.data),
+    ]
+    assert agent_run.id not in run_events._runs
+
+    db.delete(agent_run)
+    db.commit()
+
+
+def test_stream_events_not_found(client: TestClient) -> None:
+    run_id = "00000000-0000-0000-0000-000000000000"
+    for path in ("events", "stream"):
+        response = client.get(f"{settings.API_V1_STR}/agent/{run_id}/{path}")
+        assert response.status_code == 404
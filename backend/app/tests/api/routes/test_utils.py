@@ -0,0 +1,19 @@
+from concurrent.futures import Future
+
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+
+
+def test_ready_once_warmed_up(client: TestClient) -> None:
+    warm_up = client.app.state.warm_up
+    client.app.state.warm_up = Future()
+    try:
+        response = client.get(f"{settings.API_V1_STR}/utils/ready/")
+        assert response.status_code == 503
+
+        client.app.state.warm_up.set_result(None)
+        response = client.get(f"{settings.API_V1_STR}/utils/ready/")
+        assert response.status_code == 200
+    finally:
+        client.app.state.warm_up = warm_up
@@ -0,0 +1,22 @@
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+
+
+def test_metrics(client: TestClient) -> None:
+    client.get(f"{settings.API_V1_STR}/utils/health-check/")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert (
+        'http_request_seconds_count{method="GET",route="/api/v1/utils/health-check/",status="200"}'
+        in response.text
+    )
+    assert 'agent_jobs{status="queued"}' in response.text
+    assert 'db_pool_checked_out{engine="sync"}' in response.text
+
+
+def test_metrics_label_unmatched_paths(client: TestClient) -> None:
+    client.get("/wp-login.php")
+    response = client.get("/metrics")
+    assert 'route="unmatched",status="404"' in response.text
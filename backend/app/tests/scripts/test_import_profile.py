@@ -0,0 +1,31 @@
+import subprocess
+import sys
+
+from app.import_profile import ImportTime, parse_importtime
+
+OUTPUT = """\
+import time: self [us] | cumulative | imported package
+import time:       120 |        120 |     _json
+import time:       950 |       1070 |   json.decoder
+import time:       410 |       1480 | json
+"""
+
+
+def test_parses_importtime_output() -> None:
+    assert parse_importtime(OUTPUT) == [
+        ImportTime("_json", 2, 120, 120),
+        ImportTime("json.decoder", 1, 950, 1070),
+        ImportTime("json", 0, 410, 1480),
+    ]
+
+
+def test_app_starts_without_the_agent_stack() -> None:
+    # A fresh interpreter, the tests imported the agents already
+    code = (
+        "import sys, app.main; "
+        "print([m for m in ('langgraph', 'langchain_ibm') if m in sys.modules])"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "[]"
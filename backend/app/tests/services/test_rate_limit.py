@@ -0,0 +1,44 @@
+import uuid
+
+from sqlmodel import Session, delete
+
+from app.services.rate_limit import Quota, TokenBucket
+from app.tables import RateLimitBucket
+
+
+def bucket_name() -> str:
+    return f"test:{uuid.uuid4()}"
+
+
+def test_processes_share_bucket(db: Session) -> None:
+    name = bucket_name()
+    # Separate instances, as in separate worker processes
+    first = TokenBucket(name, rate=1, capacity=10)
+    second = TokenBucket(name, rate=1, capacity=10)
+    assert first.take(6) == 0
+    wait = second.take(6)
+    assert 1.5 < wait <= 2
+
+    second.refund(3)
+    assert first.take(6) == 0
+
+    db.exec(delete(RateLimitBucket).where(RateLimitBucket.name == name))
+    db.commit()
+
+
+def test_quota_takes_nothing_when_not_admitted(db: Session) -> None:
+    requests_name, tokens_name = bucket_name(), bucket_name()
+    requests = TokenBucket(requests_name, rate=1, capacity=1)
+    tokens = TokenBucket(tokens_name, rate=1, capacity=1000)
+    quota = Quota(requests=requests, tokens=tokens)
+    assert quota.acquire(400, timeout=0)
+    assert not quota.acquire(400, timeout=0)
+    # The tokens of the rejected request were put back
+    assert tokens.take(600) == 0
+
+    db.exec(
+        delete(RateLimitBucket).where(
+            RateLimitBucket.name.in_([requests_name, tokens_name])
+        )
+    )
+    db.commit()
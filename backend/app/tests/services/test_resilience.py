@@ -0,0 +1,220 @@
+import asyncio
+import threading
+import time
+import uuid
+from collections.abc import Iterator
+
+import pytest
+from sqlmodel import Session, delete
+
+from app.services import resilience
+from app.services.rate_limit import Quota, TokenBucket
+from app.services.resilience import (
+    AdaptiveLimiter,
+    CallPolicy,
+    CircuitBreaker,
+    DeadlineExceeded,
+    acall_with_policy,
+    call_with_policy,
+    stream_with_policy,
+)
+from app.tables import RateLimitBucket
+
+POLICY = CallPolicy(deadline=2.0, retries=2, backoff=0.01, hedge=True)
+
+
+def warm_up(key: str, latency: float) -> None:
+    for _ in range(resilience.MIN_HEDGE_SAMPLES):
+        resilience.latencies.record(key, latency)
+
+
+@pytest.fixture
+def tokens(db: Session, monkeypatch: pytest.MonkeyPatch) -> Iterator[TokenBucket]:
+    """A token quota of 1000 that barely refills during a test."""
+    bucket = TokenBucket(f"test:{uuid.uuid4()}", rate=0.001, capacity=1000)
+    monkeypatch.setattr(resilience, "quota", Quota(requests=None, tokens=bucket))
+    yield bucket
+    db.exec(delete(RateLimitBucket).where(RateLimitBucket.name == bucket.name))
+    db.commit()
+
+
+def test_quota_of_unused_requests_is_refunded(tokens: TokenBucket) -> None:
+    warm_up("refunded", 0.05)
+    attempts = iter([ConnectionError(), 0.5, 0.01])
+
+    def call() -> str:
+        attempt = next(attempts)
+        if isinstance(attempt, Exception):
+            raise attempt
+        time.sleep(attempt)
+        return "Antwort"
+
+    policy = CallPolicy(deadline=2.0, retries=2, backoff=0.01, hedge=True, tokens=100)
+    assert call_with_policy("refunded", call, policy) == "Antwort"
+    # The failed attempt and the losing one were refunded, the answer is
+    # settled by the caller
+    assert tokens.take(900) == 0
+    assert tokens.take(1) > 0
+
+
+def test_quota_is_refunded_without_a_slot(
+    tokens: TokenBucket, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    limiter = AdaptiveLimiter(1, 1, 1, CircuitBreaker(100, 30))
+    assert limiter.try_acquire()
+    monkeypatch.setattr(resilience, "limiter", limiter)
+
+    async def call() -> str:
+        return "Antwort"
+
+    policy = CallPolicy(deadline=0.1, retries=0, backoff=0.01, hedge=False, tokens=100)
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(acall_with_policy("no slot", call, policy))
+    assert tokens.take(1000) == 0
+
+
+def test_slow_call_is_hedged() -> None:
+    warm_up("hedged", 0.05)
+    latencies = iter([1.5, 0.01])
+
+    def call() -> str:
+        time.sleep(next(latencies))
+        return "Antwort"
+
+    start = time.monotonic()
+    assert call_with_policy("hedged", call, POLICY) == "Antwort"
+    assert time.monotonic() - start < 1
+
+
+def test_transient_failures_are_retried() -> None:
+    attempts = []
+
+    async def call() -> str:
+        attempts.append(None)
+        if len(attempts) < 3:
+            raise ConnectionError
+        return "Antwort"
+
+    assert asyncio.run(acall_with_policy("retried", call, POLICY)) == "Antwort"
+    assert len(attempts) == 3
+
+
+def test_other_failures_are_raised() -> None:
+    attempts = []
+
+    def call() -> str:
+        attempts.append(None)
+        raise ValueError
+
+    with pytest.raises(ValueError):
+        call_with_policy("failing", call, POLICY)
+    assert len(attempts) == 1
+
+
+def test_deadline_bounds_all_attempts() -> None:
+    async def call() -> str:
+        await asyncio.sleep(10)
+        return "Antwort"
+
+    policy = CallPolicy(deadline=0.1, retries=2, backoff=0.01, hedge=False)
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(acall_with_policy("stalled", call, policy))
+    assert time.monotonic() - start < 1
+
+
+def test_deadline_is_an_overload_signal(monkeypatch: pytest.MonkeyPatch) -> None:
+    limiter = AdaptiveLimiter(8, 1, 16, CircuitBreaker(100, 30))
+    monkeypatch.setattr(resilience, "limiter", limiter)
+
+    def call() -> str:
+        time.sleep(0.3)
+        return "Antwort"
+
+    policy = CallPolicy(deadline=0.1, retries=0, backoff=0.01, hedge=False)
+    with pytest.raises(DeadlineExceeded):
+        call_with_policy("stalled sync", call, policy)
+    assert limiter.limit == 4
+
+
+def test_stream_is_retried_until_first_chunk() -> None:
+    streams = []
+
+    def stream():
+        streams.append(None)
+        if len(streams) == 1:
+            raise ConnectionError
+        yield "Sehr "
+        yield "geehrte"
+
+    assert list(stream_with_policy("stream", stream, POLICY)) == ["Sehr ", "geehrte"]
+    assert len(streams) == 2
+
+
+def test_stalled_stream_keeps_its_quota_until_closed(tokens: TokenBucket) -> None:
+    answered = threading.Event()
+    closed = threading.Event()
+
+    def stream() -> Iterator[str]:
+        try:
+            answered.wait()
+            yield "Sehr "
+        finally:
+            closed.set()
+
+    policy = CallPolicy(deadline=0.1, retries=0, backoff=0.01, hedge=False, tokens=100)
+    try:
+        with pytest.raises(DeadlineExceeded):
+            list(stream_with_policy("stalled stream", stream, policy))
+        # The read of the first chunk still runs in its thread
+        assert tokens.take(901) > 0
+    finally:
+        answered.set()
+    # Its slot and quota are freed before the stream is closed
+    assert closed.wait(1)
+    assert tokens.take(1000) == 0
+
+
+def test_stream_deadline_bounds_every_chunk() -> None:
+    def stream() -> Iterator[str]:
+        yield "Sehr "
+        time.sleep(0.3)
+        yield "geehrte"
+
+    policy = CallPolicy(deadline=0.1, retries=2, backoff=0.01, hedge=False)
+    chunks = stream_with_policy("slow stream", stream, policy)
+    assert next(chunks) == "Sehr "
+    with pytest.raises(DeadlineExceeded):
+        next(chunks)
+
+
+def test_limiter_halves_on_overload_and_grows_additively() -> None:
+    limiter = AdaptiveLimiter(8, 1, 16, CircuitBreaker(100, 30))
+    for _ in range(8):
+        assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+
+    limiter.release("limited", 0.1, ConnectionError())
+    assert limiter.limit == 4
+    # About one more slot per round of `limit` successful requests
+    for _ in range(4):
+        limiter.release("limited", 0.1, None)
+    assert 4.9 < limiter.limit < 5
+
+
+def test_breaker_holds_requests_until_cooldown() -> None:
+    breaker = CircuitBreaker(failures=2, cooldown=0.2)
+    limiter = AdaptiveLimiter(8, 1, 16, breaker)
+    for _ in range(2):
+        assert limiter.try_acquire()
+        limiter.release(None, 0.1, ConnectionError())
+    assert breaker.state == "open"
+    assert not limiter.try_acquire()
+
+    # After the cooldown a single trial request is let through
+    start = time.monotonic()
+    limiter.acquire(timeout=1)
+    assert 0.1 < time.monotonic() - start < 1
+    assert not limiter.try_acquire()
+    limiter.release(None, 0.1, None)
+    assert breaker.state == "closed"
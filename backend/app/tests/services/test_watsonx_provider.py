@@ -0,0 +1,109 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+from sqlmodel import Session, delete
+
+from app.core.singleton import Singleton
+from app.services import resilience, watsonx_provider
+from app.services.rate_limit import Quota, TokenBucket
+from app.services.watsonx_provider import (
+    PoolCollector,
+    PoolStats,
+    WatsonxProvider,
+    pool_stats,
+)
+from app.tables import RateLimitBucket
+
+
+def test_singleton_is_created_once_by_concurrent_threads() -> None:
+    created = []
+
+    @Singleton
+    class Client:
+        def __init__(self) -> None:
+            # Slow like connecting to watsonx, so the threads overlap
+            time.sleep(0.05)
+            created.append(self)
+
+    assert not Client.created()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        instances = list(executor.map(lambda _: Client.instance(), range(8)))
+    assert len(created) == 1
+    assert all(instance is created[0] for instance in instances)
+    assert Client.created()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def test_pool_stats_count_kept_alive_connections() -> None:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/"
+    limits = httpx.Limits(max_connections=4, max_keepalive_connections=4)
+    try:
+        with httpx.Client(limits=limits) as client:
+            assert pool_stats(client) == PoolStats(4, 0, 0, 0)
+            for _ in range(3):
+                client.get(url)
+            # The requests reused one connection, idle until the next
+            assert pool_stats(client) == PoolStats(4, 0, 1, 0)
+            with client.stream("GET", url):
+                assert pool_stats(client) == PoolStats(4, 1, 0, 0)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_scrape_without_readable_pools(monkeypatch: pytest.MonkeyPatch) -> None:
+    class Provider:
+        def pool_stats(self) -> dict[str, PoolStats]:
+            # Like an httpcore version without the attributes read
+            raise AttributeError("'ConnectionPool' object has no attribute '_requests'")
+
+    monkeypatch.setattr(WatsonxProvider, "_instance", Provider())
+    metrics = list(PoolCollector().collect())
+    assert [metric.name for metric in metrics] == [
+        "watsonx_http_connections",
+        "watsonx_http_queued_requests",
+        "watsonx_http_max_connections",
+    ]
+    assert all(not metric.samples for metric in metrics)
+
+
+def test_chat_refunds_reservation_without_usage(
+    db: Session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    bucket = TokenBucket(f"test:{uuid.uuid4()}", rate=0.001, capacity=1000)
+    for module in (resilience, watsonx_provider):
+        monkeypatch.setattr(module, "quota", Quota(requests=None, tokens=bucket))
+
+    class Inference:
+        def chat(self, messages: list[dict[str, str]], params: object) -> dict:
+            # An answer without the `usage` watsonx normally reports
+            return {"choices": [{"message": {"content": "Guten Tag"}}]}
+
+    # A provider without a watsonx client
+    provider = object.__new__(WatsonxProvider._decorated)
+    monkeypatch.setattr(provider, "get_model_inference", lambda _: Inference())
+    messages = [{"role": "user", "content": "Hallo"}]
+    assert provider.chat("model", messages, {"max_tokens": 100}) == "Guten Tag"
+    assert bucket.take(1000) == 0
+
+    db.exec(delete(RateLimitBucket).where(RateLimitBucket.name == bucket.name))
+    db.commit()
@@ -0,0 +1,129 @@
+"""Worker process that executes agent runs from the `agentjob` queue.
+
+Runs next to the API (`AGENT_RUN_BACKEND=queue`) so agent throughput scales
+independently of HTTP capacity, and queued runs survive restarts and deploys.
+
+    python -m app.worker --concurrency 8
+"""
+
+import argparse
+import asyncio
+import logging
+import signal
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.agent.checkpoint import aclose_checkpointer
+from app.agent.langgraph import execute_run, format_mail, warm_up
+from app.agent.queue import (
+    LeaseLost,
+    claim_job,
+    complete_job,
+    fail_job,
+    renew_lease,
+)
+from app.core.config import settings
+from app.core.db import async_engine
+from app.tables import AgentJob, AgentRun
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def heartbeat(job: AgentJob) -> None:
+    """Renew the lease of `job` while it runs, three times per lease.
+
+    Returns once another worker claimed the job.
+    """
+    while True:
+        await asyncio.sleep(settings.AGENT_JOB_LEASE_SECONDS / 3)
+        try:
+            # Its own session, the worker loop's is not safe to share
+            async with AsyncSession(async_engine) as session:
+                if not await renew_lease(session, job):
+                    return
+        except Exception:
+            logger.exception(f"Renewing the lease of job {job.id} failed")
+
+
+async def run_job(job: AgentJob) -> None:
+    async with AsyncSession(async_engine) as session:
+        agent_run = await session.get(AgentRun, job.agent_run_id)
+        if not agent_run:
+            raise ValueError(f"Agent run {job.agent_run_id} not found")
+        mail = format_mail(
+            agent_run.mail_subject, agent_run.mail_body, agent_run.mail_sender
+        )
+        pipeline = agent_run.pipeline
+
+    renewing = asyncio.create_task(heartbeat(job))
+    running = asyncio.create_task(execute_run(mail, job.agent_run_id, pipeline))
+    try:
+        await asyncio.wait({renewing, running}, return_when=asyncio.FIRST_COMPLETED)
+        if not running.done():
+            raise LeaseLost(f"Job {job.id} was claimed by another worker")
+        await running
+    finally:
+        renewing.cancel()
+        running.cancel()
+        # An async run stops at its next await, the thread of a sync run
+        # cannot be stopped and finishes on its own
+        await asyncio.wait({running})
+
+
+async def worker_loop(stop: asyncio.Event) -> None:
+    """Claim and execute jobs one at a time until `stop` is set."""
+    while not stop.is_set():
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+            job = await claim_job(session)
+            if not job:
+                try:
+                    await asyncio.wait_for(
+                        stop.wait(), settings.AGENT_WORKER_POLL_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            logger.info(f"Running job {job.id} (attempt {job.attempts})")
+            try:
+                await run_job(job)
+            except LeaseLost:
+                # The job is the other worker's now
+                logger.warning(f"Lease of job {job.id} expired, stopped running it")
+            except Exception as e:
+                logger.exception(f"Job {job.id} failed")
+                await fail_job(session, job, repr(e))
+            else:
+                await complete_job(session, job)
+
+
+async def run_worker(concurrency: int) -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    # Finish in-flight runs on shutdown, unclaimed jobs stay queued
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+    # Connect to watsonx while the first jobs are claimed
+    loop.run_in_executor(None, warm_up)
+
+    logger.info(f"Worker started with {concurrency} concurrent runs")
+    await asyncio.gather(*(worker_loop(stop) for _ in range(concurrency)))
+    await aclose_checkpointer()
+    await async_engine.dispose()
+    logger.info("Worker stopped")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Execute queued agent runs")
+    parser.add_argument(
+        "--concurrency", type=int, default=settings.AGENT_WORKER_CONCURRENCY
+    )
+    args = parser.parse_args()
+    asyncio.run(run_worker(args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
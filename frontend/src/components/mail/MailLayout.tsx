@@ -2,8 +2,9 @@ import { useRef, useState } from "react";
 import { MailList } from "./MailList";
 import { MailDetail } from "./MailDetail";
 import { Mail } from "./types";
-import { useMutation, useQuery } from "@tanstack/react-query";
+import { useMutation } from "@tanstack/react-query";
 import { AgentService } from "@/client/services";
+import useAgentRunEvents from "@/hooks/useAgentRunEvents";
 import { WorkflowVisualization } from "./WorkflowVisualization";
 
 export function MailLayout() {
@@ -24,13 +25,7 @@ export function MailLayout() {
     setTemplateData(null);
   };
 
-  const { data: agentStatus } = useQuery({
-    queryKey: ["agentStatus", agentRunId.current],
-    queryFn: () =>
-      AgentService.agentGetAgentRun({ runId: agentRunId.current ?? "" }),
-    enabled: !!agentRunId.current,
-    refetchInterval: 1000,
-  });
+  const agentStatus = useAgentRunEvents(agentRunId.current);
 
   console.log(agentStatus);
 
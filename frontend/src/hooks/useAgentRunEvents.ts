@@ -0,0 +1,66 @@
+import { useEffect, useState } from "react";
+
+import { type AgentStatusResponse, OpenAPI, type Step } from "../client";
+
+/**
+ * Live state of an agent run, pushed by the backend as Server-Sent Events
+ * (`GET /agent/{run_id}/events`) until the run is completed or failed.
+ */
+const useAgentRunEvents = (runId: string | undefined) => {
+  const [agentRun, setAgentRun] = useState<AgentStatusResponse | undefined>();
+
+  useEffect(() => {
+    setAgentRun(undefined);
+    if (!runId) {
+      return;
+    }
+
+    const source = new EventSource(
+      `${OpenAPI.BASE}/api/v1/agent/${runId}/events`,
+    );
+    const update = (
+      apply: (run: AgentStatusResponse) => AgentStatusResponse,
+    ) => setAgentRun((run) => (run ? apply(run) : run));
+
+    source.addEventListener("run", (event) => {
+      const run: AgentStatusResponse = JSON.parse(event.data);
+      setAgentRun(run);
+      // The backend ends the stream, without closing EventSource reconnects
+      if (run.status === "completed" || run.status === "failed") {
+        source.close();
+      }
+    });
+    source.addEventListener("step", (event) => {
+      const step: Step = JSON.parse(event.data);
+      update((run) => ({
+        ...run,
+        steps: run.steps.some(({ id }) => id === step.id)
+          ? run.steps.map((existing) =>
+              existing.id === step.id ? step : existing,
+            )
+          : [...run.steps, step],
+      }));
+    });
+    source.addEventListener("status", (event) => {
+      const status = JSON.parse(event.data);
+      update((run) => ({ ...run, ...status }));
+      if (status.status === "failed") {
+        source.close();
+      }
+    });
+    source.addEventListener("token", (event) => {
+      const { text } = JSON.parse(event.data);
+      update((run) => ({ ...run, draft_body: run.draft_body + text }));
+    });
+    source.addEventListener("done", (event) => {
+      update((run) => ({ ...run, ...JSON.parse(event.data) }));
+      source.close();
+    });
+
+    return () => source.close();
+  }, [runId]);
+
+  return agentRun;
+};
+
+export default useAgentRunEvents;